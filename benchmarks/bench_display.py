@@ -0,0 +1,50 @@
+"""GUI thread time per displayed frame: taking the composed frame out of
+shared memory and showing it in a Tk label, either as a PIL image pasted
+through ImageTk or as PPM data read by Tk directly. Needs a display.
+
+    python -m benchmarks.bench_display
+"""
+
+import sys
+import timeit
+import tkinter as tk
+
+import numpy as np
+from PIL import Image
+
+from covid import display
+
+SIZES = {"1080p": (1920, 1080), "4K": (3840, 2160)}
+
+
+def _ms(func, number=20):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1000
+
+
+def main() -> int:
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print(f"Tk is not available: {e}", file=sys.stderr)
+        return 1
+    label = tk.Label(root)
+    label.pack()
+    for label_text, (w, h) in SIZES.items():
+        composed = (np.random.rand(h, w, 3) * 255).astype(np.uint8)  # ring slot
+        timings = []
+        for name, materialize in (("PIL", Image.fromarray), ("PPM", display.ppm_frame)):
+            photo_display = display.PhotoDisplay(label)
+
+            def show():
+                photo_display.show(materialize(composed))
+                root.update_idletasks()
+
+            show()  # create the photo image of this size
+            timings.append(f"{name} {_ms(show):6.2f} ms")
+        print(f"{label_text:>5}: " + ", ".join(timings))
+    root.destroy()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
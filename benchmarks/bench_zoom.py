@@ -0,0 +1,35 @@
+"""Cost of producing one video's part of a 1920x1080 canvas from a cached
+native frame: fitting the whole frame versus magnifying a region of interest,
+which crops the region before scaling it.
+
+    python -m benchmarks.bench_zoom
+"""
+
+import timeit
+
+import numpy as np
+
+from covid import scaling
+
+SIZES = {"1080p": (1920, 1080), "4K": (3840, 2160), "8K": (7680, 4320)}
+CANVAS = (1920, 1080)
+
+
+def _ms(func, number=20):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1000
+
+
+def main():
+    for label, (w, h) in SIZES.items():
+        frame = (np.random.rand(h, w, 3) * 255).astype(np.uint8)
+        fit_wh = scaling.fit_size((w, h), CANVAS)
+        timings = [f"fit {_ms(lambda: scaling.resize_frame(frame, fit_wh), 5):7.2f} ms"]
+        for factor in (1, 4):
+            zoom = scaling.Zoom(factor)
+            ms = _ms(lambda: scaling.zoom_frame(frame, CANVAS, zoom))
+            timings.append(f"{factor}:1 {ms:7.3f} ms")
+        print(f"{label:>5}: " + ", ".join(timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,16 @@
-"""covid.py application launcher."""
+"""covid.py application launcher.
 
-from .covid import main
+``python -m covid metrics ...`` computes metrics without GUI, see covid.batch
+"""
+
+import sys
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["metrics"]:
+        from .batch import main
+
+        sys.exit(main(sys.argv[2:]))
+    else:
+        from .covid import main
+
+        main()
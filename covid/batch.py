@@ -0,0 +1,133 @@
+"""Headless metrics computation:
+
+    python -m covid metrics reference.mp4 distorted1.mp4 distorted2.mp4 ...
+
+Each distorted video is compared with the reference frame by frame, results
+are written next to it in VQMT JSON format, where CoVid looks for them.
+"""
+
+import argparse
+import os
+import pathlib
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import numpy as np
+
+from .metrics import VQMTMetrics, luma, psnr, ssim, write_vqmt_json
+from .video_reader import FfmsReader
+
+HEAD_METRICS = [VQMTMetrics.PSNR_Y, VQMTMetrics.SSIM_Y]
+
+
+def frame_range_metrics(
+    reference: str, distorted: str, start: int, stop: int
+) -> np.ndarray:
+    """Compute PSNR-Y and SSIM-Y for a range of frames
+
+    Args:
+        reference: path to the reference video
+        distorted: path to the distorted video
+        start: first frame
+        stop: frame after the last one
+
+    Returns: (stop - start) x 2 array
+    """
+    # Frame ranges are decoded in parallel by worker processes already
+    ref_reader = FfmsReader(reference, threads=1)
+    dist_reader = FfmsReader(distorted, threads=1)
+    if (dist_reader.enc_width, dist_reader.enc_height) != (
+        ref_reader.enc_width,
+        ref_reader.enc_height,
+    ):
+        dist_reader.update_video_size((ref_reader.enc_width, ref_reader.enc_height))
+    w = min(ref_reader.output_size[0], dist_reader.output_size[0])
+    h = min(ref_reader.output_size[1], dist_reader.output_size[1])
+    values = np.empty((stop - start, len(HEAD_METRICS)))
+    for row, frame_idx in enumerate(range(start, stop)):
+        ref_y = luma(ref_reader.read_frame(frame_idx, None)[0][:h, :w])
+        dist_y = luma(dist_reader.read_frame(frame_idx, None)[0][:h, :w])
+        values[row] = psnr(ref_y, dist_y), ssim(ref_y, dist_y)
+    return values
+
+
+def compute_metrics(
+    reference: str, distorted: str, executor: ProcessPoolExecutor, jobs: int
+) -> np.ndarray:
+    """Compute metrics of the whole video, sharded by frame ranges
+
+    Args:
+        reference: path to the reference video
+        distorted: path to the distorted video
+        executor: process pool
+        jobs: number of worker processes
+
+    Returns: frames x 2 array, empty if either video has no frames
+    """
+    # Indexing here also fills the index cache for the workers
+    length = min(FfmsReader(reference).get_length(), FfmsReader(distorted).get_length())
+    if length == 0:
+        return np.empty((0, len(HEAD_METRICS)))
+    shard = max(1, -(-length // (jobs * 4)))
+    starts = range(0, length, shard)
+    futures = [
+        executor.submit(
+            frame_range_metrics, reference, distorted, start, min(start + shard, length)
+        )
+        for start in starts
+    ]
+    return np.concatenate([future.result() for future in futures])
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m covid metrics",
+        description="Compute PSNR-Y and SSIM-Y of videos against the reference "
+        "and save them in VQMT JSON format next to the videos",
+    )
+    parser.add_argument("reference", help="reference video")
+    parser.add_argument("distorted", nargs="+", help="videos to compare")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes"
+    )
+    parser.add_argument(
+        "--overwrite", action="store_true", help="replace existing JSON files"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        FfmsReader(args.reference)
+    except Exception as e:  # ffms2 reports unreadable files in different ways
+        print(f"Can't open {args.reference}: {e}", file=sys.stderr)
+        return 1
+
+    status = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for distorted in args.distorted:
+            output = pathlib.Path(distorted).with_suffix(".json")
+            if output.exists() and not args.overwrite:
+                print(f"{output} exists, use --overwrite to replace", file=sys.stderr)
+                status = 1
+                continue
+            start_time = time.perf_counter()
+            try:
+                values = compute_metrics(args.reference, distorted, executor, args.jobs)
+            except Exception as e:
+                print(f"Can't compare {distorted}: {e}", file=sys.stderr)
+                status = 1
+                continue
+            elapsed = time.perf_counter() - start_time
+            if len(values) == 0:
+                print(f"{distorted}: no frames to compare", file=sys.stderr)
+                status = 1
+                continue
+            write_vqmt_json(
+                output, HEAD_METRICS, values, files=[args.reference, distorted]
+            )
+            print(
+                f"{distorted}: {len(values)} frames in {elapsed:.1f} s "
+                f"({len(values) / elapsed:.1f} frames/s) -> {output}"
+            )
+    return status
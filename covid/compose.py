@@ -1,12 +1,156 @@
+import functools
 import os
-from typing import Tuple
+import re
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
 
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
+from . import yuv
+
 Frame = np.ndarray
 
 
+@functools.lru_cache(maxsize=64)
+def load_font(font: str, size: int) -> ImageFont.FreeTypeFont:
+    """Load TrueType font once per (font, size)
+
+    Args:
+        font: ttf name without extension
+        size: font size
+
+    Returns: font object
+    """
+    return ImageFont.truetype(font + ".ttf", size=size)
+
+
+_measure_draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+
+def text_size(font: ImageFont.FreeTypeFont, text: str) -> Tuple[int, int]:
+    """Size of (possibly multiline) text drawn at (0, 0)"""
+    _, _, w, h = _measure_draw.multiline_textbbox((0, 0), text, font=font)
+    return w, h
+
+
+class TextSprite(NamedTuple):
+    """RGBA image of a single-color text, stored as its visible pixels"""
+
+    size_wh: Tuple[int, int]
+    color: np.ndarray  # (3,) uint8
+    opaque: np.ndarray  # flat indices of fully opaque pixels
+    edge: np.ndarray  # flat indices of antialiased pixels
+    inverse_alpha: np.ndarray  # (len(edge), 1) 255 - alpha of edge pixels
+    premultiplied: np.ndarray  # (len(edge), 3) color * alpha + 128 (rounding)
+
+
+_LINE_SPACING = 4  # pixels between lines, as in PIL multiline text
+# Numbers are drawn glyph by glyph, everything else (labels) as whole pieces
+_TEXT_PIECES = re.compile(r"[0-9.\-]|[^0-9.\-]+")
+
+
+@functools.lru_cache(maxsize=512)
+def _piece_mask(piece: str, font: str, size: int) -> Tuple[np.ndarray, float]:
+    """Alpha mask of a piece of a line drawn at its origin (left, ascender)
+
+    Returns: (mask, advance width of the piece)
+    """
+    pil_font = load_font(font, size)
+    ascent, descent = pil_font.getmetrics()
+    _, _, right, bottom = pil_font.getbbox(piece)
+    mask = Image.new("L", (max(right, 1), max(ascent + descent, bottom, 1)))
+    ImageDraw.Draw(mask).text((0, 0), piece, font=pil_font, fill=255)
+    return np.asarray(mask), pil_font.getlength(piece)
+
+
+def _text_mask(text: str, font: str, size: int, align: str) -> np.ndarray:
+    """Alpha mask of (possibly multiline) text assembled from cached piece
+    masks, laid out as PIL multiline text. Text with new values is drawn
+    without PIL
+
+    Returns: (height, width) uint8 array
+    """
+    line_spacing = load_font(font, size).getbbox("A")[3] + _LINE_SPACING
+    lines = []
+    for line in text.split("\n"):
+        pieces = [
+            _piece_mask(piece, font, size) for piece in _TEXT_PIECES.findall(line)
+        ]
+        offsets = np.cumsum([0.0] + [advance for _, advance in pieces])
+        lines.append((pieces, offsets))
+    max_width = max(offsets[-1] for _, offsets in lines)
+    placed = []  # (x, y, mask)
+    for i, (pieces, offsets) in enumerate(lines):
+        left = {"left": 0.0, "center": 0.5, "right": 1.0}[align] * (
+            max_width - offsets[-1]
+        )
+        for (mask, _), offset in zip(pieces, offsets):
+            placed.append((int(round(left + offset)), i * line_spacing, mask))
+    w = max([x + mask.shape[1] for x, _, mask in placed], default=1)
+    h = max([y + mask.shape[0] for _, y, mask in placed], default=1)
+    result = np.zeros((h, w), dtype=np.uint8)
+    for x, y, mask in placed:
+        region = result[y : y + mask.shape[0], x : x + mask.shape[1]]
+        np.maximum(region, mask, out=region)
+    return result
+
+
+@functools.lru_cache(maxsize=32)
+def text_sprite(
+    text: str, font: str, size: int, color: Tuple[int, int, int], align: str
+) -> TextSprite:
+    """Text turned into a sprite of its own size, so that drawing it over
+    frames does not involve PIL. Labels and digits are rendered once and
+    reused by the following texts (see _text_mask)
+
+    Args:
+        text: (possibly multiline) text
+        font: ttf name without extension
+        size: font size
+        color: text color
+        align: "left", "center" or "right" alignment of the lines
+
+    Returns: sprite for blend_sprite
+    """
+    mask = _text_mask(text, font, size, align)
+    alpha = mask.reshape(-1)
+    edge = np.flatnonzero(alpha - np.uint8(1) < 254).astype(np.int32)
+    edge_alpha = alpha[edge, None].astype(np.uint16)
+    return TextSprite(
+        size_wh=(mask.shape[1], mask.shape[0]),
+        color=np.array(color, dtype=np.uint8),
+        opaque=np.flatnonzero(alpha == 255).astype(np.int32),
+        edge=edge,
+        inverse_alpha=255 - edge_alpha,
+        premultiplied=edge_alpha * np.array(color, dtype=np.uint16) + 128,
+    )
+
+
+def blend_sprite(region: Frame, sprite: TextSprite):
+    """Alpha blend the sprite over the RGB region in place
+
+    Args:
+        region: (height, width, 3) part of a frame of the sprite size or
+            smaller (sprite is cropped then)
+        sprite: result of text_sprite
+    """
+    w, h = sprite.size_wh
+    if region.shape[:2] != (h, w):
+        padded = np.zeros((h, w, 3), dtype=np.uint8)
+        padded[: region.shape[0], : region.shape[1]] = region
+        blend_sprite(padded, sprite)
+        region[...] = padded[: region.shape[0], : region.shape[1]]
+        return
+    in_place = region.flags.c_contiguous
+    pixels = np.ascontiguousarray(region).reshape(-1, 3)
+    pixels[sprite.opaque] = sprite.color
+    blended = pixels[sprite.edge] * sprite.inverse_alpha + sprite.premultiplied
+    pixels[sprite.edge] = (blended + (blended >> 8)) >> 8  # divided by 255
+    if not in_place:
+        region[...] = pixels.reshape(region.shape)
+
+
 class FontConfig:
     def __init__(
         self,
@@ -37,41 +181,81 @@ class FontConfig:
         self._determine_optimal_font_size(canvas_size_wh, sample_text)
 
     def _determine_optimal_font_size(self, canvas_size_wh, sample_text: str):
-        max_font_size = 100
-        desired_h = canvas_size_wh[1] * self.rel_max_size[0]
-        desired_w = canvas_size_wh[0] * self.rel_max_size[1]
-        for font_size in range(1, max_font_size + 1, 2):
-            font = ImageFont.truetype(self.font + ".ttf", size=font_size)
-            w, h = font.getsize(sample_text)
-            if w > desired_w or h > desired_h:
-                self.optimal_font_size = font_size - 1
-                return
-        self.optimal_font_size = max_font_size
+        self.optimal_font_size = fit_font_size(
+            tuple(canvas_size_wh), sample_text, self.font, tuple(self.rel_max_size)
+        )
+
+
+@functools.lru_cache(maxsize=256)
+def fit_font_size(
+    canvas_size_wh: Tuple[int, int],
+    sample_text: str,
+    font: str,
+    rel_max_size: Tuple[float, float],
+    max_font_size: int = 100,
+) -> int:
+    """Largest font size at which sample text fits into the given part of
+    the canvas. Text size is nearly proportional to font size, so it is
+    measured once at the maximum size and the estimate is corrected by
+    a couple of measurements
+
+    Args:
+        canvas_size_wh: Size of the canvas on the main window
+        sample_text: Text used to calculate font size
+        font: ttf name
+        rel_max_size: fraction of the full frame to be filled with text
+        max_font_size: upper limit of the font size
+
+    Returns: font size (at least 1)
+    """
+    desired_h = canvas_size_wh[1] * rel_max_size[0]
+    desired_w = canvas_size_wh[0] * rel_max_size[1]
+
+    def fits(font_size):
+        w, h = text_size(load_font(font, font_size), sample_text)
+        return w <= desired_w and h <= desired_h
+
+    w, h = text_size(load_font(font, max_font_size), sample_text)
+    scale = min(desired_w / max(w, 1), desired_h / max(h, 1))
+    font_size = max(1, min(int(max_font_size * scale), max_font_size))
+    while font_size > 1 and not fits(font_size):
+        font_size -= 1
+    while font_size < max_font_size and fits(font_size + 1):
+        font_size += 1
+    return font_size
+
+
+@functools.lru_cache(maxsize=4)
+def _black_frame(shape: Tuple[int, ...]) -> Frame:
+    """Read-only black frame used in place of a missing video"""
+    frame = np.zeros(shape, dtype=np.uint8)
+    frame.flags.writeable = False
+    return frame
 
 
 def _check_frame_pair_is_correct(left_frame: Frame, right_frame: Frame):
     if left_frame is None and right_frame is None:
-        return np.zeros(shape=(1, 1, 3), dtype=np.uint8), np.zeros(
-            shape=(1, 1, 3), dtype=np.uint8
-        )
+        return _black_frame((1, 1, 3)), _black_frame((1, 1, 3))
     if left_frame is None:
-        return np.zeros_like(right_frame), right_frame
+        return _black_frame(right_frame.shape), right_frame
     if right_frame is None:
-        return left_frame, np.zeros_like(left_frame)
+        return left_frame, _black_frame(left_frame.shape)
     assert (
-        len(left_frame.shape) == 3 and left_frame.shape[-1] == 3
-    ), "Frames are expected to be 3-channel colored images"
+        left_frame.ndim == 3 and left_frame.shape[-1] == right_frame.shape[-1]
+    ), "Frames are expected to be (height, width, channels) images"
     if left_frame.shape != right_frame.shape:
-        smallest = min(left_frame.shape, right_frame.shape)
-        return (
-            left_frame[: smallest[0], : smallest[1]],
-            right_frame[: smallest[0], : smallest[1]],
-        )
+        h = min(left_frame.shape[0], right_frame.shape[0])
+        w = min(left_frame.shape[1], right_frame.shape[1])
+        return left_frame[:h, :w], right_frame[:h, :w]
     return left_frame, right_frame
 
 
 def compose_vertical_split(
-    left_frame: Frame, right_frame: Frame, left_fraction: float = 0.50
+    left_frame: Frame,
+    right_frame: Frame,
+    left_fraction: float = 0.50,
+    out=None,
+    threshold: Optional[int] = None,
 ):
     """Perform composition using vertical split method
 
@@ -80,19 +264,40 @@ def compose_vertical_split(
         right_frame
         left_fraction: Fraction of left frame used in composition
     (remainder is the right frame)
+        out: Preallocated output frame of the same shape
+        threshold: column of the split in pixels, overrides left_fraction
 
     Returns:
 
     """
     left_frame, right_frame = _check_frame_pair_is_correct(left_frame, right_frame)
-    merged_frame = np.copy(right_frame)
-    threshold = int(left_fraction * left_frame.shape[1])
-    merged_frame[:, :threshold] = left_frame[:, :threshold]
-    return merged_frame
+    if out is None:
+        out = np.empty_like(left_frame)
+    if threshold is None:
+        threshold = int(left_fraction * left_frame.shape[1])
+    out[:, :threshold] = left_frame[:, :threshold]
+    out[:, threshold:] = right_frame[:, threshold:]
+    return out
+
+
+@functools.lru_cache(maxsize=16)
+def _chess_cells(h: int, w: int, cell_width: int):
+    """Cells of the chess pattern as (rows, columns, whether it is a left
+    frame cell) slices, so that composition is a set of block copies"""
+    cells = []
+    for i, y in enumerate(range(0, h, cell_width)):
+        for j, x in enumerate(range(0, w, cell_width)):
+            rows, cols = slice(y, y + cell_width), slice(x, x + cell_width)
+            cells.append((rows, cols, (i + j) % 2 == 0))
+    return tuple(cells)
 
 
 def compose_chess_pattern(
-    left_frame: Frame, right_frame: Frame, cell_size: float = 0.25
+    left_frame: Frame,
+    right_frame: Frame,
+    cell_size: float = 0.25,
+    out: Frame = None,
+    cell_width: Optional[int] = None,
 ):
     """Perform composition using chess method
 
@@ -100,26 +305,65 @@ def compose_chess_pattern(
         left_frame: top left tile
         right_frame
         cell_size: Size of each cell relative to frame height
+        out: Preallocated output frame of the same shape
+        cell_width: size of each cell in pixels, overrides cell_size
 
     Returns:
 
     """
     left_frame, right_frame = _check_frame_pair_is_correct(left_frame, right_frame)
     h, w, _ = left_frame.shape
-    cell_width = int(h * cell_size)
-    unit = np.repeat(
-        np.repeat([[1, 0], [0, 1]], cell_width, axis=0), cell_width, axis=1
-    )
-    chess_pattern = np.tile(unit, (h // cell_width + 1, w // cell_width + 1))[
-        :h, :w, np.newaxis
-    ]
-    frame = np.where(chess_pattern, left_frame, right_frame)
-    return frame
+    if out is None:
+        out = np.empty_like(left_frame)
+    if cell_width is None:
+        cell_width = max(int(h * cell_size), 1)
+    for rows, cols, is_left in _chess_cells(h, w, cell_width):
+        out[rows, cols] = (left_frame if is_left else right_frame)[rows, cols]
+    return out
+
+
+def compose_side_by_side(left_frame: Frame, right_frame: Frame, out: Frame = None):
+    """Put frames next to each other
+
+    Args:
+        left_frame
+        right_frame
+        out: Preallocated output frame, twice as wide as the inputs
 
+    Returns:
+
+    """
+    left_frame, right_frame = _check_frame_pair_is_correct(left_frame, right_frame)
+    h, w, c = left_frame.shape
+    if out is None:
+        out = np.empty((h, 2 * w, c), dtype=left_frame.dtype)
+    out[:, :w] = left_frame
+    out[:, w:] = right_frame
+    return out
 
-def compose_side_by_side(left_frame: Frame, right_frame: Frame):
-    _check_frame_pair_is_correct(left_frame, right_frame)
-    return np.hstack((left_frame, right_frame))
+
+compose_functions = {
+    "split": compose_vertical_split,
+    "sbs": compose_side_by_side,
+    "chess": compose_chess_pattern,
+}
+
+
+def i420_plane_options(compose_func, h: int, w: int) -> Tuple[dict, dict]:
+    """Keyword arguments of compose_func for the Y plane and for the U and V
+    planes of (h, w) I420 frames. The split column and the chess cell are
+    computed once from the luma size and rounded to even, so that chroma
+    boundaries line up with luma ones
+
+    Returns: (luma options, chroma options)
+    """
+    if compose_func is compose_vertical_split:
+        threshold = int(0.5 * w) // 2 * 2
+        return {"threshold": threshold}, {"threshold": threshold // 2}
+    if compose_func is compose_chess_pattern:
+        cell_width = max(int(h * 0.25) // 2 * 2, 2)
+        return {"cell_width": cell_width}, {"cell_width": cell_width // 2}
+    return {}, {}
 
 
 class Composer:
@@ -127,51 +371,47 @@ class Composer:
         self,
         compose_type: str,
         font_config: FontConfig,
-        metrics: dict,
+        metrics: List = (),
         canvas_size_wh=None,
     ):
-        if compose_type == "split":
-            self.compose_func = compose_vertical_split
-        elif compose_type == "sbs":
-            self.compose_func = compose_side_by_side
-        elif compose_type == "chess":
-            self.compose_func = compose_chess_pattern
-        else:
+        if compose_type not in compose_functions:
             raise NotImplementedError("Unknown backend!")
+        self.compose_func = compose_functions[compose_type]
         self.font_config = font_config
-        self.font = ImageFont.truetype(
-            self.font_config.font + ".ttf", size=self.font_config.optimal_font_size
-        )
+        self.font = load_font(self.font_config.font, self.font_config.optimal_font_size)
         self.canvas_size_wh = canvas_size_wh
         self.metrics = metrics
+        self.out_buffer: Frame = None
+        self.yuv_buffer: Frame = None  # composed I420 frame before conversion
 
-    def _compose_overlay_text(self, info_text, merged_frame: Image.Image):
-        img = merged_frame
-        img_draw = ImageDraw.Draw(img, mode="RGB")
-        text_w, text_h = self.font.getsize_multiline(info_text)
-        possible_xy_size = (
-            max(merged_frame.size[0] - text_w + 1, 1),
-            max(merged_frame.size[1] - text_h + 1, 1),
-        )
-        final_xy_pos = (
-            int(possible_xy_size[0] * self.font_config.location[1]),
-            int(possible_xy_size[1] * self.font_config.location[0]),
-        )
-
+    def _compose_overlay_text(self, info_text, merged_frame: Frame):
+        """Draw text over the frame in place: blend the cached sprite of the
+        text into the region under it"""
         if self.font_config.location[1] < 0.25:
             align = "left"
         elif self.font_config.location[1] > 0.75:
             align = "right"
         else:
             align = "center"
-        img_draw.multiline_text(
-            final_xy_pos,
+        sprite = text_sprite(
             info_text,
-            font=self.font,
-            align=align,
-            fill=self.font_config.color,
+            self.font_config.font,
+            self.font_config.optimal_font_size,
+            tuple(self.font_config.color),
+            align,
         )
-        return img
+        text_w, text_h = sprite.size_wh
+        frame_h, frame_w = merged_frame.shape[:2]
+        possible_xy_size = (
+            max(frame_w - text_w + 1, 1),
+            max(frame_h - text_h + 1, 1),
+        )
+        x, y = (
+            int(possible_xy_size[0] * self.font_config.location[1]),
+            int(possible_xy_size[1] * self.font_config.location[0]),
+        )
+        blend_sprite(merged_frame[y : y + text_h, x : x + text_w], sprite)
+        return merged_frame
 
     def format_text(self):
         rows = []
@@ -182,27 +422,121 @@ class Composer:
             rows.append(f"{label}: {left} vs. {right}")
         return "\n".join(rows)
 
+    @staticmethod
+    def _unpack(left_frame, right_frame):
+        return _check_frame_pair_is_correct(
+            left_frame[0] if left_frame is not None else None,
+            right_frame[0] if right_frame is not None else None,
+        )
+
+    def output_shape(self, left_frame, right_frame) -> Tuple[int, int, int]:
+        """Shape of the (RGB) frame composed from these reader outputs
+
+        Args:
+            left_frame: (frame, time delta) or None
+            right_frame: (frame, time delta) or None
+
+        Returns: (height, width, channels)
+        """
+        frames = [f[0] for f in (left_frame, right_frame) if f is not None]
+        if any(yuv.is_i420(frame) for frame in frames):
+            sizes = [yuv.frame_size(frame) for frame in frames]
+            h = min(size[0] for size in sizes) // 2 * 2
+            w = min(size[1] for size in sizes) // 2 * 2
+            c = 3
+        else:
+            h, w, c = self._unpack(left_frame, right_frame)[0].shape
+        if self.compose_func is compose_side_by_side:
+            w *= 2
+        return h, w, c
+
     def compose(
-        self, left_frame: Frame, right_frame: Frame
-    ) -> Tuple[Image.Image, float]:
+        self,
+        left_frame: Frame,
+        right_frame: Frame,
+        metrics: List = None,
+        out: Frame = None,
+    ) -> Tuple[Frame, float]:
         """Performs frame composition, merging two frames and writing text
 
         Args:
-            left_frame
-            right_frame
+            left_frame: (frame, time delta) or None. RGB or I420 frames
+                are accepted, the latter are composed plane by plane and
+                only the result is converted to RGB
+            right_frame: (frame, time delta) or None
+            metrics: list of (metric label, (left score, right score)),
+                replaces the one given to constructor
+            out: Preallocated frame of output_shape to compose into.
+                If not given, composer's own buffer is used, which is
+                overwritten by the next composition
 
         Returns:
-            Tuple of Image and left frame delta timestamp (in msec)
+            Tuple of composed frame and left frame delta timestamp (in msec)
         to the next frame
         """
         left_delta = left_frame[1] if left_frame is not None else 1000 / 24.0
-        left_frame, right_frame = _check_frame_pair_is_correct(
-            left_frame[0] if left_frame is not None else None,
-            right_frame[0] if right_frame is not None else None,
-        )
-        combined_frame = self.compose_func(left_frame, right_frame)
-        combined_frame = Image.fromarray(combined_frame)
+        if out is None:
+            shape = self.output_shape(left_frame, right_frame)
+            if self.out_buffer is None or self.out_buffer.shape != shape:
+                self.out_buffer = np.empty(shape, dtype=np.uint8)
+            out = self.out_buffer
+        if metrics is not None:
+            self.metrics = metrics
+        frames = [f[0] if f is not None else None for f in (left_frame, right_frame)]
+        if any(yuv.is_i420(frame) for frame in frames):
+            if self.yuv_buffer is None or self.yuv_buffer.shape != (
+                out.shape[0] * 3 // 2,
+                out.shape[1],
+            ):
+                self.yuv_buffer = np.empty(
+                    (out.shape[0] * 3 // 2, out.shape[1]), dtype=np.uint8
+                )
+            yuv.compose_i420(
+                self.compose_func,
+                *frames,
+                out,
+                self.yuv_buffer,
+                functools.partial(i420_plane_options, self.compose_func),
+            )
+        else:
+            left_frame, right_frame = self._unpack(left_frame, right_frame)
+            self.compose_func(left_frame, right_frame, out=out)
 
         info_to_display = self.format_text()
-        final_frame = self._compose_overlay_text(info_to_display, combined_frame)
+        final_frame = self._compose_overlay_text(info_to_display, out)
         return final_frame, left_delta
+
+
+_composers = OrderedDict()
+
+
+def get_composer(
+    compose_type: str, font_config: FontConfig, canvas_size_wh=None, max_cached=8
+) -> Composer:
+    """Composer for these settings, reused across frames
+
+    Args:
+        compose_type: "split", "sbs" or "chess"
+        font_config: font configuration
+        canvas_size_wh: size of the canvas on the main window
+        max_cached: number of composers to keep
+
+    Returns: cached or newly created Composer
+    """
+    key = (
+        compose_type,
+        canvas_size_wh,
+        font_config.font,
+        font_config.optimal_font_size,
+        font_config.location,
+        font_config.color,
+    )
+    composer = _composers.get(key)
+    if composer is None:
+        composer = Composer(compose_type, font_config, canvas_size_wh=canvas_size_wh)
+        _composers[key] = composer
+        if len(_composers) > max_cached:
+            _composers.popitem(last=False)
+    else:
+        _composers.move_to_end(key)
+    return composer
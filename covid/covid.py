@@ -1,13 +1,13 @@
 import os
 import gettext
-import time
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, simpledialog, ttk
 from functools import partial
 
-from PIL import ImageTk
+from PIL import Image, ImageTk
 
-from . import video_reader
+from . import display, export, scaling, video_reader
+from .playback import PlaybackClock
 from .metrics import VQMTMetrics
 
 gettext.install("covid", os.path.dirname(__file__))
@@ -40,6 +40,88 @@ class Application(tk.Frame):
         self.make_flexible(self)
 
 
+class ExportDialog(tk.Toplevel):
+    def __init__(self, master, background_export: export.BackgroundExport):
+        """Progress window of a background export with a cancel button
+
+        Args:
+            master: parent window
+            background_export: running export
+        """
+        super().__init__(master)
+        self.title(_("Exporting..."))
+        self.transient(master)
+        self.export = background_export
+        self.label = tk.Label(
+            self, text=os.path.basename(background_export.job.output_path)
+        )
+        self.label.grid(row=0, column=0, padx=8, pady=4, sticky="W")
+        self.progress = ttk.Progressbar(
+            self, length=300, maximum=max(background_export.total, 1)
+        )
+        self.progress.grid(row=1, column=0, padx=8, pady=4, sticky="EW")
+        self.cancel_button = tk.Button(self, text=_("Cancel"), command=self.cancel)
+        self.cancel_button.grid(row=2, column=0, padx=8, pady=4)
+        self.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.poll()
+
+    def poll(self):
+        result = self.export.poll()
+        self.progress.configure(value=self.export.done)
+        if result is None:
+            self.after(100, self.poll)
+            return
+        self.destroy()
+        if result[0] == "error":
+            messagebox.showerror(_("Export failed"), result[1])
+
+    def cancel(self):
+        self.cancel_button.configure(state=tk.DISABLED)
+        self.export.cancel()
+
+
+class GifOptionsDialog(simpledialog.Dialog):
+    def __init__(self, master, first: int, last: int, start: int, max_size: int):
+        """Asks for the frame range and size of the GIF
+
+        Args:
+            master: parent window
+            first: first frame allowed
+            last: last frame allowed
+            start: initial first frame
+            max_size: initial maximum width and height
+        """
+        self.limits = (first, last)
+        self.start = tk.IntVar(value=start)
+        self.stop = tk.IntVar(value=min(start + 99, last))
+        self.max_size = tk.IntVar(value=max_size)
+        self.result = None
+        super().__init__(master, _("Save as GIF..."))
+
+    def body(self, master):
+        rows = [
+            (_("From frame"), self.start, self.limits),
+            (_("To frame"), self.stop, self.limits),
+            (_("Maximum size"), self.max_size, (16, 4096)),
+        ]
+        for row, (label, variable, (from_, to)) in enumerate(rows):
+            tk.Label(master, text=label).grid(row=row, column=0, sticky="W")
+            box = tk.Spinbox(master, from_=from_, to=to, textvariable=variable)
+            box.grid(row=row, column=1)
+        return box
+
+    def validate(self):
+        try:
+            start, stop = self.start.get(), self.stop.get()
+            max_size = self.max_size.get()
+        except tk.TclError:
+            return False
+        return self.limits[0] <= start <= stop <= self.limits[1] and max_size > 0
+
+    def apply(self):
+        self.result = (self.start.get(), self.stop.get() + 1, self.max_size.get())
+
+
 class App(Application):
     def __init__(self, *args, **kwargs):
         super(App, self).__init__(*args, **kwargs)
@@ -47,11 +129,17 @@ class App(Application):
         self.paused = True
         self.play_cycle_paused = True  # This can differ from paused when we
         # pause video and it needs to load several frames from async video reader
-        self.last_image = None
-        self.last_time = None
+        self.display = display.PhotoDisplay(self.C)
+        self.clock = PlaybackClock()
+        self.last_frame_delta = 1000.0 / 24
         self.resize_delay_counter = 0
         self.last_canvas_size = (self.C.winfo_width(), self.C.winfo_height())
-        self.reader = video_reader.NonBlockingPairReader("split")
+        self.reader = video_reader.NonBlockingPairReader(
+            "split",
+            video_reader.ReaderOptions(native_decode=True),
+            pipeline_depth=3,
+            frame_format="array",
+        )
         self.master.protocol("WM_DELETE_WINDOW", self.handle_close)
         self.metrics = [
             ("PSNR, Y", (tk.BooleanVar(), VQMTMetrics.PSNR_Y)),
@@ -60,6 +148,9 @@ class App(Application):
             ("VMAF v0.6.1, Y", (tk.BooleanVar(), VQMTMetrics.VMAF061_Y)),
         ]
 
+        self.playback_step = tk.IntVar(value=1)
+        self.zoom_factor = tk.IntVar(value=0)  # 0 fits whole frames
+
         self.create_menu()
 
     def create_widgets(self):
@@ -67,6 +158,9 @@ class App(Application):
 
         self.C = tk.Label(self)  # , background="gray75")
         self.C.grid(sticky="NEWS")
+        self.C.bind("<ButtonPress-1>", self.start_panning)
+        self.C.bind("<B1-Motion>", self.pan_zoomed_videos)
+        self.pan_origin = None
         self.controls = tk.Frame(self)
         self.controls.grid(sticky="EWS", row=1)
 
@@ -87,6 +181,14 @@ class App(Application):
             command=self.handle_timeline_change,
         )
         self.timeline.grid(row=0, column=2, sticky="EW")
+        self.timeline.bind("<ButtonPress-1>", self.start_scrubbing)
+        self.timeline.bind("<ButtonRelease-1>", self.stop_scrubbing)
+        self.scrubbing = False
+        self.resume_after_scrubbing = False
+        self.timeline.bind("<Motion>", self.show_hover_preview)
+        self.timeline.bind("<Leave>", self.hide_hover_preview)
+        self.hover_window = None
+        self.hover_image = None
 
         self.forward = tk.Button(
             self.controls, text=">", command=partial(self.scroll_both_videos, 1)
@@ -107,6 +209,8 @@ class App(Application):
             command=self.handle_offset_change,
         )
         self.offset_box.grid(row=1, column=2)
+        self.playback_stats = tk.Label(self.controls)
+        self.playback_stats.grid(row=1, column=3, columnspan=2, sticky="E")
 
         self.master.bind("<Configure>", self.handle_resize)
         self.master.bind("<space>", self.toggle_pause)
@@ -217,26 +321,21 @@ class App(Application):
         if (
             self.reader.left_pos is None
             or self.reader.right_pos is None
-            or self.reader.left_pos.is_end()
-            or self.reader.right_pos.is_end()
+            or not self.reader.can_advance()
         ):
-            update_frame_idx = False  # not playing forward
+            update_frame_idx = False  # not playing
 
         frame, left_delta = self.reader.get_next_frame(update_frame_idx, canvas_size_wh)
 
         if update_frame_idx:
             self._sync_progress_bar_with_videos()
 
-        if self.last_image is None or (
-            frame.height != self.last_image.height()
-            or frame.width != self.last_image.width()
-        ):
-            self.last_image = ImageTk.PhotoImage(frame)
-            self.C.configure(image=self.last_image)
-        else:
-            self.last_image.paste(frame)
+        self._show_frame(frame)
         return left_delta if update_frame_idx else None
 
+    def _show_frame(self, frame):
+        self.display.show(frame)
+
     def _update_canvas_image(self):
         if self.play_cycle_paused:  # Otherwise will update itself in video play cycle
             self.video_playback_update()
@@ -264,6 +363,7 @@ class App(Application):
             self._check_start_timer(0)
         else:
             self.paused = True
+            self.clock.stop()
 
     def handle_offset_change(self):
         if self.reader.left_pos is not None and self.reader.right_pos is not None:
@@ -278,21 +378,100 @@ class App(Application):
             self.reader.right_pos.set_playback_frame_position(
                 self.timeline.get() + int(self.offset.get())
             )
+            if self.scrubbing:
+                self._show_scrubbing_preview()
+                return
             self._full_interface_sync()
             self._update_canvas_image()
 
+    def show_hover_preview(self, event):
+        """Show filmstrip thumbnails of the frame under the mouse pointer
+        above the timeline"""
+        if self.reader.left_pos is None or self.reader.right_pos is None:
+            return
+        left_idx = int(float(self.timeline.tk.call(self.timeline, "get", event.x, 0)))
+        preview = self.reader.thumbnail_preview(
+            left_idx, left_idx + int(self.offset.get())
+        )
+        if preview is None:
+            self.hide_hover_preview(event)
+            return
+        if self.hover_window is None:
+            self.hover_window = tk.Toplevel(self)
+            self.hover_window.overrideredirect(True)
+            self.hover_label = tk.Label(self.hover_window, borderwidth=1)
+            self.hover_label.pack()
+        self.hover_image = ImageTk.PhotoImage(Image.fromarray(preview))
+        self.hover_label.configure(image=self.hover_image)
+        x = event.x_root - preview.shape[1] // 2
+        y = self.timeline.winfo_rooty() - preview.shape[0] - 4
+        self.hover_window.geometry(f"+{x}+{y}")
+
+    def hide_hover_preview(self, event):
+        if self.hover_window is not None:
+            self.hover_window.destroy()
+            self.hover_window = None
+            self.hover_image = None
+
+    def start_scrubbing(self, event):
+        """While the timeline is dragged, keyframe previews are shown instead
+        of exact frames"""
+        if self.reader.left_pos is None or self.reader.right_pos is None:
+            return
+        self.scrubbing = True
+        self.resume_after_scrubbing = not self.paused
+        self.paused = True
+        self.clock.stop()
+        self._poll_scrubbing_preview()
+
+    def stop_scrubbing(self, event):
+        if not self.scrubbing:
+            return
+        self.scrubbing = False
+        self._full_interface_sync()
+        self._update_canvas_image()
+        if self.resume_after_scrubbing:
+            self._check_start_timer(0)
+
+    def _show_scrubbing_preview(self):
+        canvas_size_wh = self.C.winfo_width(), self.C.winfo_height()
+        preview = self.reader.read_preview(canvas_size_wh)
+        if preview is not None:
+            self._show_frame(preview[0])
+
+    def _poll_scrubbing_preview(self):
+        """Show previews decoded after the last timeline move"""
+        if self.scrubbing:
+            self._show_scrubbing_preview()
+            self.master.after(40, self._poll_scrubbing_preview)
+
+    def _drop_late_frames(self):
+        """Skip frames the playback is behind the clock by, so that slow
+        decoding or rendering doesn't make the playback drift"""
+        count = self.clock.frames_to_drop(self.last_frame_delta)
+        if count > 0:
+            self.reader.drop_playback_frames(count)
+            self.clock.drop(count, self.last_frame_delta)
+
     def video_playback_update(self):
         """Update function. Handles smooth pause
         (when we have unfinished background tasks,
-        pause is not instant, but keeps everything in sync)
+        pause is not instant, but keeps everything in sync).
+        Frames are presented according to the playback clock: after() only
+        wakes this function up, if it fires too early the current frame stays
+        on screen, if too late the missed frames are dropped
 
         Returns:
 
         """
+        if self.scrubbing:  # previews are shown by the timeline
+            self.play_cycle_paused = True
+            return
         left_no_tasks = self.reader.left_pos is None or self.reader.has_no_tasks()
         right_no_tasks = self.reader.right_pos is None or self.reader.has_no_tasks()
         if self.paused and left_no_tasks and right_no_tasks:
             self.play_cycle_paused = True
+            self.clock.stop()
             self._videos_next_frame(False)
             return
         next_update_time = 1000.0 / 24
@@ -301,26 +480,28 @@ class App(Application):
             and self.reader.left_pos is not None
             and self.reader.right_pos is not None
         ):
-            self.last_time = time.perf_counter()
-            left_delta = self._videos_next_frame()
-            if left_delta is None:
-                self.paused = True
-            else:
-                new_time = time.perf_counter()
-                elapsed_time = (new_time - self.last_time) * 1000
-                next_update_time = max((left_delta - elapsed_time), 0)
-                # print(
-                #     self.last_time, new_time, elapsed_time,
-                #     left_delta, next_update_time
-                # )
-                self.last_time = new_time
+            if not self.clock.is_running():
+                self.clock.start()
+            next_update_time = self.clock.time_to_next_frame()
+            if next_update_time <= 0:
+                self._drop_late_frames()
+                left_delta = self._videos_next_frame()
+                if left_delta is None:
+                    self.paused = True
+                    self.clock.stop()
+                else:
+                    self.clock.present(left_delta)
+                    self.last_frame_delta = left_delta
+                    self.playback_stats.configure(
+                        text=_("{} shown, {} dropped, {} late").format(
+                            self.clock.presented, self.clock.dropped, self.clock.late
+                        )
+                    )
+                next_update_time = self.clock.time_to_next_frame()
         else:
             self._videos_next_frame(False)
         self.play_cycle_paused = False
-        self.master.after(
-            int(next_update_time), self.video_playback_update
-        )  # TODO after() can't be reliably used for frame scheduling.
-        # TODO Better write some compensation logic later for after()
+        self.master.after(max(int(next_update_time), 1), self.video_playback_update)
 
     def _check_start_timer(self, delay):
         if (
@@ -329,6 +510,7 @@ class App(Application):
             and self.paused
         ):
             self.paused = False
+            self.clock.reset()
             if self.play_cycle_paused:
                 self.play_cycle_paused = False
                 self.master.after(int(delay), self.video_playback_update)
@@ -370,8 +552,8 @@ class App(Application):
         file_menu.add_command(label=_("Open left"), command=self.select_left_video)
         file_menu.add_command(label=_("Open right"), command=self.select_right_video)
         file_menu.add_separator()
-        file_menu.add_command(label=_("Save as GIF..."), command=None)
-        file_menu.add_command(label=_("Save as video..."), command=None)
+        file_menu.add_command(label=_("Save as GIF..."), command=self.save_as_gif)
+        file_menu.add_command(label=_("Save as video..."), command=self.save_as_video)
         file_menu.add_separator()
         file_menu.add_command(label=_("Exit"), command=self.handle_close)
         menu_bar.add_cascade(label=_("File"), menu=file_menu)
@@ -387,8 +569,32 @@ class App(Application):
             label=_("Curtain"), command=self.select_composer_type("split")
         )
         view_menu.invoke(0)
+        view_menu.add_separator()
+        for label, factor in ((_("Fit to window"), 0), ("1:1", 1), ("4:1", 4)):
+            view_menu.add_radiobutton(
+                label=label,
+                value=factor,
+                variable=self.zoom_factor,
+                command=self.update_zoom,
+            )
         menu_bar.add_cascade(label=_("View"), menu=view_menu)
 
+        playback_menu = tk.Menu(menu_bar, tearoff=0)
+        for label, step in (
+            (_("Reverse"), -1),
+            ("1x", 1),
+            ("2x", 2),
+            ("4x", 4),
+            ("8x", 8),
+        ):
+            playback_menu.add_radiobutton(
+                label=label,
+                value=step,
+                variable=self.playback_step,
+                command=self.update_playback_step,
+            )
+        menu_bar.add_cascade(label=_("Playback"), menu=playback_menu)
+
         metrics_menu = tk.Menu(menu_bar, tearoff=0)
         for metric_label, (bool_var, query) in self.metrics:
             metrics_menu.add_checkbutton(
@@ -400,14 +606,124 @@ class App(Application):
             )
         menu_bar.add_cascade(label=_("Metrics"), menu=metrics_menu)
 
+    def _export_job(self, output_path: str) -> export.ExportJob:
+        """Export of the whole timeline range with the current view settings"""
+        offset = int(self.offset.get())
+        start = max(-offset, 0)
+        stop = min(
+            self.reader.left_pos.get_length(),
+            self.reader.right_pos.get_length() - offset,
+        )
+        metrics_paths = []
+        for path in (self.reader.left_file, self.reader.right_file):
+            metrics_path = self.reader._video_to_metrics_path(path)
+            metrics_paths.append(str(metrics_path) if metrics_path.exists() else None)
+        return export.ExportJob(
+            left_path=self.reader.left_file,
+            right_path=self.reader.right_file,
+            offset=offset,
+            compose_type=self.reader.composer_type,
+            metrics=list(self.reader.metrics),
+            metrics_paths=tuple(metrics_paths),
+            sample_text=self.reader.sample_text,
+            start=start,
+            stop=stop,
+            output_path=output_path,
+        )
+
+    def save_as_gif(self):
+        if self.reader.left_pos is None or self.reader.right_pos is None:
+            messagebox.showerror(_("Save as GIF..."), _("Open both videos first"))
+            return
+        self.paused = True
+        job = self._export_job("")
+        options = GifOptionsDialog(
+            self,
+            job.start,
+            job.stop - 1,
+            self.reader.left_pos.get_playback_frame_position(),
+            max_size=640,
+        ).result
+        if options is None:
+            return
+        start, stop, max_size = options
+        output_path = filedialog.asksaveasfilename(
+            defaultextension=".gif",
+            initialfile=export.default_output_name(
+                (self.reader.left_file, self.reader.right_file), ".gif"
+            ),
+            filetypes=[("GIF", "*.gif"), (_("All files"), "*")],
+        )
+        if not output_path:
+            return
+        job = job._replace(
+            start=start,
+            stop=stop,
+            output_path=output_path,
+            max_size_wh=(max_size, max_size),
+        )
+        ExportDialog(self, export.BackgroundExport(export.run_gif_export, job))
+
+    def save_as_video(self):
+        if self.reader.left_pos is None or self.reader.right_pos is None:
+            messagebox.showerror(_("Save as video..."), _("Open both videos first"))
+            return
+        if not export.ffmpeg_available():
+            messagebox.showerror(
+                _("Save as video..."), _("ffmpeg is required to export videos")
+            )
+            return
+        output_path = filedialog.asksaveasfilename(
+            defaultextension=".mp4",
+            initialfile=export.default_output_name(
+                (self.reader.left_file, self.reader.right_file), ".mp4"
+            ),
+            filetypes=[(_("Video"), "*.mp4 *.mkv *.avi"), (_("All files"), "*")],
+        )
+        if not output_path:
+            return
+        self.paused = True
+        job = self._export_job(output_path)
+        ExportDialog(self, export.BackgroundExport(export.run_video_export, job))
+
     def select_composer_type(self, composer_type: str):
         def wrapper():
             self.reader.composer_type = composer_type
+            self.reader.update_video_size((self.C.winfo_width(), self.C.winfo_height()))
             self.reader.last_input["read_frame"] = None  # drop cache
             self._update_canvas_image()
 
         return wrapper
 
+    def update_zoom(self):
+        """Apply zoom selected in the menu, keeping the region of interest"""
+        factor = self.zoom_factor.get()
+        if factor == 0:
+            self.reader.set_zoom(None)
+        else:
+            zoom = self.reader.zoom or scaling.Zoom(factor)
+            self.reader.set_zoom(zoom._replace(factor=factor))
+        self._update_canvas_image()
+
+    def start_panning(self, event):
+        self.pan_origin = (event.x, event.y)
+
+    def pan_zoomed_videos(self, event):
+        """Drag the zoomed region of both videos with the mouse"""
+        if self.reader.zoom is None or self.pan_origin is None:
+            return
+        delta = (self.pan_origin[0] - event.x, self.pan_origin[1] - event.y)
+        self.pan_origin = (event.x, event.y)
+        self.reader.pan(delta, (self.C.winfo_width(), self.C.winfo_height()))
+        self._update_canvas_image()
+
+    def update_playback_step(self):
+        """Apply speed selected in the menu. Frame rate of the display stays
+        the same, frames in between are not decoded"""
+        self.reader.set_playback_step(self.playback_step.get())
+        if self.clock.is_running():
+            self.clock.start()
+
     def update_title(self):
         left_file = self.reader.left_file
         right_file = self.reader.right_file
@@ -0,0 +1,83 @@
+"""Showing composed frames in Tk.
+
+PIL images go through ImageTk, which converts RGB to PIL's 4-byte pixels
+first. RGB arrays are passed to Tk as binary PPM data instead: the frame
+is copied out of the shared memory ring once, right after a PPM header
+(see ppm_frame), and handed to Tk as is.
+"""
+
+import tkinter as tk
+from typing import Optional, Union
+
+import numpy as np
+from PIL import Image, ImageTk
+
+
+def ppm_header(height: int, width: int) -> bytes:
+    return b"P6 %d %d 255\n" % (width, height)
+
+
+def ppm_frame(frame: np.ndarray) -> np.ndarray:
+    """Copy of the RGB frame stored in binary PPM data
+
+    Args:
+        frame: (height, width, 3) uint8 array
+
+    Returns: read-only (height, width, 3) array, which ppm_data turns into
+        PPM data without copying
+    """
+    h, w = frame.shape[:2]
+    header = ppm_header(h, w)
+    data = b"".join((header, np.ascontiguousarray(frame).data))
+    return np.frombuffer(data, np.uint8, h * w * 3, len(header)).reshape(h, w, 3)
+
+
+def ppm_data(frame: np.ndarray) -> bytes:
+    """Binary PPM data of the RGB frame, taken as is from frames made by
+    ppm_frame and copied otherwise"""
+    owner = frame
+    while isinstance(owner, np.ndarray) and owner.base is not None:
+        owner = owner.base
+    h, w = frame.shape[:2]
+    header = ppm_header(h, w)
+    if (
+        isinstance(owner, bytes)
+        and len(owner) == len(header) + frame.nbytes
+        and frame.flags.c_contiguous
+        and frame.ctypes.data
+        == np.frombuffer(owner, np.uint8).ctypes.data + len(header)
+    ):
+        return owner
+    return b"".join((header, np.ascontiguousarray(frame).data))
+
+
+class PhotoDisplay:
+    def __init__(self, label: tk.Label):
+        """Shows frames in the label, reusing its photo image
+
+        Args:
+            label: widget to show frames in
+        """
+        self.label = label
+        self.photo: Optional[Union[tk.PhotoImage, ImageTk.PhotoImage]] = None
+
+    def show(self, frame: Union[Image.Image, np.ndarray]):
+        """
+        Args:
+            frame: PIL image or (height, width, 3) RGB array, preferably
+                made by ppm_frame
+        """
+        if isinstance(frame, np.ndarray):
+            if not isinstance(self.photo, tk.PhotoImage):
+                self.photo = tk.PhotoImage(master=self.label, format="ppm")
+                self.label.configure(image=self.photo)
+            self.photo.configure(data=ppm_data(frame))  # resizes if needed
+        elif (
+            not isinstance(self.photo, ImageTk.PhotoImage)
+            or frame.height != self.photo.height()
+            or frame.width != self.photo.width()
+        ):
+            self.photo = ImageTk.PhotoImage(frame)
+            self.label.configure(image=self.photo)
+        else:
+            self.photo.paste(frame)
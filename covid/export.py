@@ -0,0 +1,345 @@
+import itertools
+import multiprocessing
+import os
+import pathlib
+import queue
+import shutil
+import subprocess
+import threading
+from fractions import Fraction
+from typing import BinaryIO, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+from . import compose, scaling
+from .metrics import VQMTMetrics, NativeMetrics
+from .video_reader import FfmsReader, decoder_threads
+
+
+class ExportJob(NamedTuple):
+    left_path: str
+    right_path: str
+    offset: int  # right frame index minus left frame index
+    compose_type: str  # "split", "sbs" or "chess"
+    metrics: List[Tuple[str, dict]]  # (label, VQMTMetrics query) to overlay
+    metrics_paths: Tuple[Optional[str], Optional[str]]  # VQMT files of videos
+    sample_text: str  # used to fit overlay font size
+    start: int  # first left frame
+    stop: int  # frame after the last left frame
+    output_path: str
+    max_size_wh: Optional[Tuple[int, int]] = None  # downscale to fit in
+
+
+def _canvas_size(reader: FfmsReader, compose_type: str) -> Tuple[int, int]:
+    if compose_type == "sbs":
+        return 2 * reader.enc_width, reader.enc_height
+    return reader.enc_width, reader.enc_height
+
+
+def composed_frames(
+    job: ExportJob, indices: Iterable[int] = None
+) -> Iterator[np.ndarray]:
+    """Decode and compose frame pairs of the job one by one, at the resolution
+    of the left video (or downscaled to job.max_size_wh)
+
+    Args:
+        job: what to compose
+        indices: left frames to compose instead of job.start ... job.stop
+
+    Returns: iterator over composed frames. Each frame is only valid until
+        the next one is requested
+    """
+    left_reader = FfmsReader(job.left_path, threads=decoder_threads(2))
+    right_reader = FfmsReader(job.right_path, threads=decoder_threads(2))
+    canvas_size_wh = _canvas_size(left_reader, job.compose_type)
+    max_size_wh = job.max_size_wh
+    if max_size_wh is not None:
+        scale = min(
+            max_size_wh[0] / canvas_size_wh[0], max_size_wh[1] / canvas_size_wh[1], 1
+        )
+        canvas_size_wh = (
+            max(int(canvas_size_wh[0] * scale), 1),
+            max(int(canvas_size_wh[1] * scale), 1),
+        )
+    width_multiplier = 0.5 if job.compose_type == "sbs" else 1.0
+    # Frames are decoded at native resolution for metrics and scaled afterwards
+    output_sizes = [
+        reader.fit_output_size(canvas_size_wh, width_multiplier)
+        for reader in (left_reader, right_reader)
+    ]
+
+    vqmt_metrics = []
+    for path in job.metrics_paths:
+        metrics = VQMTMetrics()
+        if path is not None and job.metrics:
+            metrics.load(path)
+        vqmt_metrics.append(metrics)
+    native_metrics = NativeMetrics(max_cached=len(job.metrics) + 1)
+    labels = [label for label, _ in job.metrics]
+    queries = [query for _, query in job.metrics]
+
+    font_config = compose.FontConfig(canvas_size_wh, job.sample_text)
+    composer = compose.Composer(job.compose_type, font_config)
+    if indices is None:
+        indices = range(job.start, job.stop)
+    for left_idx in indices:
+        right_idx = left_idx + job.offset
+        left = left_reader.read_frame(left_idx, canvas_size_wh)
+        right = right_reader.read_frame(right_idx, canvas_size_wh)
+        values = zip(
+            vqmt_metrics[0].query(left_idx, queries),
+            vqmt_metrics[1].query(right_idx, queries),
+        )
+        metrics = native_metrics.fill(
+            list(zip(labels, values)),
+            queries,
+            (left_idx, right_idx),
+            left[0],
+            right[0],
+        )
+        left = (scaling.resize_frame(left[0], output_sizes[0]), left[1])
+        right = (scaling.resize_frame(right[0], output_sizes[1]), right[1])
+        yield composer.compose(left, right, metrics)[0]
+
+
+def frame_rate(video_path: str) -> str:
+    """Frame rate of the video as "numerator/denominator" string"""
+    properties = FfmsReader(video_path, threads=1).vsource.properties
+    return f"{properties.FPSNumerator}/{properties.FPSDenominator}"
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def _write_frames(frames: queue.Queue, stream, errors: list):
+    try:
+        while True:
+            data = frames.get()
+            if data is None:
+                break
+            stream.write(data)
+    except (OSError, ValueError) as e:  # encoder has died
+        errors.append(e)
+        while frames.get() is not None:  # unblock producer
+            pass
+
+
+def run_video_export(
+    job: ExportJob,
+    progress: multiprocessing.Queue,
+    cancel: multiprocessing.Event,
+    queue_size: int = 4,
+):
+    """Compose frames of the job and stream them into ffmpeg. Decoding and
+    composition run in this thread, writing to the encoder in another one,
+    with at most queue_size frames in between
+
+    Args:
+        job: what to export
+        progress: receives ("progress", done, total), then ("done", path),
+            ("cancelled", path) or ("error", message)
+        cancel: set to stop export
+        queue_size: number of composed frames waiting for the encoder
+    """
+    encoder = None
+    try:
+        total = job.stop - job.start
+        frames_iter = composed_frames(job)
+        first = next(frames_iter)
+        # Most encoders need even frame dimensions
+        h, w = first.shape[0] // 2 * 2, first.shape[1] // 2 * 2
+        encoder = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-y",
+                "-loglevel",
+                "error",
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "rgb24",
+                "-s",
+                f"{w}x{h}",
+                "-r",
+                frame_rate(job.left_path),
+                "-i",
+                "-",
+                "-pix_fmt",
+                "yuv420p",
+                job.output_path,
+            ],
+            stdin=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        frames = queue.Queue(maxsize=queue_size)
+        errors = []
+        writer = threading.Thread(
+            target=_write_frames, args=(frames, encoder.stdin, errors)
+        )
+        writer.start()
+        try:
+            for done, frame in enumerate(itertools.chain([first], frames_iter), 1):
+                if cancel.is_set() or errors:
+                    raise _Cancelled()
+                frames.put(np.ascontiguousarray(frame[:h, :w]).tobytes())
+                progress.put(("progress", done, total))
+        finally:
+            frames.put(None)
+            writer.join()
+        encoder.stdin.close()
+        if encoder.wait() != 0 or errors:
+            message = encoder.stderr.read().decode(errors="replace").strip()
+            progress.put(("error", message or str(errors[0])))
+        else:
+            progress.put(("done", job.output_path))
+    except _Cancelled:
+        encoder.kill()
+        encoder.wait()
+        if errors:
+            message = encoder.stderr.read().decode(errors="replace").strip()
+            progress.put(("error", message or str(errors[0])))
+        else:
+            progress.put(("cancelled", job.output_path))
+        try:
+            os.remove(job.output_path)
+        except OSError:
+            pass
+    except Exception as e:
+        if encoder is not None:
+            encoder.kill()
+        progress.put(("error", str(e)))
+
+
+def shared_palette(frames: List[np.ndarray], colors: int = 256) -> Image.Image:
+    """Palette for all frames of a clip, so that quantization of each frame
+    is a cheap lookup and the GIF needs only the global color table
+
+    Args:
+        frames: sample of composed frames of the same size
+        colors: palette size
+
+    Returns: "P" image to be passed to Image.quantize(palette=...)
+    """
+    return Image.fromarray(np.concatenate(frames)).quantize(
+        colors, method=Image.Quantize.MEDIANCUT
+    )
+
+
+class GifWriter:
+    def __init__(self, fp: BinaryIO, palette: Image.Image, duration_ms: float):
+        """Writes looped GIF frame by frame, all of them sharing one palette
+
+        Args:
+            fp: binary file to write to
+            palette: result of shared_palette
+            duration_ms: how long each frame is shown
+        """
+        self.fp = fp
+        self.palette = palette
+        self.duration_ms = duration_ms
+        self.frames_written = 0
+
+    def write(self, frame: np.ndarray):
+        image = Image.fromarray(frame).quantize(palette=self.palette)
+        if self.frames_written == 0:
+            header, _ = GifImagePlugin.getheader(image, info={"loop": 0})
+            self.fp.writelines(header)
+        self.fp.writelines(GifImagePlugin.getdata(image, duration=self.duration_ms))
+        self.frames_written += 1
+
+    def close(self):
+        self.fp.write(b";")  # GIF trailer
+
+
+def run_gif_export(
+    job: ExportJob,
+    progress: multiprocessing.Queue,
+    cancel: multiprocessing.Event,
+    palette_samples: int = 8,
+):
+    """Compose frames of the job and write them into GIF. The palette is
+    computed once from frames evenly sampled from the range
+
+    Args:
+        job: what to export
+        progress: receives ("progress", done, total), then ("done", path),
+            ("cancelled", path) or ("error", message)
+        cancel: set to stop export
+        palette_samples: number of frames to compute palette from
+    """
+    try:
+        duration_ms = 1000 / Fraction(frame_rate(job.left_path))
+        sample_indices = np.unique(
+            np.linspace(job.start, job.stop - 1, palette_samples).astype(int)
+        )
+        palette = shared_palette(
+            [frame.copy() for frame in composed_frames(job, sample_indices)]
+        )
+        total = job.stop - job.start
+        with open(job.output_path, "wb") as fp:
+            writer = GifWriter(fp, palette, float(duration_ms))
+            for done, frame in enumerate(composed_frames(job), 1):
+                if cancel.is_set():
+                    raise _Cancelled()
+                writer.write(frame)
+                progress.put(("progress", done, total))
+            writer.close()
+        progress.put(("done", job.output_path))
+    except _Cancelled:
+        os.remove(job.output_path)
+        progress.put(("cancelled", job.output_path))
+    except Exception as e:
+        progress.put(("error", str(e)))
+
+
+class BackgroundExport:
+    def __init__(self, target, job: ExportJob):
+        """Runs export function in a separate process
+
+        Args:
+            target: run_video_export or compatible function
+            job: what to export
+        """
+        self.job = job
+        self.progress = multiprocessing.Queue()
+        self.cancel_event = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=target, args=(job, self.progress, self.cancel_event), daemon=True
+        )
+        self.done = 0
+        self.total = job.stop - job.start
+        self.result = None  # ("done" | "cancelled" | "error", path or message)
+        self.process.start()
+
+    def poll(self):
+        """Read progress updates
+
+        Returns: None while export is running, final status tuple otherwise
+        """
+        while self.result is None:
+            try:
+                update = self.progress.get_nowait()
+            except queue.Empty:
+                if not self.process.is_alive() and self.progress.empty():
+                    self.result = ("error", "Export process has died")
+                break
+            if update[0] == "progress":
+                _, self.done, self.total = update
+            else:
+                self.result = update
+                self.process.join()
+        return self.result
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+def default_output_name(job_paths: Tuple[str, str], suffix: str) -> str:
+    left, right = (pathlib.Path(path).stem for path in job_paths)
+    return f"{left}_vs_{right}{suffix}"
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+class FrameCache:
+    def __init__(self, budget_bytes: int = 256 * 2**20):
+        """LRU cache of decoded frames bounded by their total size
+
+        Args:
+            budget_bytes: maximum total size of cached frames
+        """
+        self.budget_bytes = budget_bytes
+        self.frames = OrderedDict()
+        self.size = 0
+
+    def __contains__(self, key: Hashable):
+        return key in self.frames
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get(self, key: Hashable) -> Optional[Tuple[np.ndarray, float]]:
+        """
+        Args:
+            key: usually (frame index, output size)
+
+        Returns: (frame, time delta) or None on cache miss
+        """
+        item = self.frames.get(key)
+        if item is not None:
+            self.frames.move_to_end(key)
+        return item
+
+    def put(self, key: Hashable, frame: np.ndarray, time_delta: float):
+        """Store frame, evicting least recently used ones to fit the budget.
+        Frame must not be modified afterwards
+
+        Args:
+            key: usually (frame index, output size)
+            frame: decoded frame
+            time_delta: timestamp delta to the next frame
+        """
+        if frame.nbytes > self.budget_bytes:
+            return
+        old = self.frames.pop(key, None)
+        if old is not None:
+            self.size -= old[0].nbytes
+        self.frames[key] = (frame, time_delta)
+        self.size += frame.nbytes
+        while self.size > self.budget_bytes:
+            _, (evicted, _) = self.frames.popitem(last=False)
+            self.size -= evicted.nbytes
+
+    def clear(self):
+        self.frames.clear()
+        self.size = 0
+
+
+def read_ahead_order(
+    frame_idx: int,
+    length: int,
+    forward: int,
+    backward: int,
+    step: int = 1,
+    available: Optional[Callable[[int], bool]] = None,
+) -> List[int]:
+    """Frames worth decoding in advance after frame_idx has been requested:
+    the following ones first, then the preceding ones, nearest first.
+    In reverse playback (step == -1) the preceding frames are prefetched in
+    chunks of increasing order, so that the decoder seeks once per chunk
+    instead of once per frame. The next chunk is only requested when fewer
+    than `backward` frames preceding frame_idx are available. Faster playback
+    is prefetched by the caller, who knows which frames are shown
+
+    Args:
+        frame_idx: last requested frame
+        length: number of frames in the video
+        forward: how many frames after frame_idx to prefetch
+            (chunk size in reverse playback)
+        backward: how many frames before frame_idx to prefetch
+            (in reverse playback, how many should stay available)
+        step: playback step, frames between displayed ones
+        available: whether the frame is cached or already being prefetched,
+            used in reverse playback
+
+    Returns: list of frame indices, empty in reverse playback if the
+        frames being prefetched are enough
+    """
+    if step == -1:
+        start = frame_idx  # first frame of the available run before frame_idx
+        while available is not None and start > 0 and available(start - 1):
+            start -= 1
+            if frame_idx - start > backward:
+                return []
+        return list(range(max(start - forward, 0), start))
+    if step != 1:
+        return []
+    following = range(frame_idx + 1, min(frame_idx + forward, length - 1) + 1)
+    preceding = range(frame_idx - 1, max(frame_idx - backward, 0) - 1, -1)
+    return list(following) + list(preceding)
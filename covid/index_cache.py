@@ -0,0 +1,120 @@
+import hashlib
+import os
+import pathlib
+from typing import Callable, Optional, Union
+
+PathLike = Union[str, pathlib.Path]
+
+
+def default_cache_dir(name: str = "indexes") -> pathlib.Path:
+    """Directory of the named cache: $XDG_CACHE_HOME/covid/<name>"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join("~", ".cache")
+    return pathlib.Path(base).expanduser() / "covid" / name
+
+
+class IndexCache:
+    suffix = ".ffindex"
+    name = "indexes"  # see default_cache_dir
+
+    def __init__(
+        self,
+        cache_dir: Optional[PathLike] = None,
+        max_size_bytes: int = 512 * 2**20,
+    ):
+        """On-disk cache of ffms2 indexes, keyed by video content identity
+
+        Args:
+            cache_dir: directory to keep indexes in
+                (defaults to $XDG_CACHE_HOME/covid/indexes, looked up when
+                the cache is used)
+            max_size_bytes: total size of cached indexes, least recently
+                used ones are removed when it is exceeded
+        """
+        self._cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+
+    @property
+    def cache_dir(self) -> pathlib.Path:
+        return pathlib.Path(self._cache_dir or default_cache_dir(self.name))
+
+    @staticmethod
+    def key(video_path: PathLike) -> str:
+        """Cache key: resolved path, size and modification time of the video
+
+        Args:
+            video_path: path to the video
+
+        Returns: hex digest identifying this exact file version
+        """
+        path = pathlib.Path(video_path).resolve()
+        stat = path.stat()
+        ident = f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}"
+        return hashlib.sha1(ident.encode("utf-8", "surrogateescape")).hexdigest()
+
+    def path_for(self, video_path: PathLike) -> pathlib.Path:
+        return self.cache_dir / (self.key(video_path) + self.suffix)
+
+    def lookup(self, video_path: PathLike) -> Optional[pathlib.Path]:
+        """Find cached index for the video, marking it as recently used
+
+        Args:
+            video_path: path to the video
+
+        Returns: path to the index file or None on cache miss
+        """
+        try:
+            index_path = self.path_for(video_path)
+            os.utime(index_path)
+        except OSError:
+            return None
+        return index_path
+
+    def store(
+        self, video_path: PathLike, write_func: Callable[[str], None]
+    ) -> Optional[pathlib.Path]:
+        """Put index into the cache
+
+        Args:
+            video_path: path to the video the index belongs to
+            write_func: callable writing the index to the given file name
+
+        Returns: path to the stored index or None if it could not be written
+        """
+        try:
+            index_path = self.path_for(video_path)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = index_path.with_name(f"{index_path.name}.{os.getpid()}.tmp")
+            write_func(str(tmp_path))
+            os.replace(tmp_path, index_path)
+        except OSError:
+            return None
+        self.evict()
+        return index_path
+
+    def invalidate(self, video_path: PathLike):
+        try:
+            self.path_for(video_path).unlink()
+        except OSError:
+            pass
+
+    def evict(self):
+        """Remove least recently used indexes until the cache fits its size limit"""
+        entries = []
+        for entry in self.cache_dir.glob("*" + self.suffix):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda x: x[0]):
+            if total <= self.max_size_bytes:
+                break
+            try:
+                entry.unlink()
+            except OSError:
+                continue
+            total -= size
+
+
+default_index_cache = IndexCache()
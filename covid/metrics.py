@@ -1,7 +1,126 @@
+import hashlib
+import multiprocessing
+import os
 import sys
 import json
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Union
+from typing import List, Union, Optional, Tuple
+
+import numpy as np
+
+from . import yuv
+from .index_cache import default_cache_dir
+
+
+def _query_key(query: dict):
+    return tuple(
+        sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in query.items())
+    )
+
+
+def _values_table(head_metrics: List[dict], values: List[dict]) -> np.ndarray:
+    """Columnar store of VQMT values: frames x columns, NaN where missing"""
+    n_cols = max([metric["col"] + 1 for metric in head_metrics], default=0)
+    table = np.full((len(values), n_cols), np.nan)
+    for i, frame_values in enumerate(values):
+        row = np.array(frame_values["data"][:n_cols], dtype=np.float64)
+        table[i, : len(row)] = row  # null values become NaN
+    return table
+
+
+def sidecar_path(metrics_path: Union[str, Path]) -> Path:
+    """Binary copy of VQMT JSON file, stored in $XDG_CACHE_HOME/covid/metrics
+    under a name derived from the resolved path of the JSON file"""
+    resolved = str(Path(metrics_path).resolve())
+    name = hashlib.sha1(resolved.encode("utf-8", "surrogateescape")).hexdigest()
+    return default_cache_dir("metrics") / (name + ".npz")
+
+
+def _read_sidecar(metrics_path: Union[str, Path]):
+    stat = os.stat(metrics_path)
+    try:
+        with np.load(sidecar_path(metrics_path), allow_pickle=False) as data:
+            if (
+                int(data["source_size"]) != stat.st_size
+                or int(data["source_mtime_ns"]) != stat.st_mtime_ns
+            ):
+                return None  # JSON file has been changed since
+            return json.loads(str(data["head_metrics"])), data["values"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _parse_and_store(metrics_path: Union[str, Path]):
+    """convert_to_sidecar, also telling whether the sidecar has been written"""
+    stat = os.stat(metrics_path)
+    with open(metrics_path, "r") as f:
+        metrics = json.load(f)
+    head_metrics = metrics["head"]["metrics"]
+    values = _values_table(head_metrics, metrics["values"])
+    sidecar = sidecar_path(metrics_path)
+    tmp_path = sidecar.with_name(f"{sidecar.name}.{os.getpid()}.tmp.npz")
+    try:
+        sidecar.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            tmp_path,
+            head_metrics=np.array(json.dumps(head_metrics)),
+            values=values,
+            source_size=np.array(stat.st_size),
+            source_mtime_ns=np.array(stat.st_mtime_ns),
+        )
+        os.replace(tmp_path, sidecar)
+    except OSError:  # read-only location, parse JSON every time
+        return (head_metrics, values), False
+    return (head_metrics, values), True
+
+
+def convert_to_sidecar(metrics_path: Union[str, Path]) -> Tuple[List[dict], np.ndarray]:
+    """Parse VQMT JSON file and store it as .npz sidecar (see sidecar_path),
+    so that later openings don't have to parse JSON
+
+    Args:
+        metrics_path: path to VQMT JSON file
+
+    Returns: (head metrics, values table)
+    """
+    return _parse_and_store(metrics_path)[0]
+
+
+def _convert_in_subprocess(metrics_path: Union[str, Path], conn):
+    """Subprocess part of convert_to_sidecar: sends None when the sidecar has
+    been written, otherwise the parsed metrics or the parsing error, so that
+    the JSON is never parsed twice"""
+    try:
+        loaded, stored = _parse_and_store(metrics_path)
+        conn.send(None if stored else loaded)
+    except (json.JSONDecodeError, OSError, KeyError, ValueError) as e:
+        conn.send(e)
+    finally:
+        conn.close()
+
+
+def _convert_and_read(metrics_path: Union[str, Path]):
+    # Called from a loader thread: forking a threaded process may copy locks
+    # held by other threads into the child, a fresh interpreter is started
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    converter = context.Process(
+        target=_convert_in_subprocess, args=(metrics_path, sender), daemon=True
+    )
+    converter.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:  # converter died, parse here
+        result = convert_to_sidecar(metrics_path)
+    finally:
+        receiver.close()
+        converter.join()
+    if isinstance(result, Exception):
+        raise result
+    return _read_sidecar(metrics_path) if result is None else result
 
 
 class VQMTMetrics:
@@ -13,15 +132,64 @@ class VQMTMetrics:
     VMAF061_Y = dict(metric_name="vmaf", color_component="Y", value_id="VMAF061")
 
     def __init__(self):
-        self.metrics: dict = None
+        self.head_metrics: List[dict] = None
+        self.values: np.ndarray = None  # frames x columns, NaN where missing
+        self.columns = {}  # query key -> column (None if there is no such metric)
+        self._load_id = 0
+        self._loader: threading.Thread = None
+
+    def load(self, metrics_path: Union[str, Path], background: bool = False):
+        """Load VQMT metrics, preferring binary sidecar file (see sidecar_path)
+        over JSON
+
+        Args:
+            metrics_path: path to VQMT JSON file
+            background: load in a background thread, until it is done
+                query returns None values. JSON is parsed in a separate
+                process in this case, so that GUI doesn't stall
+        """
+        self._load_id += 1
+        self.head_metrics = None
+        self.values = None
+        self.columns = {}
+        if background:
+            self._loader = threading.Thread(
+                target=self._load, args=(metrics_path, self._load_id, True), daemon=True
+            )
+            self._loader.start()
+        else:
+            self._load(metrics_path, self._load_id, False)
+
+    def wait(self, timeout: float = None):
+        """Wait for background loading to finish"""
+        if self._loader is not None:
+            self._loader.join(timeout)
 
-    def load(self, metrics_path: Union[str, Path]):
+    def _load(self, metrics_path, load_id, convert_in_subprocess):
         try:
-            with open(metrics_path, "r") as f:
-                self.metrics = json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError) as e:
-            self.metrics = None
+            loaded = _read_sidecar(metrics_path)
+            if loaded is None and convert_in_subprocess:
+                loaded = _convert_and_read(metrics_path)
+            if loaded is None:  # sidecar is gone already
+                loaded = convert_to_sidecar(metrics_path)
+        except (json.JSONDecodeError, OSError, KeyError, ValueError) as e:
             print(f"Can't load metrics from {metrics_path}: {e}", file=sys.stderr)
+            return
+        if load_id == self._load_id:  # otherwise another file is being loaded
+            self._set_metrics(*loaded)
+
+    def _set_metrics(self, head_metrics: List[dict], values: np.ndarray):
+        """Switch to loaded metrics and resolve known metrics
+
+        Args:
+            head_metrics: metrics from head section
+            values: values table, frames x columns
+        """
+        self.head_metrics = head_metrics
+        self.columns = {}
+        for query in (self.PSNR_Y, self.SSIM_Y, self.NIQE_Y, self.VMAF061_Y):
+            self._resolve(query)
+        self.values = values
 
     @staticmethod
     def _get_metric_col(head_metrics: List[dict], query: dict):
@@ -34,12 +202,21 @@ class VQMTMetrics:
         """
         for metric in head_metrics:
             for k, v in query.items():
-                if metric[k] != v:
+                if metric.get(k) != v:
                     break
             else:
                 return metric["col"]
         raise IndexError(query)
 
+    def _resolve(self, query: dict) -> Optional[int]:
+        key = _query_key(query)
+        if key not in self.columns:
+            try:
+                self.columns[key] = self._get_metric_col(self.head_metrics, query)
+            except IndexError:
+                self.columns[key] = None
+        return self.columns[key]
+
     def query(self, frame_idx: int, requested_metrics: List[dict]):
         """
         Return requested metrics for specific frame if exists
@@ -48,14 +225,294 @@ class VQMTMetrics:
             requested_metrics: list of requested metrics
         Returns: list of metrics
         """
-        if self.metrics is None:
+        if self.values is None or frame_idx is None or frame_idx >= len(self.values):
             return [None] * len(requested_metrics)
+        frame_metrics = self.values[frame_idx]
         result = []
-        frame_metrics = self.metrics["values"][frame_idx]["data"]
         for query in requested_metrics:
-            try:
-                col = self._get_metric_col(self.metrics["head"]["metrics"], query)
-                result.append(frame_metrics[col])
-            except IndexError:
-                result.append(None)
+            col = self._resolve(query)
+            value = np.nan if col is None else frame_metrics[col]
+            result.append(None if np.isnan(value) else float(value))
+        return result
+
+    def query_range(
+        self, start: int, stop: int, requested_metrics: List[dict]
+    ) -> np.ndarray:
+        """
+        Return requested metrics for a range of frames
+        Args:
+            start: first frame
+            stop: frame after the last one
+            requested_metrics: list of requested metrics
+        Returns: array of (stop - start) x len(requested_metrics) values,
+            NaN where metric is missing
+        """
+        result = np.full((max(stop - start, 0), len(requested_metrics)), np.nan)
+        if self.values is None:
+            return result
+        rows = self.values[start:stop]
+        for i, query in enumerate(requested_metrics):
+            col = self._resolve(query)
+            if col is not None:
+                result[: len(rows), i] = rows[:, col]
+        return result
+
+
+def write_vqmt_json(
+    metrics_path: Union[str, Path],
+    head_metrics: List[dict],
+    values: np.ndarray,
+    files: List[str] = (),
+):
+    """Write metrics in VQMT JSON format, readable by VQMTMetrics.load
+
+    Args:
+        metrics_path: output JSON path
+        head_metrics: metric descriptions (metric_name, color_component, ...),
+            "col" is assigned by their order
+        values: frames x metrics array, NaN for missing values
+        files: compared files, stored in head section
+    """
+    head = {
+        "files": list(files),
+        "metrics": [dict(metric, col=col) for col, metric in enumerate(head_metrics)],
+    }
+    rows = [
+        {
+            "frame": frame_idx,
+            "data": [None if np.isnan(value) else float(value) for value in row],
+        }
+        for frame_idx, row in enumerate(values)
+    ]
+    with open(metrics_path, "w") as f:
+        json.dump({"head": head, "values": rows}, f)
+
+
+_LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def luma(frame: np.ndarray) -> np.ndarray:
+    """Y component (BT.601 weights) of an RGB frame. Y plane of an I420
+    frame is taken as is
+
+    Args:
+        frame: h x w x 3 RGB frame or I420 frame (see covid.yuv)
+
+    Returns: h x w float32 array
+    """
+    if yuv.is_i420(frame):
+        return yuv.split_i420(frame)[0].astype(np.float32)
+    return frame.astype(np.float32) @ _LUMA_WEIGHTS
+
+
+MAX_PSNR = 100.0  # reported for identical images, as VQMT does
+
+
+def psnr(reference: np.ndarray, distorted: np.ndarray, peak: float = 255.0) -> float:
+    """Peak signal-to-noise ratio in dB, at most MAX_PSNR (identical images)"""
+    diff = reference.astype(np.float64) - distorted
+    mse = np.mean(diff * diff)
+    if mse == 0:
+        return MAX_PSNR
+    return min(float(10 * np.log10(peak * peak / mse)), MAX_PSNR)
+
+
+def _box_mean(image: np.ndarray, window: int) -> np.ndarray:
+    """Means over all window x window blocks, computed with an integral image"""
+    integral = np.zeros((image.shape[0] + 1, image.shape[1] + 1))
+    np.cumsum(np.cumsum(image, axis=0), axis=1, out=integral[1:, 1:])
+    sums = (
+        integral[window:, window:]
+        - integral[:-window, window:]
+        - integral[window:, :-window]
+        + integral[:-window, :-window]
+    )
+    return sums / (window * window)
+
+
+def ssim(
+    reference: np.ndarray, distorted: np.ndarray, window: int = 8, peak: float = 255.0
+) -> float:
+    """Structural similarity with sliding box window
+
+    Args:
+        reference: 2D image
+        distorted: 2D image of the same shape
+        window: window size
+        peak: maximum pixel value
+
+    Returns: mean SSIM
+    """
+    a = reference.astype(np.float64)
+    b = distorted.astype(np.float64)
+    window = min(window, *a.shape)
+    c1 = (0.01 * peak) ** 2
+    c2 = (0.03 * peak) ** 2
+    mu_a, mu_b = _box_mean(a, window), _box_mean(b, window)
+    var_a = _box_mean(a * a, window) - mu_a * mu_a
+    var_b = _box_mean(b * b, window) - mu_b * mu_b
+    cov = _box_mean(a * b, window) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / (
+        (mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2)
+    )
+    return float(ssim_map.mean())
+
+
+class NativeMetrics:
+    """PSNR and SSIM of Y computed on decoded frame pairs, used for the videos
+    which have no VQMT file. Left video is the reference. Frames should be
+    taken at native resolution, pair_key identifies them (e.g. frame indices
+    and file identities). SSIM of a 1080p pair takes a fraction of a second,
+    so interactive callers compute in background (see compute_in_background)
+    and only show cached values"""
+
+    functions = {
+        _query_key(VQMTMetrics.PSNR_Y): psnr,
+        _query_key(VQMTMetrics.SSIM_Y): ssim,
+    }
+
+    def __init__(self, max_cached: int = 4096):
+        self.max_cached = max_cached
+        self.cache = OrderedDict()
+        self._lock = threading.Lock()  # cache is filled by the worker thread
+        self._worker: threading.Thread = None
+        self._finished = []
+
+    def clear(self):
+        with self._lock:
+            self.cache.clear()
+
+    @classmethod
+    def supports(cls, query: dict) -> bool:
+        return _query_key(query) in cls.functions
+
+    def compute(self, query: dict, pair_key, left_frame, right_frame) -> float:
+        """Compute metric of the frame pair, reusing earlier result
+
+        Args:
+            query: VQMTMetrics.PSNR_Y or VQMTMetrics.SSIM_Y
+            pair_key: identifies the pair, e.g. frame indices and size
+            left_frame: reference RGB or I420 frame
+            right_frame: distorted RGB or I420 frame
+
+        Returns: metric value
+        """
+        value = self.cached(query, pair_key)
+        if value is None:
+            left_y, right_y = luma(left_frame), luma(right_frame)
+            h = min(left_y.shape[0], right_y.shape[0])
+            w = min(left_y.shape[1], right_y.shape[1])
+            function = self.functions[_query_key(query)]
+            value = function(left_y[:h, :w], right_y[:h, :w])
+            with self._lock:
+                self.cache[(_query_key(query), pair_key)] = value
+                if len(self.cache) > self.max_cached:
+                    self.cache.popitem(last=False)
+        return value
+
+    def cached(self, query: dict, pair_key) -> Optional[float]:
+        """Metric of the frame pair if it has been computed, otherwise None"""
+        key = (_query_key(query), pair_key)
+        with self._lock:
+            value = self.cache.get(key)
+            if value is not None:
+                self.cache.move_to_end(key)
+        return value
+
+    def compute_in_background(
+        self, queries: List[dict], pair_key, left_frame, right_frame
+    ):
+        """Compute metrics of the frame pair in a worker thread. The pair is
+        reported by finished() when its values are cached
+
+        Args:
+            queries: metrics to compute, see supports
+            pair_key: identifies the pair
+            left_frame: reference RGB or I420 frame, must not change meanwhile
+            right_frame: distorted RGB or I420 frame, must not change meanwhile
+        """
+        self._worker = threading.Thread(
+            target=self._compute_all,
+            args=(queries, pair_key, left_frame, right_frame),
+            daemon=True,
+        )
+        self._worker.start()
+
+    def _compute_all(self, queries, pair_key, left_frame, right_frame):
+        try:
+            for query in queries:
+                self.compute(query, pair_key, left_frame, right_frame)
+        finally:
+            with self._lock:
+                self._finished.append(pair_key)
+
+    def is_busy(self) -> bool:
+        """Whether a background computation is running or its pair is not
+        reported by finished() yet"""
+        with self._lock:
+            if self._finished:
+                return True
+        return self._worker is not None and self._worker.is_alive()
+
+    def finished(self) -> list:
+        """Keys of pairs computed in background since the last call"""
+        with self._lock:
+            finished, self._finished = self._finished, []
+        return finished
+
+    def missing(self, metrics: List, queries: List[dict], pair_key) -> List[dict]:
+        """Supported queries with missing values of the right video, which
+        are not computed yet
+
+        Args:
+            metrics: list of (metric label, (left score, right score))
+            queries: metric query for each row of metrics
+            pair_key: identifies the pair
+
+        Returns: queries to compute
+        """
+        return [
+            query
+            for (_, (_, right_value)), query in zip(metrics, queries)
+            if right_value is None
+            and self.supports(query)
+            and self.cached(query, pair_key) is None
+        ]
+
+    def fill_cached(self, metrics: List, queries: List[dict], pair_key):
+        """Fill missing values of the right video with already computed ones
+
+        Args:
+            metrics: list of (metric label, (left score, right score))
+            queries: metric query for each row of metrics
+            pair_key: identifies the pair
+
+        Returns: metrics, values which are not computed yet are left None
+        """
+        result = []
+        for (label, (left_value, right_value)), query in zip(metrics, queries):
+            if right_value is None and self.supports(query):
+                right_value = self.cached(query, pair_key)
+            result.append((label, (left_value, right_value)))
+        return result
+
+    def fill(self, metrics: List, queries: List[dict], pair_key, left, right):
+        """Fill missing values of the right video with computed ones
+
+        Args:
+            metrics: list of (metric label, (left score, right score))
+            queries: metric query for each row of metrics
+            pair_key: identifies the pair, e.g. frame indices and size
+            left: reference frame or None, preferably at native resolution
+            right: distorted frame or None, preferably at native resolution
+
+        Returns: metrics with missing supported values computed
+        """
+        if left is None or right is None:
+            return metrics
+        result = []
+        for (label, (left_value, right_value)), query in zip(metrics, queries):
+            if right_value is None and self.supports(query):
+                right_value = self.compute(query, pair_key, left, right)
+            result.append((label, (left_value, right_value)))
         return result
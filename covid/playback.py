@@ -0,0 +1,71 @@
+import time
+
+
+class PlaybackClock:
+    def __init__(self, late_threshold_ms: float = 5.0, timer=time.perf_counter):
+        """Presentation clock of the playback. Frame i is due at start time
+        plus the sum of PTS deltas of the previous frames, regardless of how
+        accurately the GUI timer fires
+
+        Args:
+            late_threshold_ms: frame shown later than that is counted as late
+            timer: monotonic clock in seconds
+        """
+        self.late_threshold_ms = late_threshold_ms
+        self.timer = timer
+        self.reset()
+
+    def reset(self):
+        """Stop the clock and clear statistics"""
+        self.stop()
+        self.presented = 0
+        self.dropped = 0
+        self.late = 0
+
+    def start(self):
+        """(Re)start the clock: the next frame is due now"""
+        self.origin = self.timer()
+        self.next_pts_ms = 0.0
+
+    def stop(self):
+        """Stop the clock (on pause), keeping statistics"""
+        self.origin = None
+        self.next_pts_ms = 0.0
+
+    def is_running(self) -> bool:
+        return self.origin is not None
+
+    def time_to_next_frame(self) -> float:
+        """Milliseconds until the next frame is due, negative if it is late"""
+        if self.origin is None:
+            return 0.0
+        return self.next_pts_ms - (self.timer() - self.origin) * 1000
+
+    def frames_to_drop(self, frame_delta_ms: float) -> int:
+        """Number of whole frames the playback is behind the clock
+
+        Args:
+            frame_delta_ms: duration of the frames to be dropped
+
+        Returns: how many frames to skip before presenting the next one
+        """
+        lateness = -self.time_to_next_frame()
+        if lateness <= 0 or frame_delta_ms <= 0:
+            return 0
+        return int(lateness // frame_delta_ms)
+
+    def drop(self, count: int, frame_delta_ms: float):
+        """Skip frames without presenting them"""
+        self.next_pts_ms += count * frame_delta_ms
+        self.dropped += count
+
+    def present(self, frame_delta_ms: float):
+        """Register that the next frame is shown
+
+        Args:
+            frame_delta_ms: PTS delta from this frame to the following one
+        """
+        if -self.time_to_next_frame() > self.late_threshold_ms:
+            self.late += 1
+        self.presented += 1
+        self.next_pts_ms += frame_delta_ms
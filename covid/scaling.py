@@ -0,0 +1,158 @@
+"""Scaling of decoded frames outside of the decoder, so that frames decoded
+once at native resolution can be shown at any size or magnified around
+a region of interest"""
+
+from typing import NamedTuple, Tuple
+
+import numpy as np
+from PIL import Image
+
+from . import yuv
+
+
+def fit_size(
+    frame_wh: Tuple[int, int],
+    canvas_size_wh: Tuple[int, int],
+    width_multiplier: float = 1.0,
+) -> Tuple[int, int]:
+    """Largest size of the frame keeping its aspect ratio that fits the canvas
+
+    Args:
+        frame_wh: (width, height) of the frame
+        canvas_size_wh: target (width, height)
+        width_multiplier: 0.5 for side-by-side view, otherwise 1.0
+
+    Returns: (width, height), at least 1x1
+    """
+    resize_coeff = min(
+        canvas_size_wh[0] * width_multiplier / frame_wh[0],
+        canvas_size_wh[1] / frame_wh[1],
+    )
+    return (
+        max(int(frame_wh[0] * resize_coeff), 1),
+        max(int(frame_wh[1] * resize_coeff), 1),
+    )
+
+
+def _resize_plane(plane: np.ndarray, size_wh: Tuple[int, int]) -> np.ndarray:
+    return np.asarray(Image.fromarray(plane).resize(size_wh, Image.BILINEAR))
+
+
+def _magnify(plane: np.ndarray, factor: int) -> np.ndarray:
+    """Nearest neighbour upscale by an integer factor"""
+    return plane.repeat(factor, axis=0).repeat(factor, axis=1)
+
+
+def resize_frame(frame: np.ndarray, size_wh: Tuple[int, int]) -> np.ndarray:
+    """Bilinear resize of an RGB or I420 frame
+
+    Args:
+        frame: frame to resize, not modified
+        size_wh: target (width, height), even for I420 frames
+
+    Returns: new frame of the target size (the same frame if it already
+        has this size)
+    """
+    h, w = yuv.frame_size(frame)
+    if (w, h) == tuple(size_wh):
+        return frame
+    if yuv.is_i420(frame):
+        y, u, v = yuv.split_i420(frame)
+        chroma_wh = (size_wh[0] // 2, size_wh[1] // 2)
+        return yuv.pack_i420(
+            _resize_plane(y, size_wh),
+            _resize_plane(u, chroma_wh),
+            _resize_plane(v, chroma_wh),
+        )
+    return _resize_plane(frame, size_wh)
+
+
+class Zoom(NamedTuple):
+    factor: int  # displayed pixels per native pixel
+    center: Tuple[float, float] = (0.5, 0.5)  # relative to frame width, height
+
+
+def _clamp(x, left, right):
+    return max(left, min(x, right))
+
+
+def zoom_region(
+    frame_wh: Tuple[int, int], view_wh: Tuple[int, int], zoom: Zoom
+) -> Tuple[int, int, int, int]:
+    """Native pixels shown in the view: the region around zoom.center,
+    moved to lie within the frame
+
+    Args:
+        frame_wh: native (width, height) of the frame
+        view_wh: (width, height) of the view showing the frame
+        zoom: zoom factor and center
+
+    Returns: (x, y, width, height) of the region
+    """
+    w = min(frame_wh[0], -(-view_wh[0] // zoom.factor))
+    h = min(frame_wh[1], -(-view_wh[1] // zoom.factor))
+    x = _clamp(round(zoom.center[0] * frame_wh[0] - w / 2), 0, frame_wh[0] - w)
+    y = _clamp(round(zoom.center[1] * frame_wh[1] - h / 2), 0, frame_wh[1] - h)
+    return x, y, w, h
+
+
+def pan(
+    zoom: Zoom,
+    frame_wh: Tuple[int, int],
+    view_wh: Tuple[int, int],
+    delta_xy: Tuple[float, float],
+) -> Zoom:
+    """Move the zoomed region, keeping it within the frame
+
+    Args:
+        zoom: current zoom
+        frame_wh: native (width, height) of the frame
+        view_wh: (width, height) of the view showing the frame
+        delta_xy: shift of the region in displayed pixels
+
+    Returns: zoom with the new center
+    """
+    x, y, w, h = zoom_region(frame_wh, view_wh, zoom)
+    x = _clamp(x + delta_xy[0] / zoom.factor, 0, frame_wh[0] - w)
+    y = _clamp(y + delta_xy[1] / zoom.factor, 0, frame_wh[1] - h)
+    return zoom._replace(center=((x + w / 2) / frame_wh[0], (y + h / 2) / frame_wh[1]))
+
+
+def zoom_frame(frame: np.ndarray, view_wh: Tuple[int, int], zoom: Zoom) -> np.ndarray:
+    """Crop the zoomed region of a native frame and magnify it. Only the
+    region is copied: an RGB frame at 1:1 is returned as a view
+
+    Args:
+        frame: native RGB or I420 frame
+        view_wh: (width, height) of the view showing the frame
+        zoom: zoom factor and center
+
+    Returns: frame of at most view_wh size, each native pixel shown as
+        zoom.factor x zoom.factor square
+    """
+    h, w = yuv.frame_size(frame)
+    x, y, region_w, region_h = zoom_region((w, h), view_wh, zoom)
+    out_w = min(region_w * zoom.factor, view_wh[0])
+    out_h = min(region_h * zoom.factor, view_wh[1])
+    if yuv.is_i420(frame):
+        # Chroma is subsampled: the region is extended to even coordinates
+        x_end, y_end = (
+            min(x + region_w + 1, w) // 2 * 2,
+            min(y + region_h + 1, h) // 2 * 2,
+        )
+        x, y = x // 2 * 2, y // 2 * 2
+        region_w, region_h = x_end - x, y_end - y
+        out_w, out_h = out_w // 2 * 2, out_h // 2 * 2
+        planes = [
+            plane[y // s : (y + region_h) // s, x // s : (x + region_w) // s]
+            for plane, s in zip(yuv.split_i420(frame), (1, 2, 2))
+        ]
+        if zoom.factor != 1:
+            planes = [_magnify(plane, zoom.factor) for plane in planes]
+        return yuv.pack_i420(
+            *(plane[: out_h // s, : out_w // s] for plane, s in zip(planes, (1, 2, 2)))
+        )
+    region = frame[y : y + region_h, x : x + region_w]
+    if zoom.factor != 1:
+        region = _magnify(region, zoom.factor)
+    return region[:out_h, :out_w]
@@ -0,0 +1,183 @@
+import os
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from typing import NamedTuple, Tuple, List, Optional
+
+import numpy as np
+
+
+class SharedFrame(NamedTuple):
+    """Descriptor of a frame stored in shared memory. Only descriptors are sent
+    through queues, pixels stay in place"""
+
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+    ring: str = ""  # producer's ring, together with slot identifies the slot
+    slot: int = -1
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Map an existing segment without registering it in the resource tracker.
+    Only the owner's registration must exist: the tracker unlinks registered
+    segments when their process dies. Unregistering after attaching is not
+    an option, since the tracker is often shared with the owner (forked or
+    spawned processes inherit it) and that would drop the owner's entry"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        pass
+    from multiprocessing import resource_tracker
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _close(shm: shared_memory.SharedMemory) -> bool:
+    try:
+        shm.close()
+    except BufferError:  # someone still holds a view of this memory
+        return False
+    return True
+
+
+class FrameRing:
+    def __init__(self, slots: int = 4):
+        """Round-robin set of shared memory frame slots, owned by the producer.
+        A slot is overwritten after `slots` more frames are put into the ring,
+        so consumers must be done with a frame by then
+
+        Args:
+            slots: number of slots in the ring
+        """
+        self.slots: List[Optional[shared_memory.SharedMemory]] = [None] * slots
+        self.next_slot = 0
+        self.ring_id = f"{os.getpid()}-{id(self)}"
+
+    def reserve(self, shape: Tuple[int, ...], dtype=np.uint8):
+        """Take the next slot, growing it if needed
+
+        Args:
+            shape: frame shape
+            dtype: frame dtype
+
+        Returns: (SharedFrame descriptor, writable view of the slot)
+        """
+        dtype = np.dtype(dtype)
+        nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        slot_idx = self.next_slot
+        slot = self.slots[slot_idx]
+        if slot is None or slot.size < nbytes:
+            if slot is not None:
+                _close(slot)
+                slot.unlink()
+            slot = shared_memory.SharedMemory(create=True, size=nbytes)
+            self.slots[slot_idx] = slot
+        self.next_slot = (slot_idx + 1) % len(self.slots)
+        view = np.ndarray(shape, dtype=dtype, buffer=slot.buf)
+        descriptor = SharedFrame(
+            slot.name, tuple(shape), dtype.str, self.ring_id, slot_idx
+        )
+        return descriptor, view
+
+    def put(self, frame: np.ndarray) -> SharedFrame:
+        """Copy frame into the next slot
+
+        Args:
+            frame: frame to share
+
+        Returns: descriptor of the shared copy
+        """
+        descriptor, view = self.reserve(frame.shape, frame.dtype)
+        view[...] = frame
+        return descriptor
+
+    def close(self):
+        for slot in self.slots:
+            if slot is not None:
+                _close(slot)
+                slot.unlink()
+        self.slots = [None] * len(self.slots)
+
+
+class SharedFrameReader:
+    def __init__(self, max_attached: int = 16):
+        """Consumer side of FrameRing: maps shared frames into this process
+
+        Args:
+            max_attached: how many segments to keep mapped
+        """
+        self.max_attached = max_attached
+        self.attached = OrderedDict()
+        self.slot_names = {}  # (ring, slot) -> name of the segment mapped last
+        self._closing = []
+
+    def get(self, frame: SharedFrame) -> np.ndarray:
+        """
+        Args:
+            frame: descriptor received from the producer
+
+        Returns: read-only view of the frame (no copy)
+        """
+        shm = self.attached.get(frame.name)
+        if shm is None:
+            old_name = self.slot_names.get((frame.ring, frame.slot))
+            if frame.ring and old_name is not None:
+                self._detach(old_name)  # the slot has been regrown
+            self.slot_names[(frame.ring, frame.slot)] = frame.name
+            shm = _attach(frame.name)
+            self.attached[frame.name] = shm
+            self._release_old()
+        else:
+            self.attached.move_to_end(frame.name)
+        view = np.ndarray(frame.shape, dtype=np.dtype(frame.dtype), buffer=shm.buf)
+        view.flags.writeable = False
+        return view
+
+    def _detach(self, name: str):
+        shm = self.attached.pop(name, None)
+        if shm is not None and not _close(shm):
+            self._closing.append(shm)
+
+    def _release_old(self):
+        self._closing = [shm for shm in self._closing if not _close(shm)]
+        while len(self.attached) > self.max_attached:
+            _, shm = self.attached.popitem(last=False)
+            if not _close(shm):
+                self._closing.append(shm)
+
+    def close(self):
+        for shm in list(self.attached.values()) + self._closing:
+            _close(shm)
+        self.attached.clear()
+        self.slot_names.clear()
+        self._closing = []
+
+
+def to_shared(result, ring: FrameRing):
+    """Replace frames in a command result with their shared memory descriptors
+
+    Args:
+        result: array or tuple possibly containing arrays
+        ring: where to put frames
+
+    Returns: same result with arrays replaced by SharedFrame
+    """
+    if isinstance(result, np.ndarray):
+        return ring.put(result)
+    if isinstance(result, tuple) and not isinstance(result, SharedFrame):
+        return tuple(to_shared(item, ring) for item in result)
+    return result
+
+
+def from_shared(result, reader: SharedFrameReader):
+    """Inverse of to_shared: replaces descriptors with views of the frames"""
+    if isinstance(result, SharedFrame):
+        return reader.get(result)
+    if isinstance(result, tuple):
+        return tuple(from_shared(item, reader) for item in result)
+    return result
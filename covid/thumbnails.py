@@ -0,0 +1,132 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+from .index_cache import IndexCache, PathLike
+
+THUMBNAIL_HEIGHT = 72
+MAX_THUMBNAILS = 2000
+
+
+class ThumbnailCache(IndexCache):
+    suffix = ".npy"
+    name = "thumbnails"
+
+    def __init__(
+        self, cache_dir: Optional[PathLike] = None, max_size_bytes: int = 2**30
+    ):
+        """On-disk cache of filmstrips, keyed by video content identity
+
+        Args:
+            cache_dir: directory to keep filmstrips in
+                (defaults to $XDG_CACHE_HOME/covid/thumbnails, looked up
+                when the cache is used)
+            max_size_bytes: total size of cached filmstrips
+        """
+        super().__init__(cache_dir, max_size_bytes)
+
+
+default_thumbnail_cache = ThumbnailCache()
+
+
+def filmstrip_step(length: int, max_thumbnails: int = MAX_THUMBNAILS) -> int:
+    """Frames between thumbnails of a video with this number of frames"""
+    return max(1, -(-length // max_thumbnails))
+
+
+def _filmstrip_dtype(height: int, width: int) -> np.dtype:
+    return np.dtype([("ready", np.uint8), ("image", np.uint8, (height, width, 3))])
+
+
+def build_filmstrip(
+    reader,
+    video_path: PathLike,
+    cache: ThumbnailCache = default_thumbnail_cache,
+    height: int = THUMBNAIL_HEIGHT,
+):
+    """Decode every filmstrip_step-th frame at thumbnail resolution into
+    a memory-mapped array in the cache. Thumbnails become visible to
+    Filmstrip readers one by one, a partially built filmstrip is completed
+
+    Args:
+        reader: FfmsReader of the video
+        video_path: path to the video
+        cache: where to put the filmstrip
+        height: thumbnail height, width follows the aspect ratio
+    """
+    length = reader.get_length()
+    step = filmstrip_step(length)
+    width = max(1, round(reader.enc_width * height / reader.enc_height))
+    dtype = _filmstrip_dtype(height, width)
+    shape = (-(-length // step),)
+
+    path = cache.path_for(video_path)
+    try:
+        strip = np.load(path, mmap_mode="r+")
+        if strip.dtype != dtype or strip.shape != shape:
+            strip = None
+    except (OSError, ValueError):
+        strip = None
+    if strip is None:
+        cache.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        strip = np.lib.format.open_memmap(tmp_path, "w+", dtype, shape)
+        os.replace(tmp_path, path)
+        cache.evict()
+
+    reader.set_output_size((width, height))
+    for i in range(len(strip)):
+        if not strip["ready"][i]:
+            strip["image"][i] = reader.read_frame(i * step, None)[0]
+            strip["ready"][i] = 1
+    strip.flush()
+
+
+class Filmstrip:
+    def __init__(self, strip: np.ndarray, step: int):
+        """Read-only view of a (possibly still building) filmstrip
+
+        Args:
+            strip: memory-mapped array written by build_filmstrip
+            step: frames between thumbnails
+        """
+        self.strip = strip
+        self.step = step
+
+    @classmethod
+    def open(
+        cls,
+        video_path: PathLike,
+        length: int,
+        cache: ThumbnailCache = default_thumbnail_cache,
+    ) -> Optional["Filmstrip"]:
+        """
+        Args:
+            video_path: path to the video
+            length: number of frames in the video
+            cache: where to look for the filmstrip
+
+        Returns: filmstrip or None if it has not been built yet
+        """
+        try:
+            strip = np.load(cache.path_for(video_path), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        step = filmstrip_step(length)
+        if strip.dtype.names != ("ready", "image") or len(strip) != -(-length // step):
+            return None
+        return cls(strip, step)
+
+    def get(self, frame_idx: int) -> Optional[np.ndarray]:
+        """Thumbnail of the closest frame at or before frame_idx
+
+        Args:
+            frame_idx: frame index
+
+        Returns: thumbnail or None if it is not ready yet
+        """
+        i = min(max(frame_idx, 0) // self.step, len(self.strip) - 1)
+        if not self.strip["ready"][i]:
+            return None
+        return self.strip["image"][i]
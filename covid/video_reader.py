@@ -1,17 +1,27 @@
+import math
 import multiprocessing
+import os
 import threading
+import time
+from collections import deque
 from multiprocessing import Queue
 from queue import Empty
 
 import ffms2
+import numpy as np
 import pathlib
 
 from PIL import Image
 
-from . import compose
-from .metrics import VQMTMetrics
+from . import compose, scaling, yuv
+from .frame_cache import FrameCache, read_ahead_order
+from .display import ppm_frame
+from .index_cache import IndexCache, default_index_cache
+from .metrics import VQMTMetrics, NativeMetrics
+from .thumbnails import Filmstrip, build_filmstrip
+from .shared_frames import FrameRing, SharedFrameReader, to_shared, from_shared
 
-from typing import Union, NamedTuple, Tuple, Callable
+from typing import Union, NamedTuple, Tuple, Callable, Optional, List
 
 main_thread = threading.current_thread()
 
@@ -20,6 +30,16 @@ def _clamp(x, left, right):
     return max(left, min(x, right))
 
 
+def _file_identity(video_path: Union[str, pathlib.Path, None]):
+    """Identifies particular version of the file: path and modification time"""
+    if video_path is None:
+        return None
+    try:
+        return str(video_path), pathlib.Path(video_path).stat().st_mtime_ns
+    except OSError:
+        return str(video_path), None
+
+
 def dummy_func(*args):
     return args
 
@@ -28,6 +48,17 @@ def true_func(*args):
     return True
 
 
+def _nearby_keyframe(keyframes: np.ndarray, target: int, max_distance: int) -> int:
+    """Keyframe closest to target if it is less than max_distance frames
+    away, otherwise target"""
+    i = np.searchsorted(keyframes, target)
+    candidates = keyframes[max(i - 1, 0) : i + 1]
+    if len(candidates) == 0:
+        return target
+    nearest = int(candidates[np.argmin(np.abs(candidates - target))])
+    return nearest if abs(nearest - target) < max_distance else target
+
+
 class VideoOpenException(BaseException):
     pass
 
@@ -54,26 +85,100 @@ class PlaybackPosition:
         return self.next_frame_idx
 
 
+def _load_index(video_path: Union[str, pathlib.Path], cache: Optional[IndexCache]):
+    if cache is not None:
+        index_path = cache.lookup(video_path)
+        if index_path is not None:
+            try:
+                index = ffms2.Index.read(str(index_path), str(video_path))
+                if index.belongs_to_file(str(video_path)):
+                    return index
+            except Exception:  # stale or incompatible index, rebuild it
+                pass
+            cache.invalidate(video_path)
+    indexer = ffms2.Indexer(str(video_path))  # TODO throw error of our type
+    index = indexer.do_indexing2()
+    if cache is not None:
+        cache.store(video_path, index.write)
+    return index
+
+
+def decoder_threads(readers: int = 2) -> int:
+    """Decoding threads per reader, so that readers decoding simultaneously
+    share available cores instead of oversubscribing them
+
+    Args:
+        readers: number of readers decoding at the same time
+
+    Returns: thread count, at least 1
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on Windows and macOS
+        cores = os.cpu_count() or 1
+    return max(1, cores // readers)
+
+
 class FfmsReader:
-    def __init__(self, video_path: Union[str, pathlib.Path]):
-        self.indexer = ffms2.Indexer(str(video_path))  # TODO throw error of our type
-        self.index = self.indexer.do_indexing2()
+    def __init__(
+        self,
+        video_path: Union[str, pathlib.Path],
+        index_cache: Optional[IndexCache] = default_index_cache,
+        threads: int = 0,
+        seek_mode: int = ffms2.FFMS_SEEK_NORMAL,
+        pixel_format: str = "rgb24",
+    ):
+        """
+        Args:
+            video_path: Path to video to read
+            index_cache: Where to look for a previously built index
+                (None disables caching)
+            threads: decoding threads, 0 to use all cores
+            seek_mode: one of ffms2.FFMS_SEEK_* modes: how accurately
+                (and slowly) the decoder seeks
+            pixel_format: "rgb24" for (h, w, 3) RGB frames or "yuv420p"
+                for I420 frames (see covid.yuv), which take half the memory
+        """
+        self.index = _load_index(video_path, index_cache)
         self.track_number = self.index.get_first_indexed_track_of_type(
             ffms2.FFMS_TYPE_VIDEO
         )
-        self.vsource = ffms2.VideoSource(str(video_path), self.track_number, self.index)
+        self.vsource = ffms2.VideoSource(
+            str(video_path),
+            self.track_number,
+            self.index,
+            num_threads=threads or decoder_threads(1),
+            seek_mode=seek_mode,
+        )
+        self.pixel_format = pixel_format
         self.vsource.set_output_format(
-            [ffms2.get_pix_fmt("rgb24")], resizer=ffms2.FFMS_RESIZER_FAST_BILINEAR
+            [ffms2.get_pix_fmt(pixel_format)],
+            resizer=ffms2.FFMS_RESIZER_FAST_BILINEAR,
         )
         self.length = self.vsource.properties.NumFrames
 
         frame = self.vsource.get_frame(0)
         self.enc_width = frame.EncodedWidth
         self.enc_height = frame.EncodedHeight
+        self.output_size = (self.enc_width, self.enc_height)
+        if pixel_format == "yuv420p" and (self.enc_width % 2 or self.enc_height % 2):
+            self.set_output_size((self.enc_width, self.enc_height))
 
     def get_length(self):
         return self.length
 
+    def get_encoded_size(self) -> Tuple[int, int]:
+        """Native (width, height) of the video"""
+        return self.enc_width, self.enc_height
+
+    def get_keyframes(self) -> List[int]:
+        """Indices of keyframes, which are decoded without the preceding frames"""
+        return [
+            idx
+            for idx, info in enumerate(self.vsource.track.frame_info_list)
+            if info.KeyFrame
+        ]
+
     def update_video_size(self, canvas_size_wh, width_multiplier=1.0):
         """Updates internal FFMS scaling method
 
@@ -84,19 +189,34 @@ class FfmsReader:
         Returns:
 
         """
-        resize_coeff = min(
-            canvas_size_wh[0] * width_multiplier / self.enc_width,
-            canvas_size_wh[1] / self.enc_height,
-        )
-        new_shape = (
-            int(self.enc_width * resize_coeff),
-            int(self.enc_height * resize_coeff),
+        self.set_output_size(self.fit_output_size(canvas_size_wh, width_multiplier))
+
+    def fit_output_size(self, canvas_size_wh, width_multiplier=1.0) -> Tuple[int, int]:
+        """Output size update_video_size would set, without setting it"""
+        return self.valid_output_size(
+            scaling.fit_size(
+                (self.enc_width, self.enc_height), canvas_size_wh, width_multiplier
+            )
         )
+
+    def valid_output_size(self, size_wh: Tuple[int, int]) -> Tuple[int, int]:
+        """Size closest to size_wh that frames can be scaled to"""
+        if self.pixel_format == "yuv420p":
+            return max(size_wh[0] // 2 * 2, 2), max(size_wh[1] // 2 * 2, 2)
+        return max(size_wh[0], 1), max(size_wh[1], 1)
+
+    def set_output_size(self, size_wh: Tuple[int, int]):
+        """Scale decoded frames to exactly this (width, height).
+        I420 frames are rounded down to even size"""
+        size_wh = self.valid_output_size(size_wh)
+        if size_wh == self.output_size:
+            return
         self.vsource.set_output_format(
-            width=new_shape[0],
-            height=new_shape[1],
+            width=size_wh[0],
+            height=size_wh[1],
             resizer=ffms2.FFMS_RESIZER_FAST_BILINEAR,
         )
+        self.output_size = size_wh
 
     def read_frame(self, frame_idx, canvas_size_wh):
         """Reads current frame and calculates timestamp delta
@@ -106,7 +226,8 @@ class FfmsReader:
             canvas_size_wh: canvas size. Not used, but is important
                 for caching purposes (invalidates cache on canvas size change)
 
-        Returns: frame, time_delta
+        Returns: frame (a view of decoder's buffer for RGB), time_delta
+            to the next frame in milliseconds, as used everywhere downstream
 
         """
         frame = self.vsource.get_frame(frame_idx)
@@ -117,55 +238,265 @@ class FfmsReader:
         this_frame_delta = (
             frame_info_list[next_frame_idx].PTS - frame_info_list[frame_idx].PTS
         )
+        # ffms2 time base converts PTS to milliseconds
         time_base = self.vsource.track.time_base
         this_frame_delta *= time_base.numerator / time_base.denominator
-        if this_frame_delta < 1e-3:
-            this_frame_delta = 1 / 24
-        array = (
-            frame.planes[0]
-            .reshape((height, frame.Linesize[0]))[:, 0 : (width * 3)]
-            .reshape(height, width, 3)
-        )
+        if this_frame_delta < 1:  # the last frame or broken timestamps
+            this_frame_delta = 1000 / 24
+        if self.pixel_format == "yuv420p":
+            # ffms2 sizes every plane buffer as Linesize * full frame height
+            sizes = ((height, width),) + ((height // 2, width // 2),) * 2
+            planes = [
+                plane[: h * linesize].reshape(h, linesize)[:, :w]
+                for plane, linesize, (h, w) in zip(frame.planes, frame.Linesize, sizes)
+            ]
+            array = yuv.pack_i420(*planes)
+        else:
+            array = (
+                frame.planes[0]
+                .reshape((height, frame.Linesize[0]))[:, 0 : (width * 3)]
+                .reshape(height, width, 3)
+            )
         return array, this_frame_delta
 
 
+def build_filmstrip_in_background(video_path: Union[str, pathlib.Path]):
+    """Process target: generate filmstrip of the video with low priority"""
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+    build_filmstrip(FfmsReader(video_path, threads=1), video_path)
+
+
 class TaskExecuteFlags(NamedTuple):
     skip_to_last: bool  # ignore all except for the last task with this name
     priority: int  # among such tasks, highest priority one will be executed first
 
 
+class ReaderOptions(NamedTuple):
+    cache_budget: int = 256 * 2**20  # bytes of decoded frames kept per reader
+    read_ahead: int = 8  # frames after the requested one decoded while idle
+    read_behind: int = 2  # frames before the requested one decoded while idle
+    ring_slots: int = 3  # shared memory slots for frames sent to the pair reader
+    decoder_threads: int = 0  # per reader, 0 to divide cores between two readers
+    seek_mode: int = ffms2.FFMS_SEEK_NORMAL  # see FfmsReader
+    pixel_format: str = "rgb24"  # "yuv420p" sends I420 frames, see covid.yuv
+    # Decode at native resolution and scale cached frames in the reader
+    # process: resizing the window does not reconfigure the decoder
+    native_decode: bool = False
+
+
 class SingleReaderProxy:
     def __init__(
-        self, video_path: Union[str, pathlib.Path], in_queue: Queue, out_queue: Queue
+        self,
+        video_path: Union[str, pathlib.Path],
+        in_queue: Queue,
+        out_queue: Queue,
+        options: ReaderOptions = ReaderOptions(),
     ):
         self.video_path = video_path
         self.in_queue = in_queue
         self.out_queue = out_queue
+        self.options = options
+        self.reader: FfmsReader = None
+        self.cache = FrameCache(options.cache_budget)
+        self.prefetch_queue = []
+        self.scaled_size = None  # output size with native_decode, None for native
+        self.view_size = None  # canvas area showing the video
+        self.zoom: Optional[scaling.Zoom] = None
+
+    def read_frame(self, frame_idx, canvas_size_wh, playback_step=1, upcoming=()):
+        """FfmsReader.read_frame backed by the frame cache. Schedules read-ahead
+        around the requested frame
+
+        Args:
+            frame_idx: index of frame to read
+            canvas_size_wh: canvas size
+            playback_step: frames between displayed ones during playback,
+                negative for reverse playback. Determines read-ahead direction
+            upcoming: frames shown after this one when playing faster than
+                one frame per step, prefetched instead of the neighbours
+
+        Returns: frame, time_delta
+        """
+        result = self._decode_cached(frame_idx, canvas_size_wh)
+        if abs(playback_step) > 1:
+            order = list(upcoming)
+        else:
+            queued = {idx for idx, _ in self.prefetch_queue}
+            order = read_ahead_order(
+                frame_idx,
+                self.reader.get_length(),
+                self.options.read_ahead,
+                self.options.read_behind,
+                playback_step,
+                lambda idx: idx in queued or self._cache_key(idx) in self.cache,
+            )
+        if order or playback_step != -1:  # reverse: keep prefetching the chunk
+            self.prefetch_queue = [(idx, canvas_size_wh) for idx in order]
+        return result
+
+    def read_preview(self, frame_idx, canvas_size_wh, scale):
+        """Frame at a fraction of the current output size, used while
+        scrubbing. Read-ahead is not changed
+
+        Args:
+            frame_idx: index of frame to read
+            canvas_size_wh: canvas size
+            scale: fraction of the output size
+
+        Returns: frame, time_delta
+        """
+        output_size = self._output_size()
+        self._set_output_size(
+            (int(output_size[0] * scale), int(output_size[1] * scale))
+        )
+        try:
+            return self._decode_cached(frame_idx, canvas_size_wh)
+        finally:
+            self._set_output_size(output_size)
+
+    def update_video_size(self, canvas_size_wh, width_multiplier=1.0):
+        """FfmsReader.update_video_size. With native_decode only the size
+        frames are scaled to when read is changed, cached native frames
+        are reused"""
+        self._set_output_size(
+            self.reader.fit_output_size(canvas_size_wh, width_multiplier)
+        )
+        self.view_size = (
+            max(int(canvas_size_wh[0] * width_multiplier), 1),
+            max(canvas_size_wh[1], 1),
+        )
+
+    def set_zoom(self, zoom: Optional[scaling.Zoom]):
+        """Show the region of interest of native frames magnified instead of
+        whole frames fitted to the canvas. Requires native_decode
+
+        Args:
+            zoom: zoom factor and center, None to fit whole frames
+        """
+        if zoom is not None and not self.options.native_decode:
+            raise ValueError("Zoom requires native_decode reader option")
+        self.zoom = zoom
+
+    def read_native(self, frame_idx):
+        """Frame at the native resolution of the video, as used for metrics.
+        Read-ahead is not changed
+
+        Args:
+            frame_idx: index of frame to read
+
+        Returns: frame
+        """
+        if self.options.native_decode:
+            return self._decode_native(frame_idx, None)[0]
+        output_size = self.reader.output_size
+        self.reader.set_output_size(self.reader.get_encoded_size())
+        try:
+            return self._decode_native(frame_idx, None)[0]
+        finally:
+            self.reader.set_output_size(output_size)
+
+    def _output_size(self) -> Tuple[int, int]:
+        return self.scaled_size or self.reader.output_size
+
+    def _set_output_size(self, size_wh: Tuple[int, int]):
+        if self.options.native_decode:
+            self.scaled_size = self.reader.valid_output_size(size_wh)
+        else:
+            self.reader.set_output_size(size_wh)
+
+    def _cache_key(self, frame_idx):
+        if self.zoom is not None:  # zoomed regions are cut from native frames
+            return frame_idx, self.reader.output_size
+        return frame_idx, self._output_size()
+
+    def _decode_cached(self, frame_idx, canvas_size_wh):
+        """Frame of the current output size (or zoomed region). With
+        native_decode, both the native frame and its scaled version are cached"""
+        key = self._cache_key(frame_idx)
+        result = self.cache.get(key)
+        if result is None:
+            result = self._decode_native(frame_idx, canvas_size_wh)
+            if key[1] != self.reader.output_size:
+                result = (scaling.resize_frame(result[0], key[1]), result[1])
+                self.cache.put(key, *result)
+        if self.zoom is not None and self.view_size is not None:
+            return scaling.zoom_frame(result[0], self.view_size, self.zoom), result[1]
+        return result
+
+    def _decode_native(self, frame_idx, canvas_size_wh):
+        """Frame of the decoder's output size, cached"""
+        native_key = (frame_idx, self.reader.output_size)
+        result = self.cache.get(native_key)
+        if result is None:
+            array, delta = self.reader.read_frame(frame_idx, canvas_size_wh)
+            if array.base is not None:  # decoder reuses its output buffer
+                array = array.copy()
+            result = (array, delta)
+            self.cache.put(native_key, *result)
+        return result
+
+    def _prefetch_step(self):
+        while self.prefetch_queue:
+            frame_idx, canvas_size_wh = self.prefetch_queue.pop(0)
+            if self._cache_key(frame_idx) not in self.cache:
+                self._decode_cached(frame_idx, canvas_size_wh)
+                return
 
     def work_cycle(self):
         """Enter working cycle, receiving queries in self.in_queue and sending output
-         in self.out_queue
+         in self.out_queue. Frames around the last requested one are decoded
+         into the cache while there are no queries
 
         Returns:
 
         """
         try:
-            reader = FfmsReader(self.video_path)
+            self.reader = FfmsReader(
+                self.video_path,
+                threads=self.options.decoder_threads or decoder_threads(2),
+                seek_mode=self.options.seek_mode,
+                pixel_format=self.options.pixel_format,
+            )
         except Exception as e:  # TODO catch our error
             self.out_queue.put((None, (self.video_path,), e))
             return
+        handlers = {
+            "read_frame": self.read_frame,
+            "read_preview": self.read_preview,
+            "read_native": self.read_native,
+            "update_video_size": self.update_video_size,
+            "set_zoom": self.set_zoom,
+        }
+        ring = FrameRing(self.options.ring_slots)
         while True:
-            query = self.in_queue.get(block=True)
+            try:
+                query = self.in_queue.get(block=not self.prefetch_queue)
+            except Empty:
+                try:
+                    self._prefetch_step()
+                except Exception:  # the frame will be reported when requested
+                    pass
+                continue
             cmd, args = query
+            if cmd == "_stop":
+                break
             try:
-                result = getattr(reader, cmd)(*args)
-                self.out_queue.put((cmd, args, result))
+                handler = handlers.get(cmd) or getattr(self.reader, cmd)
+                result = handler(*args)
+                self.out_queue.put((cmd, args, to_shared(result, ring)))
             except Exception as e:
                 self.out_queue.put((cmd, args, e))
+        ring.close()
 
 
 def spawn_async_reader(
-    video_path: Union[str, pathlib.Path], in_queue: Queue, out_queue: Queue
+    video_path: Union[str, pathlib.Path],
+    in_queue: Queue,
+    out_queue: Queue,
+    options: ReaderOptions = ReaderOptions(),
 ):
     """Stub function to be used from Process().start
 
@@ -173,11 +504,12 @@ def spawn_async_reader(
         video_path: Path to video to read
         in_queue: Input queue
         out_queue: Output queue
+        options: Reader process options
 
     Returns:
 
     """
-    reader = SingleReaderProxy(video_path, in_queue, out_queue)
+    reader = SingleReaderProxy(video_path, in_queue, out_queue, options)
     reader.work_cycle()
 
 
@@ -213,41 +545,74 @@ class ProcessWrapper:
             cleanup_on_sigterm()
         self.process.start()
 
-    def end(self):
-        self.process.terminate()
+    def end(self, timeout=1.0):
+        self.in_queue.put(("_stop", ()))
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
         self.in_queue.close()
         self.out_queue.close()
 
 
 class ProxyReaderPairWrapper:
+    # Seconds between frames whose native metrics are computed during playback
+    PLAYBACK_METRICS_INTERVAL = 0.25
+
     def __init__(
         self,
         video_path_1: Union[str, pathlib.Path, None],
         video_path_2: Union[str, pathlib.Path, None],
         in_queue: Queue,
         out_queue: Queue,
+        reader_options: ReaderOptions = ReaderOptions(),
+        pipeline_depth: int = 0,
     ):
         self.left_process = None
         self.right_process = None
+        # Every frame in flight needs its own slot in the rings
+        self.reader_options = reader_options._replace(
+            ring_slots=max(reader_options.ring_slots, pipeline_depth + 2)
+        )
+        self.left_identity = None
+        self.right_identity = None
 
         self.in_queue = in_queue
         self.out_queue = out_queue
+        self.frames = SharedFrameReader()
+        self.out_ring = FrameRing(self.reader_options.ring_slots)
+        self.pipeline = deque()  # playback frames sent to readers, not composed yet
+        self.native_metrics = NativeMetrics()
+        # Native metrics missing in the last composed frame: (pair key,
+        # frame indices, queries), computed when the readers are idle
+        self.metrics_request = None
+        # Command to repeat once its native metrics are computed:
+        # (pair key, cmd, args, combine)
+        self.recompose = None
+        self.metrics_started = 0.0  # time.monotonic() of the last computation
+        self.metrics_duration = 0.0  # seconds the last computation took
+        self.last_play = None  # time.monotonic() of the last play command
+        self.play_interval = 0.04  # running average of seconds between them
 
         self.reconfigure_paths(video_path_1, video_path_2, False)
 
         self.last_commands = {}
 
-    def _local_exec(self, cmd, args_1, args_2, combine):
+    def _send(self, cmd, args_1, args_2):
         for proc, arg in ((self.left_process, args_1), (self.right_process, args_2)):
             if proc is not None:
                 proc.execute(cmd, arg)
 
+    def _local_exec(self, cmd, args_1, args_2, combine):
+        self._send(cmd, args_1, args_2)
+        return self._collect(combine, (args_1, args_2))
+
+    def _collect(self, combine, args):
         outs = []
         has_errors = False
         for proc in (self.left_process, self.right_process):
             if proc is not None:
                 ans = proc.wait_for_execution()
-                outs.append(ans[2])
+                outs.append(from_shared(ans[2], self.frames))
                 if isinstance(ans[2], BaseException):
                     has_errors = True
             else:
@@ -255,8 +620,29 @@ class ProxyReaderPairWrapper:
         if combine is None or has_errors:
             return outs
         elif isinstance(combine, dict):
-            ans = compose.Composer(**combine).compose(*outs)
-            return ans
+            composer = compose.get_composer(
+                combine["compose_type"],
+                combine["font_config"],
+                combine["canvas_size_wh"],
+            )
+            metrics = combine["metrics"]
+            queries = combine.get("metric_queries", ())
+            indices = tuple(
+                None if out is None else arg[0] for arg, out in zip(args, outs)
+            )
+            if None not in indices:
+                # Metrics describe whole native frames, whatever size or zoomed
+                # region is displayed: the key is frame indices and file
+                # identities only. They are computed in background (see
+                # _metrics_step) and only taken from the cache here
+                pair_key = (indices, self.left_identity, self.right_identity)
+                missing = self.native_metrics.missing(metrics, queries, pair_key)
+                if missing:
+                    self.metrics_request = (pair_key, indices, missing)
+                metrics = self.native_metrics.fill_cached(metrics, queries, pair_key)
+            descriptor, out = self.out_ring.reserve(composer.output_shape(*outs))
+            _, delta = composer.compose(*outs, metrics=metrics, out=out)
+            return descriptor, delta
 
     def execute(self, cmd: str, args_1: Tuple, args_2: Tuple, combine: Callable):
         """Send command for execution to two video readers. Wait for result,
@@ -271,14 +657,156 @@ class ProxyReaderPairWrapper:
         Returns:
 
         """
+        self._flush_pipeline()
+        self.metrics_request = None
         try:
             ans = self._local_exec(cmd, args_1, args_2, combine)
+            if isinstance(combine, dict):
+                request = self.metrics_request
+                self._set_recompose(
+                    None
+                    if request is None
+                    else (request[0], cmd, (args_1, args_2), combine)
+                )
             self.out_queue.put((cmd, (args_1, args_2), ans))
         except Exception as e:
             self.out_queue.put((cmd, (args_1, args_2), [e, None]))
 
+    def _set_recompose(self, recompose):
+        """Remember the command to repeat when its metrics are computed,
+        telling the caller whether such command exists"""
+        if (recompose is None) != (self.recompose is None):
+            self.out_queue.put(("_metrics_pending", (), recompose is not None))
+        self.recompose = recompose
+
+    def _has_metrics_work(self) -> bool:
+        return self.metrics_request is not None or self.native_metrics.is_busy()
+
+    def _metrics_step(self):
+        """Recompose the frame whose native metrics have been computed, and
+        start computing the last requested ones"""
+        if self.native_metrics.is_busy():
+            for pair_key in self.native_metrics.finished():
+                self.metrics_duration = time.monotonic() - self.metrics_started
+                if self.recompose is not None and self.recompose[0] == pair_key:
+                    _, cmd, args, combine = self.recompose
+                    self.execute(cmd, *args, combine)
+            return
+        if self.metrics_request is not None:
+            self._start_metrics(self.metrics_request)
+            self.metrics_request = None
+
+    def _start_metrics(self, request):
+        """Start computing native metrics of the frame pair
+
+        Args:
+            request: (pair key, frame indices, queries)
+        """
+        pair_key, indices, queries = request
+        self.metrics_started = time.monotonic()
+        outs = self._local_exec("read_native", (indices[0],), (indices[1],), None)
+        if any(isinstance(out, BaseException) or out is None for out in outs):
+            if self.recompose is not None and self.recompose[0] == pair_key:
+                self._set_recompose(None)
+            return
+        # Frames are copied out of the rings, which the readers keep reusing
+        self.native_metrics.compute_in_background(
+            queries, pair_key, *(np.array(out) for out in outs)
+        )
+
+    def _sample_playback_metrics(self):
+        """During playback the readers are never idle: native metrics are
+        computed for some of the frames to be played, one pair at a time and
+        at most every PLAYBACK_METRICS_INTERVAL. The pair is chosen far
+        enough ahead to be computed before it is composed. Frames in between
+        show None"""
+        if self.native_metrics.is_busy():
+            self._metrics_step()  # collect the finished pair
+        if (
+            self.metrics_request is None
+            or not self.pipeline
+            or self.native_metrics.is_busy()
+            or time.monotonic() - self.metrics_started < self.PLAYBACK_METRICS_INTERVAL
+        ):
+            return
+        lead = len(self.pipeline) + math.ceil(
+            1.5 * self.metrics_duration / self.play_interval
+        )
+        indices = self._playback_target(lead)
+        queries = self.metrics_request[2]
+        self.metrics_request = None
+        pair_key = (indices, self.left_identity, self.right_identity)
+        # Readers answer in order: frames in flight are collected first
+        self._flush_pipeline()
+        self._start_metrics((pair_key, indices, queries))
+
+    def _playback_target(self, lead: int) -> tuple:
+        """Frame indices `lead` playback steps after the last requested pair"""
+        (_, *args), _ = self.pipeline[-1]
+        indices = []
+        for idx, *rest in args:
+            if idx is None or len(rest) < 3:
+                indices.append(idx)
+                continue
+            _, step, upcoming = rest
+            if len(upcoming) >= lead:
+                indices.append(upcoming[lead - 1])
+            else:
+                indices.append(idx + lead * step)
+        return tuple(indices)
+
+    def play(self, generation: int, args_1: Tuple, args_2: Tuple, combine: dict):
+        """Pipelined read_frame: request is sent to the readers at once, while
+        the previous playback frame is being composed. Answers are sent
+        to out_queue in order as "_play" results
+
+        Args:
+            generation: playback pipeline generation, returned as is
+            args_1: read_frame args for the first reader
+            args_2: read_frame args for the second reader
+            combine: Composer arguments
+
+        Returns:
+
+        """
+        self._set_recompose(None)
+        now = time.monotonic()
+        if self.last_play is not None:
+            self.play_interval += 0.1 * (now - self.last_play - self.play_interval)
+        self.last_play = now
+        self._send("read_frame", args_1, args_2)
+        self.pipeline.append(((generation, args_1, args_2), combine))
+        while len(self.pipeline) > 1:
+            self._finish_play()
+        self._sample_playback_metrics()
+
+    def _finish_play(self):
+        args, combine = self.pipeline.popleft()
+        try:
+            ans = self._collect(combine, args[1:])
+            self.out_queue.put(("_play", args, ans))
+        except Exception as e:
+            self.out_queue.put(("_play", args, [e, None]))
+
+    def _flush_pipeline(self):
+        """Finish pipelined frames, so that readers' answers are not mixed up"""
+        while self.pipeline:
+            self._finish_play()
+
+    def _spawn_reader(self, video_path: Union[str, pathlib.Path]) -> ProcessWrapper:
+        in_queue, out_queue = Queue(), Queue()
+        process = multiprocessing.Process(
+            target=spawn_async_reader,
+            args=(video_path, in_queue, out_queue, self.reader_options),
+        )
+        wrapper = ProcessWrapper(process, in_queue, out_queue)
+        wrapper.start()
+        return wrapper
+
     def reconfigure_paths(self, video_path_1, video_path_2, return_length=True):
-        """Create readers from scratch, optionally reporting their lengths
+        """Restart readers whose video has changed, optionally reporting
+        lengths of both readers. Reader of an unchanged video keeps running
+        with its position, output format and caches
 
         Args:
             video_path_1: Path to the left video
@@ -289,36 +817,39 @@ class ProxyReaderPairWrapper:
         Returns:
 
         """
-        if self.left_process is not None:
-            self.left_process.end()
-            self.left_process = None
-        if self.right_process is not None:
-            self.right_process.end()
-            self.right_process = None
-
-        if video_path_1 is not None:
-            q1, q2 = Queue(), Queue()
-            left_process = multiprocessing.Process(
-                target=spawn_async_reader, args=(video_path_1, q1, q2)
-            )
-            self.left_process = ProcessWrapper(left_process, q1, q2)
-            self.left_process.start()
-
-        if video_path_2 is not None:
-            q3, q4 = Queue(), Queue()
-            right_process = multiprocessing.Process(
-                target=spawn_async_reader, args=(video_path_2, q3, q4)
-            )
-            self.right_process = ProcessWrapper(right_process, q3, q4)
-            self.right_process.start()
+        old_identities = (self.left_identity, self.right_identity)
+        new_left = _file_identity(video_path_1)
+        if new_left != self.left_identity or self.left_process is None:
+            if self.left_process is not None:
+                self.left_process.end()
+                self.left_process = None
+            if video_path_1 is not None:
+                self.left_process = self._spawn_reader(video_path_1)
+            self.left_identity = new_left
+
+        new_right = _file_identity(video_path_2)
+        if new_right != self.right_identity or self.right_process is None:
+            if self.right_process is not None:
+                self.right_process.end()
+                self.right_process = None
+            if video_path_2 is not None:
+                self.right_process = self._spawn_reader(video_path_2)
+            self.right_identity = new_right
+
+        if (new_left, new_right) != old_identities:
+            self.native_metrics.clear()
+            self.metrics_request = None
+            self._set_recompose(None)
 
         status = self._local_exec("get_length", (), (), None)
         if isinstance(status[0], BaseException):
             self.left_process.end()
             self.left_process = None
+            self.left_identity = None
         if isinstance(status[1], BaseException):
             self.right_process.end()
             self.right_process = None
+            self.right_identity = None
         if return_length:
             self.out_queue.put(("get_length", ((), ()), status))
 
@@ -331,21 +862,24 @@ class ProxyReaderPairWrapper:
         """
         need_block = True
         while True:
+            metrics_work = self._has_metrics_work()
             try:
-                query = self.in_queue.get(block=need_block, timeout=1)
+                query = self.in_queue.get(
+                    block=need_block, timeout=0.05 if metrics_work else 1
+                )
             except Empty:
-                if need_block:
+                if need_block and not metrics_work:
                     if main_thread.is_alive():
                         continue
                     else:
                         break
-                if len(self.last_commands) > 0:
-                    last_items = list(self.last_commands.items())
-                    last_items.sort(key=lambda x: x[1][0], reverse=True)
-                    cmd, (priority, args, combine) = last_items[0]
-                    self.execute(cmd, args[0], args[1], combine)
-                    del self.last_commands[cmd]
-                if len(self.last_commands) == 0:
+                if self.pipeline:
+                    self._finish_play()
+                elif len(self.last_commands) > 0:
+                    self._execute_pending()
+                else:
+                    self._metrics_step()
+                if len(self.last_commands) == 0 and not self.pipeline:
                     need_block = True
                 continue
 
@@ -353,13 +887,49 @@ class ProxyReaderPairWrapper:
             cmd, args, flags, combine = query
             cmd: str
             flags: TaskExecuteFlags
-            if cmd == "_reconfigure":
+            if cmd == "_stop":
+                break
+            elif cmd == "_reconfigure":
+                self._flush_pipeline()
                 self.reconfigure_paths(*args)
+            elif cmd == "_play":
+                # Resizes (priority 1) apply to frames requested after them
+                self._execute_pending(min_priority=1)
+                self.play(*args, combine)
             else:
                 if flags.skip_to_last:
                     self.last_commands[cmd] = (flags.priority, args, combine)
                 else:
                     self.execute(cmd, args[0], args[1], combine)
+        self.close()
+
+    def _execute_pending(self, min_priority: Optional[int] = None):
+        """Execute the highest priority command skipped to the last, or all
+        of them with at least min_priority
+
+        Args:
+            min_priority: None to execute one command
+        """
+        last_items = list(self.last_commands.items())
+        last_items.sort(key=lambda x: x[1][0], reverse=True)
+        for cmd, (priority, args, combine) in last_items:
+            if min_priority is not None and priority < min_priority:
+                break
+            self.execute(cmd, args[0], args[1], combine)
+            del self.last_commands[cmd]
+            if min_priority is None:
+                break
+
+    def close(self):
+        """Stop both readers and release shared memory"""
+        for proc in (self.left_process, self.right_process):
+            if proc is not None:
+                proc.end()
+        self.left_process = None
+        self.right_process = None
+        self.pipeline.clear()
+        self.frames.close()
+        self.out_ring.close()
 
 
 def spawn_pairs_reader(
@@ -367,6 +937,8 @@ def spawn_pairs_reader(
     video_path_2: Union[str, pathlib.Path, None],
     in_queue: Queue,
     out_queue: Queue,
+    reader_options: ReaderOptions = ReaderOptions(),
+    pipeline_depth: int = 0,
 ):
     """Stub function to be used in Process()
 
@@ -375,20 +947,40 @@ def spawn_pairs_reader(
         video_path_2: Path to second video
         in_queue: Input queue
         out_queue: Output queue
+        reader_options: Options of both reader processes
+        pipeline_depth: Maximum number of playback frames in flight
 
     Returns:
 
     """
-    reader = ProxyReaderPairWrapper(video_path_1, video_path_2, in_queue, out_queue)
+    reader = ProxyReaderPairWrapper(
+        video_path_1, video_path_2, in_queue, out_queue, reader_options, pipeline_depth
+    )
     reader.work_cycle()
 
 
 class NonBlockingPairReader:
-    def __init__(self, composer_type: str):
+    KEYFRAME_ONLY_STEP = 4  # playback step from which keyframes are preferred
+    RESPONSE_TIMEOUT = 30.0  # seconds to wait for keyframes and sizes
+
+    def __init__(
+        self,
+        composer_type: str,
+        reader_options: ReaderOptions = ReaderOptions(),
+        pipeline_depth: int = 0,
+        frame_format: str = "image",
+    ):
         """
         Args:
             composer_type: "split", "sbs" or "chess" - what composer
                 type to use
+            reader_options: frame cache and read-ahead settings of the
+                reader processes
+            pipeline_depth: how many playback frames may be decoded and
+                composed ahead of the displayed one (0 disables pipelining)
+            frame_format: "image" to return frames as PIL images, "array"
+                for read-only RGB arrays made by display.ppm_frame, which
+                Tk reads without conversion
         """
         self.in_queue = Queue()
         self.out_queue = Queue()
@@ -403,8 +995,32 @@ class NonBlockingPairReader:
         self.composer_type = composer_type
         self.sample_text = "PSNR=34.57890123\nSSIM=0.99987123"
         self.font_config: compose.FontConfig = None
+        self.frames = SharedFrameReader()
+        self.pipeline_depth = pipeline_depth
+        self.read_ahead = reader_options.read_ahead
+        self.frame_format = frame_format
+        self.pipeline_generation = 0
+        self.pipeline_config = None
+        self.pipeline_requested = []
+        self.pipeline_results = {}
+        self.metrics_pending = False  # shown frame will be updated with metrics
+        self.playback_step = 1
+        self.left_keyframes: np.ndarray = None
+        self.right_keyframes: np.ndarray = None
+        self.filmstrips = [None, None]  # left and right, opened when built
+        self.filmstrip_builders = [None, None]
+        self.encoded_sizes = [None, None]  # native (width, height) of videos
+        self.zoom: Optional[scaling.Zoom] = None
         self.reader = multiprocessing.Process(
-            target=spawn_pairs_reader, args=(None, None, self.in_queue, self.out_queue)
+            target=spawn_pairs_reader,
+            args=(
+                None,
+                None,
+                self.in_queue,
+                self.out_queue,
+                reader_options,
+                pipeline_depth,
+            ),
         )
         self.metrics = []
 
@@ -418,16 +1034,26 @@ class NonBlockingPairReader:
 
     def create_left_reader(self, new_file: Union[str, pathlib.Path]):
         self.left_file = str(new_file)
-        self._recreate_readers()
+        self._recreate_readers(left_changed=True)
 
     def create_right_reader(self, new_file: Union[str, pathlib.Path]):
         self.right_file = str(new_file)
-        self._recreate_readers()
+        self._recreate_readers(right_changed=True)
 
     def _video_to_metrics_path(self, video_path: str):
         return pathlib.Path(video_path).with_suffix(".json")  # todo regexp
 
-    def _recreate_readers(self):
+    def _recreate_readers(self, left_changed=False, right_changed=False):
+        """Reopen readers. Only the changed sides are restarted in the backend,
+        positions and metrics of the other side are kept
+
+        Args:
+            left_changed: whether left video file has been changed
+            right_changed: whether right video file has been changed
+
+        Returns:
+
+        """
         if "get_length" in self.last_cmd_data:
             del self.last_cmd_data["get_length"]
         self._async_call(
@@ -436,9 +1062,8 @@ class NonBlockingPairReader:
             args=(self.left_file, self.right_file),
             combine=None,
         )
-        while "get_length" not in self.last_cmd_data:
-            self._read_all_responses(True, 5)
-        readers_lengths = self.last_cmd_data["get_length"][0]
+        # Indexing a long video takes a while, only a dead backend is an error
+        readers_lengths = self._wait_for_response("get_length", None)[0]
         if isinstance(readers_lengths[0], BaseException):
             left_file = self.left_file
             self.left_file = None
@@ -449,20 +1074,112 @@ class NonBlockingPairReader:
             self.right_file = None
             self.right_pos = None
             raise AttributeError(f"Error while opening {right_file}")
-        if readers_lengths[0] is not None:
-            self.left_pos = PlaybackPosition(readers_lengths[0])
-        else:
+        if readers_lengths[0] is None:
             self.left_pos = None
+        elif left_changed or self.left_pos is None:
+            self.left_pos = PlaybackPosition(readers_lengths[0])
 
-        if readers_lengths[1] is not None:
-            self.right_pos = PlaybackPosition(readers_lengths[1])
-        else:
+        if readers_lengths[1] is None:
             self.right_pos = None
+        elif right_changed or self.right_pos is None:
+            self.right_pos = PlaybackPosition(readers_lengths[1])
 
-        if self.left_file:
-            self.left_metrics.load(self._video_to_metrics_path(self.left_file))
-        if self.right_file:
-            self.right_metrics.load(self._video_to_metrics_path(self.right_file))
+        if left_changed or right_changed:
+            self._async_call(
+                "get_keyframes",
+                TaskExecuteFlags(skip_to_last=False, priority=0),
+                args=((), ()),
+                combine=None,
+            )
+            self._wait_for_response("get_keyframes", self.RESPONSE_TIMEOUT)
+            self.left_keyframes, self.right_keyframes = (
+                None if keyframes is None else np.array(keyframes)
+                for keyframes in self.last_cmd_data.pop("get_keyframes")[0]
+            )
+            self._async_call(
+                "get_encoded_size",
+                TaskExecuteFlags(skip_to_last=False, priority=0),
+                args=((), ()),
+                combine=None,
+            )
+            self._wait_for_response("get_encoded_size", self.RESPONSE_TIMEOUT)
+            self.encoded_sizes = self.last_cmd_data.pop("get_encoded_size")[0]
+            if self.zoom is not None:  # restarted reader is not zoomed yet
+                self._send_zoom()
+
+        if left_changed:
+            self._start_filmstrip_builder(0, self.left_file)
+        if right_changed:
+            self._start_filmstrip_builder(1, self.right_file)
+
+        if self.left_file and left_changed:
+            self.left_metrics.load(
+                self._video_to_metrics_path(self.left_file), background=True
+            )
+        if self.right_file and right_changed:
+            self.right_metrics.load(
+                self._video_to_metrics_path(self.right_file), background=True
+            )
+
+    def _start_filmstrip_builder(self, side: int, video_path: Optional[str]):
+        builder = self.filmstrip_builders[side]
+        if builder is not None and builder.is_alive():
+            builder.terminate()
+        self.filmstrips[side] = None
+        self.filmstrip_builders[side] = None
+        if video_path is not None:
+            builder = multiprocessing.Process(
+                target=build_filmstrip_in_background, args=(video_path,), daemon=True
+            )
+            builder.start()
+            self.filmstrip_builders[side] = builder
+
+    def thumbnail_preview(self, left_idx, right_idx) -> Optional[np.ndarray]:
+        """Frames composed from filmstrip thumbnails, instantly available
+
+        Args:
+            left_idx: left frame number
+            right_idx: right frame number
+
+        Returns: small composed frame or None if thumbnails are not built yet
+        """
+        thumbnails = []
+        for side, (video_path, pos, idx) in enumerate(
+            (
+                (self.left_file, self.left_pos, left_idx),
+                (self.right_file, self.right_pos, right_idx),
+            )
+        ):
+            if pos is None:
+                thumbnails.append(None)
+                continue
+            if self.filmstrips[side] is None:
+                self.filmstrips[side] = Filmstrip.open(video_path, pos.get_length())
+                if self.filmstrips[side] is None:
+                    return None
+            thumbnail = self.filmstrips[side].get(idx)
+            if thumbnail is None:
+                return None
+            thumbnails.append(thumbnail)
+        if all(thumbnail is None for thumbnail in thumbnails):
+            return None
+        return compose.compose_functions[self.composer_type](*thumbnails)
+
+    def _materialize(self, result):
+        """Copy composed frame out of the backend's shared memory ring
+        (it will be overwritten by the following frames)"""
+        result = from_shared(result, self.frames)
+        if isinstance(result, tuple) and isinstance(result[0], np.ndarray):
+            # RGB arrays are always copied by PIL and ppm_frame
+            if self.frame_format == "array":
+                return (ppm_frame(result[0]),) + result[1:]
+            return (Image.fromarray(result[0]),) + result[1:]
+        return result
+
+    def _to_frame_format(self, image: Image.Image):
+        if self.frame_format == "array":
+            return ppm_frame(np.asarray(image))
+        return image
 
     def _read_all_responses(self, wait_for_first=False, first_timeout=0.5):
         while True:
@@ -471,9 +1188,33 @@ class NonBlockingPairReader:
                     block=wait_for_first, timeout=first_timeout
                 )
                 wait_for_first = False
-                self.last_cmd_data[cmd] = (result, args)
             except Empty:
                 break
+            if cmd == "_play":
+                if args in self.pipeline_requested:  # not reset or dropped
+                    self.pipeline_results[args] = self._materialize(result)
+            elif cmd == "_metrics_pending":
+                self.metrics_pending = result
+            else:
+                self.last_cmd_data[cmd] = (self._materialize(result), args)
+
+    def _wait_for_response(self, cmd: str, timeout: Optional[float]):
+        """Read responses until the one to cmd arrives
+
+        Args:
+            cmd: command sent to the backend
+            timeout: seconds to wait, None to wait while the backend is alive
+
+        Returns: (result, args) of the command
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while cmd not in self.last_cmd_data:
+            if not self.reader.is_alive() or (
+                deadline is not None and time.monotonic() > deadline
+            ):
+                raise AttributeError(f"Wait for {cmd} failed")
+            self._read_all_responses(True, 1)
+        return self.last_cmd_data[cmd]
 
     def _async_call(self, cmd, flags, args, combine):
         self.last_input[cmd] = args
@@ -493,11 +1234,13 @@ class NonBlockingPairReader:
 
     def has_no_tasks(self) -> bool:
         """Checks whether backend has any unfinished tasks
-        (i.e. frame decoding or resize).
+        (i.e. frame decoding or resize, or computing metrics of the shown frame).
 
         Returns:
             True if backend has unfinished tasks
         """
+        if self.metrics_pending:
+            return False
         for key in self.last_cmd_data:
             if (
                 key in self.last_input
@@ -525,12 +1268,7 @@ class NonBlockingPairReader:
             "read_frame",
             TaskExecuteFlags(skip_to_last=True, priority=0),
             ((left_idx, canvas_size_wh), (right_idx, canvas_size_wh)),
-            {
-                "compose_type": self.composer_type,
-                "canvas_size_wh": canvas_size_wh,
-                "font_config": self.font_config,
-                "metrics": self.get_metrics(left_idx, right_idx),
-            },
+            self._compose_args(left_idx, right_idx, canvas_size_wh),
         )
         self._read_all_responses(False)
         if "read_frame" not in self.last_cmd_data:
@@ -542,6 +1280,215 @@ class NonBlockingPairReader:
             raise AttributeError("Wait for the first frame failed several times")
         return self.last_cmd_data["read_frame"][0]
 
+    def _compose_args(self, left_idx, right_idx, canvas_size_wh):
+        return {
+            "compose_type": self.composer_type,
+            "canvas_size_wh": canvas_size_wh,
+            "font_config": self.font_config,
+            "metrics": self.get_metrics(left_idx, right_idx),
+            "metric_queries": [query for _, query in self.metrics],
+        }
+
+    def set_playback_step(self, step: int):
+        """Set playback speed
+
+        Args:
+            step: frames to advance per displayed frame, negative for
+                reverse playback
+        """
+        if step != self.playback_step:
+            self.playback_step = step
+            self.reset_pipeline()
+
+    def _step_positions(self, left_idx, right_idx):
+        """Positions after one playback step. Both videos move by the same
+        number of frames, limited so that both stay within their videos.
+        At speeds of KEYFRAME_ONLY_STEP and higher, the left video moves to
+        the keyframe closest to the target if it is less than a step away,
+        so that such frames are decoded without the frames preceding them.
+        Sparse keyframes don't change the speed"""
+        delta = self.playback_step
+        if (
+            abs(delta) >= self.KEYFRAME_ONLY_STEP
+            and left_idx is not None
+            and self.left_keyframes is not None
+        ):
+            target = _nearby_keyframe(self.left_keyframes, left_idx + delta, abs(delta))
+            delta = target - left_idx
+        for idx, pos in ((left_idx, self.left_pos), (right_idx, self.right_pos)):
+            if idx is not None:
+                delta = _clamp(delta, -idx, pos.length - 1 - idx)
+        return tuple(
+            None if idx is None else idx + delta for idx in (left_idx, right_idx)
+        )
+
+    def _playback_indices(self, shift: int):
+        """Frame indices of both videos `shift` playback steps ahead"""
+        return self._playback_path(shift)[-1]
+
+    def _playback_path(self, steps: int):
+        """Frame indices of both videos after 0, 1, ..., `steps` playback steps"""
+        path = [
+            tuple(
+                None if pos is None else pos.get_playback_frame_position()
+                for pos in (self.left_pos, self.right_pos)
+            )
+        ]
+        for _ in range(steps):
+            path.append(self._step_positions(*path[-1]))
+        return path
+
+    def can_advance(self) -> bool:
+        """Whether playback step moves videos (the end is not reached)"""
+        return self._playback_indices(1) != self._playback_indices(0)
+
+    def advance_playback(self, steps: int = 1):
+        """Move both videos by playback steps"""
+        for pos, idx in zip(
+            (self.left_pos, self.right_pos), self._playback_indices(steps)
+        ):
+            if pos is not None:
+                pos.set_playback_frame_position(idx)
+
+    def drop_playback_frames(self, count: int):
+        """Skip playback steps without showing their frames. Frames requested
+        ahead for these steps are dropped, the following ones stay in flight
+
+        Args:
+            count: playback steps to skip
+        """
+        if count <= 0:
+            return
+        for key in self.pipeline_requested[:count]:
+            self.pipeline_results.pop(key, None)
+        del self.pipeline_requested[:count]
+        self.advance_playback(count)
+
+    def _playback_args(self, shift: int, canvas_size_wh):
+        """read_frame args of the frame `shift` playback steps after the current one.
+        Faster playback also tells the readers which frames follow, so that
+        they are prefetched"""
+        upcoming = self.read_ahead if abs(self.playback_step) > 1 else 0
+        path = self._playback_path(shift + upcoming)
+        args = []
+        for side, idx in enumerate(path[shift]):
+            if idx is None:
+                args.append((None, canvas_size_wh))
+                continue
+            following = dict.fromkeys(indices[side] for indices in path[shift + 1 :])
+            following.pop(idx, None)  # the end of the video is reached
+            args.append((idx, canvas_size_wh, self.playback_step, tuple(following)))
+        return tuple(args)
+
+    def reset_pipeline(self):
+        """Forget about frames requested ahead (they are ignored when arrive)"""
+        self.pipeline_generation += 1
+        self.pipeline_requested = []
+        self.pipeline_results = {}
+
+    def _fill_pipeline(self, canvas_size_wh):
+        while len(self.pipeline_requested) < self.pipeline_depth:
+            args_1, args_2 = self._playback_args(
+                len(self.pipeline_requested), canvas_size_wh
+            )
+            key = (self.pipeline_generation, args_1, args_2)
+            if key in self.pipeline_requested:  # end of the video is reached
+                break
+            self.pipeline_requested.append(key)
+            self.in_queue.put(
+                (
+                    "_play",
+                    key,
+                    TaskExecuteFlags(skip_to_last=False, priority=0),
+                    self._compose_args(args_1[0], args_2[0], canvas_size_wh),
+                )
+            )
+
+    def _read_pipelined_frame(self, canvas_size_wh):
+        """Returns current frame from the playback pipeline,
+        keeping up to pipeline_depth next frames in flight"""
+        config = (
+            self.composer_type,
+            canvas_size_wh,
+            tuple(label for label, _ in self.metrics),
+            self.zoom,
+        )
+        current_args = self._playback_args(0, canvas_size_wh)
+        if (
+            config != self.pipeline_config
+            or not self.pipeline_requested
+            or self.pipeline_requested[0][1:] != current_args
+        ):
+            self.reset_pipeline()
+            self.pipeline_config = config
+        self._fill_pipeline(canvas_size_wh)
+        key = self.pipeline_requested[0]
+        self._read_all_responses(False)
+        for i in range(5):
+            if key in self.pipeline_results:
+                break
+            self._read_all_responses(True)
+        else:
+            raise AttributeError("Wait for the frame failed several times")
+        self.pipeline_requested.pop(0)
+        result = self.pipeline_results.pop(key)
+        self.last_input["read_frame"] = current_args
+        self.last_cmd_data["read_frame"] = (result, current_args)
+        return result
+
+    def read_preview(self, canvas_size_wh, scale=0.5):
+        """Queues a cheap approximation of the current frame for decoding:
+        the keyframe at or before the position of each video (decoded
+        without the frames preceding it) at a fraction of the output size,
+        without metrics. Used while the timeline is dragged. Never blocks
+
+        Args:
+            canvas_size_wh: size of the canvas of the main window
+            scale: fraction of the output size
+
+        Returns:
+            Pair of the latest decoded preview image (upscaled to the usual
+            frame size) and timestamp difference, or None if none is ready
+        """
+        if self.zoom is not None:  # magnified region is small already
+            scale = 1.0
+        args = []
+        for pos, keyframes in (
+            (self.left_pos, self.left_keyframes),
+            (self.right_pos, self.right_keyframes),
+        ):
+            if pos is None:
+                args.append((None, canvas_size_wh, scale))
+                continue
+            idx = pos.get_playback_frame_position()
+            if keyframes is not None and len(keyframes) > 0:
+                i = np.searchsorted(keyframes, idx, side="right")
+                idx = int(keyframes[max(i - 1, 0)])
+            args.append((idx, canvas_size_wh, scale))
+        args = tuple(args)
+        if self.last_input.get("read_preview") != args:
+            combine = dict(
+                self._compose_args(None, None, canvas_size_wh),
+                metrics=[],
+                metric_queries=[],
+            )
+            self._async_call(
+                "read_preview",
+                TaskExecuteFlags(skip_to_last=True, priority=0),
+                args,
+                combine,
+            )
+        self._read_all_responses(False)
+        if "read_preview" not in self.last_cmd_data:
+            return None
+        image, delta = self.last_cmd_data["read_preview"][0]
+        if not isinstance(image, (Image.Image, np.ndarray)):  # decoding error
+            return None
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        size = (int(image.width / scale), int(image.height / scale))
+        return self._to_frame_format(image.resize(size, Image.BILINEAR)), delta
+
     def _is_last_index_valid(self):
         last_index = self.last_input["read_frame"]
         return last_index == (
@@ -562,15 +1509,33 @@ class NonBlockingPairReader:
         Returns:
             Pair of image and timestamp difference to the next frame
         """
-        if (
+        if update_frame_idx and self.pipeline_depth > 0:
+            array, this_frame_delta = self._read_pipelined_frame(canvas_size_wh)
+            self.advance_playback()
+            self._fill_pipeline(canvas_size_wh)
+        elif (
             update_frame_idx
             or "read_frame" not in self.last_cmd_data
             or not self._is_last_index_valid()
         ):
             array, this_frame_delta = self.read_current_frame(canvas_size_wh)
             if update_frame_idx:
-                self.left_pos.shift_playback_frame_position(1)
-                self.right_pos.shift_playback_frame_position(1)
+                self.advance_playback()
+            elif (
+                self.last_cmd_data["read_frame"][1] != self.last_input["read_frame"]
+                and self.zoom is None
+            ):
+                # Exact frame is still decoding, show upscaled thumbnails
+                placeholder = self.thumbnail_preview(*self._playback_indices(0))
+                if placeholder is not None:
+                    size = (
+                        (array.shape[1], array.shape[0])
+                        if isinstance(array, np.ndarray)
+                        else array.size
+                    )
+                    array = self._to_frame_format(
+                        Image.fromarray(placeholder).resize(size, Image.BILINEAR)
+                    )
         else:
             array, this_frame_delta = self.repeat_last_frame()
 
@@ -594,6 +1559,46 @@ class NonBlockingPairReader:
             None,
         )
 
+    def set_zoom(self, zoom: Optional[scaling.Zoom]):
+        """Show the same region of interest of both videos magnified.
+        Requires ReaderOptions.native_decode
+
+        Args:
+            zoom: zoom factor and center relative to frame size (so that
+                videos of different resolution show the same region), None
+                to fit whole frames to the canvas. Metrics in the overlay
+                still describe whole frames
+        """
+        if zoom == self.zoom:
+            return
+        self.zoom = zoom
+        self.reset_pipeline()
+        self.last_input["read_frame"] = None  # drop cache
+        self._send_zoom()
+
+    def _send_zoom(self):
+        # Not skipped to the last call: frames requested afterwards are zoomed
+        self._async_call(
+            "set_zoom",
+            TaskExecuteFlags(skip_to_last=False, priority=1),
+            ((self.zoom,), (self.zoom,)),
+            None,
+        )
+
+    def pan(self, delta_xy: Tuple[float, float], canvas_size_wh: Tuple[int, int]):
+        """Move the zoomed region of both videos
+
+        Args:
+            delta_xy: shift in canvas pixels
+            canvas_size_wh: Size of the canvas of the main window
+        """
+        frame_wh = self.encoded_sizes[0] or self.encoded_sizes[1]
+        if self.zoom is None or frame_wh is None:
+            return
+        width_multiplier = 0.5 if self.composer_type == "sbs" else 1.0
+        view_wh = (int(canvas_size_wh[0] * width_multiplier), canvas_size_wh[1])
+        self.set_zoom(scaling.pan(self.zoom, frame_wh, view_wh, delta_xy))
+
     def repeat_last_frame(self) -> Tuple[Image.Image, float]:
         """Function to return latest decoded frame one more time
 
@@ -607,16 +1612,23 @@ class NonBlockingPairReader:
         self._read_all_responses(False)
         return self.last_cmd_data["read_frame"][0]
 
-    def close(self):
+    def close(self, timeout=2.0):
         self.left_file = None
         self.right_file = None
-        self.reader.terminate()
+        for side in (0, 1):
+            self._start_filmstrip_builder(side, None)
+        if self.reader.is_alive():
+            self.in_queue.put(("_stop", None, None, None))
+            self.reader.join(timeout)
+        if self.reader.is_alive():
+            self.reader.terminate()
+        self.frames.close()
 
     def __enter__(self):
         return self
 
     def __exit__(self, *exc):
-        self.reader.terminate()
+        self.close()
         return False
 
     def get_metrics(self, left_idx: int, right_idx: int):
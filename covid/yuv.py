@@ -0,0 +1,129 @@
+"""Planar YUV 4:2:0 frames.
+
+An I420 frame of height h and width w (both even) is stored as a single
+(h * 3 // 2, w) uint8 array: h rows of Y followed by the U and V planes,
+each (h // 2, w // 2) laid out contiguously. It is half the size of the same
+frame in RGB, and its Y plane is available for metrics without conversion.
+"""
+
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+Frame = np.ndarray
+
+BLACK = (16, 128, 128)  # limited range Y, U, V
+
+
+def is_i420(frame: Optional[Frame]) -> bool:
+    return frame is not None and frame.ndim == 2
+
+
+def frame_size(frame: Frame) -> Tuple[int, int]:
+    """(height, width) of an RGB or I420 frame"""
+    if is_i420(frame):
+        return frame.shape[0] * 2 // 3, frame.shape[1]
+    return frame.shape[:2]
+
+
+def split_i420(frame: Frame) -> Tuple[Frame, Frame, Frame]:
+    """Y, U and V planes of an I420 frame (views, no copy)"""
+    h, w = frame_size(frame)
+    flat = frame.reshape(-1)
+    quarter = (h // 2) * (w // 2)
+    y = flat[: h * w].reshape(h, w)
+    u = flat[h * w : h * w + quarter].reshape(h // 2, w // 2)
+    v = flat[h * w + quarter : h * w + 2 * quarter].reshape(h // 2, w // 2)
+    return y, u, v
+
+
+def pack_i420(y: Frame, u: Frame, v: Frame, out: Frame = None) -> Frame:
+    """Pack planes (possibly strided views) into a single I420 array
+
+    Args:
+        y: (h, w) luma plane
+        u: (h // 2, w // 2) chroma plane
+        v: (h // 2, w // 2) chroma plane
+        out: preallocated (h * 3 // 2, w) array
+
+    Returns: I420 frame
+    """
+    h, w = y.shape
+    if out is None:
+        out = np.empty((h * 3 // 2, w), dtype=np.uint8)
+    for dst, src in zip(split_i420(out), (y, u, v)):
+        dst[...] = src
+    return out
+
+
+def black_i420(h: int, w: int) -> Frame:
+    frame = np.empty((h * 3 // 2, w), dtype=np.uint8)
+    for plane, value in zip(split_i420(frame), BLACK):
+        plane[...] = value
+    return frame
+
+
+def i420_to_rgb(frame: Frame, out: Frame = None) -> Frame:
+    """BT.601 limited range YUV to RGB conversion
+
+    Args:
+        frame: I420 frame
+        out: preallocated (h, w, 3) uint8 array
+
+    Returns: RGB frame
+    """
+    y, u, v = split_i420(frame)
+    h, w = y.shape
+    if out is None:
+        out = np.empty((h, w, 3), dtype=np.uint8)
+    # Pairs of luma rows share a row of chroma samples, which is widened
+    # to the luma width: contiguous broadcasting is much faster than 2x2 one
+    c = np.multiply(y, 298, dtype=np.int32).reshape(h // 2, 2, w)
+    d = u.astype(np.int32) - 128
+    e = v.astype(np.int32) - 128
+    tmp = np.empty_like(c)
+    for channel, term in enumerate((409 * e, -100 * d - 208 * e, 516 * d)):
+        term += 128 - 16 * 298
+        np.add(c, np.repeat(term, 2, axis=1)[:, None, :], out=tmp)
+        tmp >>= 8
+        np.clip(tmp, 0, 255, out=tmp)
+        out[..., channel] = tmp.reshape(h, w)
+    return out
+
+
+def compose_i420(
+    compose_func: Callable,
+    left_frame: Optional[Frame],
+    right_frame: Optional[Frame],
+    out: Frame,
+    scratch: Frame,
+    plane_options: Optional[Callable[[int, int], Tuple[dict, dict]]] = None,
+) -> Frame:
+    """Compose I420 frames plane by plane, then convert the result to RGB
+
+    Args:
+        compose_func: one of compose.compose_functions
+        left_frame: I420 frame or None
+        right_frame: I420 frame or None
+        out: (h, w, 3) RGB output of the size compose_func produces
+        scratch: (h * 3 // 2, w) array for the composed I420 frame
+        plane_options: function of the luma (h, w) returning keyword
+            arguments of compose_func for the Y plane and for the chroma
+            planes (see compose.i420_plane_options)
+
+    Returns: out
+    """
+    sizes = [frame_size(f) for f in (left_frame, right_frame) if f is not None]
+    h = min(size[0] for size in sizes) // 2 * 2
+    w = min(size[1] for size in sizes) // 2 * 2
+    frames = [
+        black_i420(h, w) if frame is None else frame
+        for frame in (left_frame, right_frame)
+    ]
+    luma_options, chroma_options = plane_options(h, w) if plane_options else ({}, {})
+    for i, out_plane in enumerate(split_i420(scratch)):
+        ph, pw = (h, w) if i == 0 else (h // 2, w // 2)
+        left_plane, right_plane = (split_i420(f)[i][:ph, :pw, None] for f in frames)
+        options = luma_options if i == 0 else chroma_options
+        compose_func(left_plane, right_plane, out=out_plane[:, :, None], **options)
+    return i420_to_rgb(scratch, out)
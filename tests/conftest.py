@@ -0,0 +1,25 @@
+import pytest
+
+
+class FakeTimer:
+    """Monotonic clock moved by tests: timer.now += seconds"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def timer():
+    return FakeTimer()
+
+
+@pytest.fixture(autouse=True)
+def user_cache(tmp_path, monkeypatch):
+    """Default caches (indexes, filmstrips, metrics sidecars) are kept in
+    the test's temporary directory instead of the user's ~/.cache"""
+    cache_home = tmp_path / "user_cache"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(cache_home))
+    return cache_home
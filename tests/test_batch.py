@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from covid import batch
+from covid.metrics import MAX_PSNR, VQMTMetrics
+
+
+class FakeReader:
+    """FfmsReader of synthetic videos: "ref" and "same" have identical
+    frames, "noisy" differs from them, "empty" has no frames"""
+
+    enc_width, enc_height = 32, 24
+
+    def __init__(self, video_path, threads=0):
+        self.name = str(video_path).rsplit("/", 1)[-1].split(".")[0]
+        if self.name == "broken":
+            raise OSError("invalid data")
+        self.output_size = (self.enc_width, self.enc_height)
+
+    def get_length(self):
+        return 0 if self.name == "empty" else 12
+
+    def update_video_size(self, canvas_size_wh, width_multiplier=1.0):
+        self.output_size = canvas_size_wh
+
+    def read_frame(self, frame_idx, canvas_size_wh):
+        frame = np.full((self.enc_height, self.enc_width, 3), 100 + frame_idx)
+        if self.name == "noisy":
+            noise = np.random.default_rng(frame_idx).integers(-9, 10, frame.shape)
+            frame = frame + noise
+        return frame.astype(np.uint8), 40.0
+
+
+@pytest.fixture
+def fake_videos(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "FfmsReader", FakeReader)
+    monkeypatch.setattr(batch, "ProcessPoolExecutor", ThreadPoolExecutor)
+    return tmp_path
+
+
+def test_frame_range_metrics(fake_videos):
+    values = batch.frame_range_metrics("ref.mp4", "same.mp4", 2, 5)
+    assert values.shape == (3, 2)
+    assert (values[:, 0] == MAX_PSNR).all() and np.allclose(values[:, 1], 1)
+    with ThreadPoolExecutor(2) as executor:
+        values = batch.compute_metrics("ref.mp4", "noisy.mp4", executor, 2)
+    assert values.shape == (12, 2) and (values[:, 0] < 40).all()
+
+
+def test_main(fake_videos, capsys):
+    ref, same, noisy = (str(fake_videos / name) for name in ("ref", "same", "noisy"))
+    assert batch.main([ref + ".mp4", same + ".mp4", noisy + ".mp4", "-j", "2"]) == 0
+    metrics = VQMTMetrics()
+    metrics.load(noisy + ".json")
+    assert len(metrics.values) == 12
+    assert metrics.query(11, [VQMTMetrics.PSNR_Y])[0] < 40
+
+    assert batch.main([ref + ".mp4", noisy + ".mp4"]) == 1
+    assert "use --overwrite" in capsys.readouterr().err
+    assert batch.main([ref + ".mp4", noisy + ".mp4", "--overwrite"]) == 0
+
+
+def test_main_errors(fake_videos, capsys):
+    ref, empty = (str(fake_videos / name) + ".mp4" for name in ("ref", "empty"))
+    assert batch.main([ref, empty]) == 1
+    assert "no frames to compare" in capsys.readouterr().err
+    assert not (fake_videos / "empty.json").exists()
+
+    assert batch.main([str(fake_videos / "broken.mp4"), ref]) == 1
+    assert "Can't open" in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        batch.main([ref])  # no videos to compare
@@ -0,0 +1,89 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+from covid import compose
+
+
+def test_composer_cache():
+    font_config = compose.FontConfig((320, 240), "PSNR=34.57890123")
+    composer = compose.get_composer("split", font_config, (320, 240))
+    assert compose.get_composer("split", font_config, (320, 240)) is composer
+    assert compose.get_composer("chess", font_config, (320, 240)) is not composer
+
+    frame = (np.zeros((240, 320, 3), dtype=np.uint8), 40.0)
+    image, delta = composer.compose(frame, frame, [("PSNR, Y", (30.0, None))])
+    assert image.shape == (240, 320, 3) and delta == 40.0
+    assert image.max() > 0  # text is drawn
+    assert composer.format_text() == "PSNR, Y: 30.000 vs. None"
+
+
+def test_fit_font_size():
+    text = "PSNR=34.57890123\nSSIM=0.99987123"
+    font_config = compose.FontConfig((640, 480), text)
+    size = font_config.optimal_font_size
+    assert 1 < size < 100
+
+    def text_wh(font_size):
+        return compose.text_size(compose.load_font(font_config.font, font_size), text)
+
+    w, h = text_wh(size)
+    assert w <= 640 * 0.75 and h <= 480 * 0.5
+    w, h = text_wh(size + 1)
+    assert w > 640 * 0.75 or h > 480 * 0.5
+    assert compose.FontConfig((4000, 4000), text).optimal_font_size == 100
+
+
+def test_chess_pattern():
+    left = np.full((8, 12, 3), 255, dtype=np.uint8)
+    right = np.zeros((8, 12, 3), dtype=np.uint8)
+    out = np.empty_like(left)
+    frame = compose.compose_chess_pattern(left, right, cell_size=0.25, out=out)
+    assert frame is out
+    unit = np.kron([[1, 0], [0, 1]], np.ones((2, 2), dtype=int))
+    expected = np.tile(unit, (2, 3))[:, :, np.newaxis] * 255
+    assert np.array_equal(frame, np.broadcast_to(expected, frame.shape))
+
+
+def test_compose_into_buffer():
+    left = np.full((6, 8, 3), 200, dtype=np.uint8)
+    right = np.full((6, 8, 3), 100, dtype=np.uint8)
+
+    out = np.empty((6, 16, 3), dtype=np.uint8)
+    assert compose.compose_side_by_side(left, right, out=out) is out
+    assert (out[:, :8] == 200).all() and (out[:, 8:] == 100).all()
+    assert (compose.compose_side_by_side(left, None)[:, 8:] == 0).all()
+
+    out = np.empty_like(left)
+    assert compose.compose_vertical_split(left, right, out=out) is out
+    assert (out[:, :4] == 200).all() and (out[:, 4:] == 100).all()
+
+    font_config = compose.FontConfig((16, 6), "x")
+    composer = compose.Composer("sbs", font_config)
+    assert composer.output_shape((left, 40.0), None) == (6, 16, 3)
+    frame, _ = composer.compose((left, 40.0), None)
+    assert frame is composer.compose((left, 40.0), None)[0]  # buffer is reused
+
+
+def test_text_sprite():
+    font_config = compose.FontConfig((320, 240), "PSNR=34.57890123")
+    args = ("PSNR: 34.5\nSSIM: 0.99", font_config.font, 20, (255, 255, 0), "left")
+    sprite = compose.text_sprite(*args)
+    assert compose.text_sprite(*args) is sprite
+
+    font = compose.load_font(font_config.font, 20)
+    w, h = compose.text_size(font, args[0])
+    frame = np.random.randint(0, 256, (h + 10, w + 10, 3), dtype=np.uint8)
+    expected = Image.fromarray(frame)
+    ImageDraw.Draw(expected).multiline_text((5, 5), args[0], font=font, fill=args[3])
+    compose.blend_sprite(frame[5 : 5 + h, 5 : 5 + w], sprite)
+    # Glyphs are placed at whole pixels, PIL may shift some of them by kerning
+    assert (frame != np.asarray(expected)).any(axis=2).mean() < 0.02
+
+    # New values are assembled from the glyphs rendered already
+    misses = compose._piece_mask.cache_info().misses
+    compose.text_sprite("PSNR: 43.5\nSSIM: 0.9", *args[1:])
+    assert compose._piece_mask.cache_info().misses == misses
+
+    partial = np.zeros((h // 2, w // 2, 3), dtype=np.uint8)  # sprite is cropped
+    compose.blend_sprite(partial, sprite)
+    assert partial.max() > 0
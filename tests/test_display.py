@@ -0,0 +1,19 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from covid import display
+
+
+def test_ppm_frame():
+    frame = np.random.randint(0, 256, (6, 10, 3), dtype=np.uint8)
+    ppm = display.ppm_frame(frame)
+    assert (ppm == frame).all() and not ppm.flags.writeable
+
+    data = display.ppm_data(ppm)
+    assert display.ppm_data(ppm) is data
+    assert (np.asarray(Image.open(io.BytesIO(data))) == frame).all()
+
+    flipped = display.ppm_data(ppm[::-1])  # not the memory of the PPM data
+    assert (np.asarray(Image.open(io.BytesIO(flipped))) == frame[::-1]).all()
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+from PIL import Image
+
+from covid import export
+from covid.metrics import VQMTMetrics
+
+
+def _job(output_path, compose_type="sbs"):
+    return export.ExportJob(
+        left_path="samples/foreman_crf30_short.mp4",
+        right_path="samples/foreman_crf40_short.mp4",
+        offset=2,
+        compose_type=compose_type,
+        metrics=[("PSNR, Y", VQMTMetrics.PSNR_Y)],
+        metrics_paths=(
+            "samples/foreman_crf30_short.json",
+            "samples/foreman_crf40_short.json",
+        ),
+        sample_text="PSNR=34.57890123",
+        start=0,
+        stop=5,
+        output_path=str(output_path),
+    )
+
+
+def test_composed_frames(tmp_path):
+    frames = [f.copy() for f in export.composed_frames(_job(tmp_path / "out.mp4"))]
+    assert len(frames) == 5
+    assert frames[0].shape == (288, 2 * 352, 3)
+
+
+@pytest.mark.skipif(not export.ffmpeg_available(), reason="ffmpeg is not installed")
+def test_video_export(tmp_path):
+    background_export = export.BackgroundExport(
+        export.run_video_export, _job(tmp_path / "out.mp4", "split")
+    )
+    while background_export.poll() is None:
+        background_export.process.join(0.1)
+    assert background_export.result[0] == "done"
+    assert background_export.done == background_export.total == 5
+    assert os.path.getsize(tmp_path / "out.mp4") > 0
+
+
+def test_gif_export(tmp_path):
+    output_path = tmp_path / "out.gif"
+    job = _job(output_path)._replace(max_size_wh=(320, 320))
+    background_export = export.BackgroundExport(export.run_gif_export, job)
+    while background_export.poll() is None:
+        background_export.process.join(0.1)
+    assert background_export.result[0] == "done"
+    with Image.open(output_path) as gif:
+        assert gif.n_frames == 5
+        assert max(gif.size) <= 320
@@ -0,0 +1,27 @@
+import numpy as np
+
+from covid.frame_cache import FrameCache, read_ahead_order
+
+
+def test_frame_cache():
+    frame = np.zeros((10, 10, 3), dtype=np.uint8)
+    cache = FrameCache(budget_bytes=frame.nbytes * 2)
+    cache.put((0, (10, 10)), frame, 0.04)
+    cache.put((1, (10, 10)), frame.copy(), 0.04)
+    assert cache.get((0, (10, 10)))[0] is frame
+    cache.put((2, (10, 10)), frame.copy(), 0.04)
+    assert (1, (10, 10)) not in cache  # least recently used
+    assert (0, (10, 10)) in cache and len(cache) == 2
+    assert cache.size == frame.nbytes * 2
+
+
+def test_read_ahead_order():
+    assert read_ahead_order(5, 100, 3, 2) == [6, 7, 8, 4, 3]
+    assert read_ahead_order(0, 100, 2, 2) == [1, 2]
+    assert read_ahead_order(98, 100, 3, 1) == [99, 97]
+    assert read_ahead_order(5, 100, 3, 2, step=-1) == [2, 3, 4]
+    # Reverse playback: the next chunk is requested when the previous one runs dry
+    assert read_ahead_order(10, 100, 4, 1, -1, {7, 8, 9}.__contains__) == []
+    assert read_ahead_order(10, 100, 4, 1, -1, {9}.__contains__) == [5, 6, 7, 8]
+    assert read_ahead_order(2, 100, 4, 1, -1, set().__contains__) == [0, 1]
+    assert read_ahead_order(5, 100, 3, 2, step=8) == []
@@ -0,0 +1,26 @@
+import os
+
+from covid.index_cache import IndexCache, default_index_cache
+
+
+def test_index_cache(tmp_path):
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"0" * 16)
+    cache = IndexCache(tmp_path / "cache", max_size_bytes=100)
+
+    assert cache.lookup(video) is None
+    stored = cache.store(video, lambda name: open(name, "wb").write(b"1" * 60))
+    assert cache.lookup(video) == stored
+
+    key = cache.key(video)
+    os.utime(video, ns=(0, 0))
+    assert cache.key(video) != key
+    assert cache.lookup(video) is None
+
+    cache.store(video, lambda name: open(name, "wb").write(b"2" * 60))
+    assert not stored.exists()  # least recently used index is evicted
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+
+def test_default_index_cache(user_cache):
+    assert default_index_cache.cache_dir == user_cache / "covid" / "indexes"
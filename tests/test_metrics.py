@@ -0,0 +1,130 @@
+import json
+
+import numpy as np
+
+from covid.metrics import (
+    MAX_PSNR,
+    VQMTMetrics,
+    NativeMetrics,
+    sidecar_path,
+    psnr,
+    ssim,
+    write_vqmt_json,
+)
+
+
+def _write_vqmt(path, n_frames):
+    head = {
+        "metrics": [
+            {"col": 0, "metric_name": "psnr", "color_component": "Y"},
+            {"col": 1, "metric_name": "ssim", "color_component": "Y"},
+        ]
+    }
+    values = [{"frame": i, "data": [30.0 + i, None]} for i in range(n_frames)]
+    path.write_text(json.dumps({"head": head, "values": values}))
+
+
+def test_vqmt_query(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    path = tmp_path / "video.json"
+    _write_vqmt(path, 4)
+    metrics = VQMTMetrics()
+    assert metrics.query(0, [VQMTMetrics.PSNR_Y]) == [None]
+    metrics.load(path)
+
+    requested = [VQMTMetrics.PSNR_Y, VQMTMetrics.SSIM_Y, VQMTMetrics.VMAF061_Y]
+    assert metrics.query(2, requested) == [32.0, None, None]
+    assert metrics.query(10, requested) == [None, None, None]
+
+    values = metrics.query_range(2, 6, requested)
+    assert values.shape == (4, 3)
+    assert np.array_equal(values[:2, 0], [32.0, 33.0])
+    assert np.isnan(values[2:]).all() and np.isnan(values[:, 1:]).all()
+
+    metrics.load(tmp_path / "missing.json")
+    assert metrics.query(0, requested) == [None, None, None]
+
+
+def test_vqmt_sidecar(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    path = tmp_path / "video.json"
+    _write_vqmt(path, 3)
+    metrics = VQMTMetrics()
+    metrics.load(path, background=True)
+    metrics.wait()
+    assert sidecar_path(path).exists()
+    assert sidecar_path(path).parent == tmp_path / "cache" / "covid" / "metrics"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["cache", "video.json"]
+    assert metrics.query(1, [VQMTMetrics.PSNR_Y]) == [31.0]
+
+    path.write_text("not a json anymore")  # sidecar can't be reused
+    metrics.load(path)
+    assert metrics.query(1, [VQMTMetrics.PSNR_Y]) == [None]
+
+    _write_vqmt(path, 5)
+    metrics.load(path)
+    assert metrics.query(4, [VQMTMetrics.PSNR_Y]) == [34.0]
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(path))  # sidecar can't be written
+    _write_vqmt(path, 6)
+    metrics.load(path, background=True)
+    metrics.wait()
+    assert metrics.query(5, [VQMTMetrics.PSNR_Y]) == [35.0]
+
+
+def _reference_ssim(a, b, window):
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    values = []
+    for y in range(a.shape[0] - window + 1):
+        for x in range(a.shape[1] - window + 1):
+            pa = a[y : y + window, x : x + window].astype(np.float64)
+            pb = b[y : y + window, x : x + window].astype(np.float64)
+            cov = ((pa - pa.mean()) * (pb - pb.mean())).mean()
+            values.append(
+                (2 * pa.mean() * pb.mean() + c1)
+                * (2 * cov + c2)
+                / ((pa.mean() ** 2 + pb.mean() ** 2 + c1) * (pa.var() + pb.var() + c2))
+            )
+    return np.mean(values)
+
+
+def test_native_metrics():
+    rng = np.random.default_rng(0)
+    a = rng.integers(0, 256, (20, 24)).astype(np.float32)
+    b = np.clip(a + rng.normal(0, 5, a.shape), 0, 255).astype(np.float32)
+    assert psnr(a, a) == MAX_PSNR  # as VQMT reports identical frames
+    assert 30 < psnr(a, b) < 40
+    assert ssim(a, a) == 1.0
+    assert abs(ssim(a, b, 8) - _reference_ssim(a, b, 8)) < 1e-9
+
+    left = np.repeat(a[:, :, np.newaxis], 3, axis=2).astype(np.uint8)
+    right = np.repeat(b[:, :, np.newaxis], 3, axis=2).astype(np.uint8)
+    native = NativeMetrics()
+    metrics = [("PSNR, Y", (None, None)), ("VMAF", (None, None))]
+    queries = [VQMTMetrics.PSNR_Y, VQMTMetrics.VMAF061_Y]
+    filled = native.fill(metrics, queries, (0, 0), left, right)
+    assert filled[0][1][0] is None and 30 < filled[0][1][1] < 40
+    assert filled[1] == ("VMAF", (None, None))
+    assert native.fill(metrics, queries, (0, 0), left, None) == metrics
+
+    # Interactive use: cached values only, the rest is computed in background
+    native = NativeMetrics()
+    assert native.missing(metrics, queries, (1, 1)) == [VQMTMetrics.PSNR_Y]
+    assert native.fill_cached(metrics, queries, (1, 1)) == metrics
+    native.compute_in_background([VQMTMetrics.PSNR_Y], (1, 1), left, right)
+    native._worker.join()
+    assert native.is_busy()  # until the pair is reported
+    assert native.finished() == [(1, 1)] and not native.is_busy()
+    assert native.missing(metrics, queries, (1, 1)) == []
+    assert native.fill_cached(metrics, queries, (1, 1)) == filled
+
+
+def test_write_vqmt_json(tmp_path):
+    path = tmp_path / "video.json"
+    values = np.array([[40.0, 0.99], [np.nan, 0.98]])
+    write_vqmt_json(path, [VQMTMetrics.PSNR_Y, VQMTMetrics.SSIM_Y], values)
+    metrics = VQMTMetrics()
+    metrics.load(path)
+    requested = [VQMTMetrics.SSIM_Y, VQMTMetrics.PSNR_Y]
+    assert metrics.query(0, requested) == [0.99, 40.0]
+    assert metrics.query(1, requested) == [0.98, None]
@@ -0,0 +1,22 @@
+import pytest
+
+from covid.playback import PlaybackClock
+
+
+def test_playback_clock(timer):
+    clock = PlaybackClock(late_threshold_ms=5, timer=timer)
+    assert not clock.is_running()
+    clock.start()
+    clock.present(20)
+    assert clock.time_to_next_frame() == 20
+
+    timer.now += 0.01  # early wake up: keep showing the current frame
+    assert clock.time_to_next_frame() == pytest.approx(10)
+    assert clock.frames_to_drop(20) == 0
+
+    timer.now += 0.065  # 55 ms late: two frames are skipped
+    assert clock.frames_to_drop(20) == 2
+    clock.drop(2, 20)
+    assert clock.time_to_next_frame() == pytest.approx(-15)
+    clock.present(20)
+    assert (clock.presented, clock.dropped, clock.late) == (2, 2, 1)
@@ -1,8 +1,24 @@
+import queue
+import threading
+import time
+
 import PIL
+import ffms2
 import numpy as np
 
+from covid import display, scaling, yuv
 from covid.metrics import VQMTMetrics
-from covid.video_reader import PlaybackPosition, FfmsReader, NonBlockingPairReader
+from covid.playback import PlaybackClock
+from covid.video_reader import (
+    PlaybackPosition,
+    FfmsReader,
+    NonBlockingPairReader,
+    ProxyReaderPairWrapper,
+    ReaderOptions,
+    SingleReaderProxy,
+    decoder_threads,
+)
+from covid.shared_frames import SharedFrameReader, from_shared
 
 
 def test_playback():
@@ -29,6 +45,119 @@ def test_video_reader():
     assert max(reader.read_frame(0, None)[0].shape) == 600
 
 
+def test_frame_delta_drives_clock(timer):
+    reader = FfmsReader("samples/foreman_crf30_short.mp4")
+    clock = PlaybackClock(timer=timer)
+    for frame_idx in (0, reader.get_length() - 1):  # the last one has no PTS delta
+        delta = reader.read_frame(frame_idx, None)[1]
+        assert 1000 / 61 < delta < 1000 / 23  # milliseconds
+        clock.start()
+        clock.present(delta)
+        timer.now += 2.5 * delta / 1000  # a frame and a half late
+        assert clock.frames_to_drop(delta) == 1
+
+
+def test_decoder_options():
+    assert 1 <= decoder_threads(2) <= decoder_threads(1)
+    reader = FfmsReader(
+        "samples/foreman_crf30_short.mp4", threads=1, seek_mode=ffms2.FFMS_SEEK_LINEAR
+    )
+    assert reader.read_frame(100, None)[0].shape == (288, 352, 3)
+
+
+def test_yuv_reader():
+    reader = FfmsReader("samples/foreman_crf30_short.mp4", pixel_format="yuv420p")
+    frame = reader.read_frame(0, None)[0]
+    assert frame.shape == (288 * 3 // 2, 352)
+    assert yuv.i420_to_rgb(frame).shape == (288, 352, 3)
+
+
+def test_native_decode():
+    proxy = SingleReaderProxy(
+        "samples/foreman_crf30_short.mp4",
+        None,
+        None,
+        ReaderOptions(read_ahead=0, read_behind=0, native_decode=True),
+    )
+    proxy.reader = FfmsReader("samples/foreman_crf30_short.mp4")
+    proxy.update_video_size((200, 200))
+    assert proxy.read_frame(0, (200, 200))[0].shape == (163, 200, 3)
+    proxy.update_video_size((400, 200), 0.5)  # side-by-side
+    assert proxy.read_frame(0, (400, 200))[0].shape == (163, 200, 3)
+    proxy.update_video_size((600, 600))
+    assert proxy.read_frame(0, (600, 600))[0].shape == (490, 600, 3)
+    # Decoder is never reconfigured, the native frame is decoded once
+    assert proxy.reader.output_size == (352, 288)
+    assert len(proxy.cache) == 3
+
+    proxy.set_zoom(scaling.Zoom(4))  # 150x150 region of the native frame
+    assert proxy.read_frame(0, (600, 600))[0].shape == (600, 600, 3)
+    assert len(proxy.cache) == 3
+    assert proxy.read_native(0).shape == (288, 352, 3)  # for metrics, cached
+    assert len(proxy.cache) == 3
+
+
+def _run_proxy(options, commands):
+    """Send commands to SingleReaderProxy.work_cycle the way the pair reader
+    does, returning copies of the results"""
+    in_queue, out_queue = queue.Queue(), queue.Queue()
+    proxy = SingleReaderProxy(
+        "samples/foreman_crf30_short.mp4", in_queue, out_queue, options
+    )
+    worker = threading.Thread(target=proxy.work_cycle)
+    worker.start()
+    frames = SharedFrameReader()
+    results = []
+    try:
+        for cmd, args in commands:
+            in_queue.put((cmd, args))
+            _, _, result = out_queue.get(timeout=30)
+            result = from_shared(result, frames)
+            if isinstance(result, BaseException):
+                raise result
+            if isinstance(result, tuple):  # the ring slot is reused
+                result = tuple(np.array(item) for item in result)
+            results.append(result)
+    finally:
+        in_queue.put(("_stop", ()))
+        worker.join()
+        frames.close()
+    return results
+
+
+def test_proxy_commands():
+    results = _run_proxy(
+        ReaderOptions(read_ahead=0, read_behind=0),
+        [
+            ("update_video_size", ((200, 200),)),
+            ("read_frame", (0, (200, 200))),
+            ("read_preview", (0, (200, 200), 0.5)),
+            ("get_length", ()),
+        ],
+    )
+    assert results[1][0].shape == (163, 200, 3)
+    assert results[2][0].shape == (81, 100, 3)
+    assert results[3] == 210
+
+
+def test_proxy_zoom():
+    results = _run_proxy(
+        ReaderOptions(read_ahead=0, read_behind=0, native_decode=True),
+        [
+            ("update_video_size", ((600, 600),)),
+            ("set_zoom", (scaling.Zoom(4),)),
+            ("read_frame", (0, (600, 600))),
+            ("set_zoom", (scaling.Zoom(1),)),
+            ("read_frame", (0, (600, 600))),
+            ("set_zoom", (None,)),
+            ("read_frame", (0, (600, 600))),
+        ],
+    )
+    assert results[2][0].shape == (600, 600, 3)  # 150x150 native pixels
+    assert results[4][0].shape == (288, 352, 3)  # 1:1, the whole frame fits
+    assert results[6][0].shape == (490, 600, 3)
+
+
 def test_threaded():
     with NonBlockingPairReader("sbs") as main_thread:
         main_thread.create_left_reader("samples/foreman_crf30_short.mp4")
@@ -52,11 +181,136 @@ def test_threaded():
         assert (frame[:, int(frame.shape[1] * 0.8) :, :]).max() > 0.01
 
         main_thread.metrics = [("PSNR, Y", VQMTMetrics.PSNR_Y)]
+        main_thread.left_metrics.wait()
+        main_thread.right_metrics.wait()
         metrics = main_thread.get_metrics(0, 0)[0][1]
         assert 13 < metrics[0] < metrics[1] < 14
         assert main_thread.has_no_tasks()
     # main_thread.close()
 
 
+def test_incremental_reconfigure():
+    with NonBlockingPairReader("split") as main_thread:
+        main_thread.create_left_reader("samples/foreman_crf30_short.mp4")
+        main_thread.left_pos.set_playback_frame_position(5)
+        main_thread.create_right_reader("samples/foreman_crf40_short.mp4")
+        assert main_thread.left_pos.get_playback_frame_position() == 5
+        assert main_thread.right_pos.get_playback_frame_position() == 0
+        main_thread.create_right_reader("samples/foreman_crf30_short.mp4")
+        assert main_thread.left_pos.get_playback_frame_position() == 5
+
+
+def test_array_frames():
+    with NonBlockingPairReader(
+        "sbs", ReaderOptions(native_decode=True), frame_format="array"
+    ) as main_thread:
+        main_thread.create_left_reader("samples/foreman_crf30_short.mp4")
+        main_thread.create_right_reader("samples/foreman_crf40_short.mp4")
+        main_thread.update_video_size((704, 288))
+        frame, _ = main_thread.get_next_frame(False, (704, 288))
+        assert frame.shape == (288, 704, 3) and not frame.flags.writeable
+        assert display.ppm_data(frame) is display.ppm_data(frame)  # not copied
+
+
+def test_pipelined_playback():
+    with NonBlockingPairReader("split", pipeline_depth=2) as main_thread:
+        main_thread.create_left_reader("samples/foreman_crf30_short.mp4")
+        main_thread.create_right_reader("samples/foreman_crf40_short.mp4")
+        main_thread.update_video_size((400, 400))
+        for i in range(5):
+            frame, delta = main_thread.get_next_frame(True, (400, 400))
+            assert isinstance(frame, PIL.Image.Image)
+            assert delta > 0
+        assert main_thread.left_pos.get_playback_frame_position() == 5
+        assert len(main_thread.pipeline_requested) == 2
+
+        generation = main_thread.pipeline_generation
+        main_thread.drop_playback_frames(1)  # late playback skips a frame
+        main_thread.get_next_frame(True, (400, 400))
+        assert main_thread.left_pos.get_playback_frame_position() == 7
+        assert main_thread.pipeline_generation == generation
+
+        main_thread.left_pos.set_playback_frame_position(100)  # seek resets pipeline
+        main_thread.get_next_frame(True, (400, 400))
+        assert main_thread.pipeline_requested[0][1][0] == 101
+
+        main_thread.update_video_size((200, 200))  # applied to the next frame
+        frame, _ = main_thread.get_next_frame(True, (200, 200))
+        assert max(frame.size) == 200
+
+
+def test_playback_speed():
+    with NonBlockingPairReader("split", pipeline_depth=2) as main_thread:
+        main_thread.create_left_reader("samples/foreman_crf30_short.mp4")
+        main_thread.create_right_reader("samples/foreman_crf40_short.mp4")
+        main_thread.right_pos.set_playback_frame_position(3)
+        main_thread.set_playback_step(2)
+        main_thread.get_next_frame(True, (400, 400))
+        assert main_thread.left_pos.get_playback_frame_position() == 2
+        assert main_thread.right_pos.get_playback_frame_position() == 5
+
+        main_thread.set_playback_step(-1)
+        main_thread.get_next_frame(True, (400, 400))
+        main_thread.get_next_frame(True, (400, 400))
+        assert main_thread.left_pos.get_playback_frame_position() == 0
+        assert not main_thread.can_advance()
+
+        main_thread.set_playback_step(8)
+        main_thread.left_keyframes = np.array([0, 100])  # long GOP
+        path = [left for left, _ in main_thread._playback_path(14)]
+        assert path == [0, 8, 16, 24, 32, 40, 48, 56, 64, 72, 80, 88, 100, 108, 116]
+        main_thread.advance_playback()
+        assert main_thread._playback_args(0, (400, 400))[0][3][0] == 16
+        assert main_thread.right_pos.get_playback_frame_position() == 11
+
+        main_thread.set_playback_step(-8)
+        main_thread.left_pos.set_playback_frame_position(108)
+        main_thread.right_pos.set_playback_frame_position(111)
+        path = [left for left, _ in main_thread._playback_path(3)]
+        assert path == [108, 100, 92, 84]
+
+
+def test_playback_metrics_target():
+    wrapper = ProxyReaderPairWrapper(None, None, queue.Queue(), queue.Queue())
+    try:
+        wrapper.pipeline.append(((0, (10, None, 1, (11, 12)), (None, None)), {}))
+        assert wrapper._playback_target(2) == (12, None)
+        assert wrapper._playback_target(5) == (15, None)
+        wrapper.pipeline.append(((0, (40, None, -4, ()), (43, None, -4, ())), {}))
+        assert wrapper._playback_target(3) == (28, 31)
+    finally:
+        wrapper.close()
+
+
+def test_scrubbing_preview():
+    with NonBlockingPairReader("split") as main_thread:
+        main_thread.create_left_reader("samples/foreman_crf30_short.mp4")
+        main_thread.create_right_reader("samples/foreman_crf40_short.mp4")
+        main_thread.update_video_size((400, 400))
+        full_frame, _ = main_thread.get_next_frame(False, (400, 400))
+        main_thread.left_pos.set_playback_frame_position(150)
+        main_thread.right_pos.set_playback_frame_position(150)
+        preview = None
+        for i in range(50):
+            preview = main_thread.read_preview((400, 400), scale=0.5)
+            if preview is not None:
+                break
+            time.sleep(0.1)
+        assert abs(preview[0].width - full_frame.width) <= 1
+        left_idx = main_thread.last_input["read_preview"][0][0]
+        assert left_idx <= 150 and left_idx in main_thread.left_keyframes
+
+
+def test_thumbnail_preview(user_cache):
+    with NonBlockingPairReader("sbs") as main_thread:
+        main_thread.create_left_reader("samples/foreman_crf30_short.mp4")
+        main_thread.create_right_reader("samples/foreman_crf40_short.mp4")
+        for builder in main_thread.filmstrip_builders:
+            builder.join(30)
+        preview = main_thread.thumbnail_preview(100, 100)
+        assert preview.shape == (72, 2 * 88, 3)
+    assert len(list((user_cache / "covid" / "thumbnails").iterdir())) == 2
+
+
 if __name__ == "__main__":
     test_threaded()
@@ -0,0 +1,40 @@
+import numpy as np
+
+from covid import scaling, yuv
+
+
+def test_fit_size():
+    assert scaling.fit_size((352, 288), (600, 600)) == (600, 490)
+    assert scaling.fit_size((352, 288), (600, 600), 0.5) == (300, 245)
+    assert scaling.fit_size((352, 288), (0, 0)) == (1, 1)
+
+
+def test_resize_frame():
+    frame = np.full((288, 352, 3), 200, dtype=np.uint8)
+    assert scaling.resize_frame(frame, (352, 288)) is frame
+    resized = scaling.resize_frame(frame, (176, 144))
+    assert resized.shape == (144, 176, 3) and (resized == 200).all()
+
+    i420 = yuv.black_i420(288, 352)
+    resized = scaling.resize_frame(i420, (176, 144))
+    assert resized.shape == (216, 176)
+    assert [plane.mean() for plane in yuv.split_i420(resized)] == list(yuv.BLACK)
+
+
+def test_zoom():
+    frame = np.arange(1080 * 1920 * 3, dtype=np.uint32).astype(np.uint8)
+    frame = frame.reshape(1080, 1920, 3)
+    view = (400, 300)
+    zoom = scaling.Zoom(1)
+    assert scaling.zoom_region((1920, 1080), view, zoom) == (760, 390, 400, 300)
+    region = scaling.zoom_frame(frame, view, zoom)
+    assert region.shape == (300, 400, 3) and np.shares_memory(region, frame)
+
+    zoom = scaling.pan(zoom._replace(factor=4), (1920, 1080), view, (-4000, 40))
+    assert scaling.zoom_region((1920, 1080), view, zoom) == (0, 512, 100, 75)
+    region = scaling.zoom_frame(frame, view, zoom)
+    assert region.shape == (300, 400, 3)
+    assert (region[:4, :4] == frame[512, 0]).all()
+
+    i420 = yuv.black_i420(1080, 1920)
+    assert scaling.zoom_frame(i420, view, zoom).shape == (450, 400)
@@ -0,0 +1,49 @@
+import subprocess
+import sys
+
+import numpy as np
+
+from covid.shared_frames import FrameRing, SharedFrameReader, to_shared, from_shared
+
+
+def test_shared_frames():
+    ring = FrameRing(slots=2)
+    reader = SharedFrameReader()
+    frame = np.arange(4 * 5 * 3, dtype=np.uint8).reshape(4, 5, 3)
+
+    result = to_shared((frame, 40.0), ring)
+    view, delta = from_shared(result, reader)
+    assert delta == 40.0
+    assert np.array_equal(view, frame)
+    assert not view.flags.writeable
+
+    bigger = np.ones((8, 10, 3), dtype=np.uint8)
+    ring.put(bigger)
+    descriptor = ring.put(bigger)  # wraps around and grows the first slot
+    assert descriptor.name != result[0].name
+    assert np.array_equal(reader.get(descriptor), bigger)
+    assert result[0].name not in reader.attached  # replaced, not kept mapped
+
+    del view
+    reader.close()
+    ring.close()
+
+
+def test_shared_frames_resource_tracker():
+    # Attaching must leave the owner's registration alone: the tracker is shared
+    # here, and it reports a KeyError when the owner unlinks an unknown segment
+    script = (
+        "import numpy as np\n"
+        "from covid.shared_frames import FrameRing, SharedFrameReader\n"
+        "ring = FrameRing(slots=1)\n"
+        "reader = SharedFrameReader()\n"
+        "reader.get(ring.put(np.zeros((2, 2, 3), np.uint8)))\n"
+        "reader.close()\n"
+        "ring.close()\n"
+    )
+    process = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, timeout=60
+    )
+    assert process.returncode == 0
+    assert "Traceback" not in process.stderr
+    assert "leaked" not in process.stderr
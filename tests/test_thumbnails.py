@@ -0,0 +1,49 @@
+import numpy as np
+
+from covid.thumbnails import (
+    Filmstrip,
+    ThumbnailCache,
+    build_filmstrip,
+    default_thumbnail_cache,
+)
+
+
+class FakeReader:
+    enc_width, enc_height = 64, 32
+
+    def __init__(self):
+        self.output_size = (self.enc_width, self.enc_height)
+        self.decoded = []
+
+    def get_length(self):
+        return 5000
+
+    def set_output_size(self, size_wh):
+        self.output_size = size_wh
+
+    def read_frame(self, frame_idx, canvas_size_wh):
+        self.decoded.append(frame_idx)
+        w, h = self.output_size
+        return np.full((h, w, 3), frame_idx % 256, dtype=np.uint8), 40.0
+
+
+def test_filmstrip(tmp_path):
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"0")
+    cache = ThumbnailCache(tmp_path / "cache")
+    assert Filmstrip.open(video, 5000, cache) is None
+
+    reader = FakeReader()
+    build_filmstrip(reader, video, cache, height=8)
+    assert reader.decoded[:3] == [0, 3, 6] and len(reader.decoded) == 1667
+    filmstrip = Filmstrip.open(video, 5000, cache)
+    assert filmstrip.get(7).shape == (8, 16, 3)
+    assert filmstrip.get(7)[0, 0, 0] == 6
+
+    reader = FakeReader()
+    build_filmstrip(reader, video, cache, height=8)
+    assert reader.decoded == []  # already built
+
+
+def test_default_thumbnail_cache(user_cache):
+    assert default_thumbnail_cache.cache_dir == user_cache / "covid" / "thumbnails"
@@ -0,0 +1,53 @@
+import numpy as np
+
+from covid import compose, yuv
+from covid.metrics import luma
+
+
+def rgb_to_i420(rgb):
+    """Reference BT.601 limited range conversion with 2x2 chroma averaging"""
+    r, g, b = (rgb[..., i].astype(np.float64) for i in range(3))
+    y = 16 + (65.738 * r + 129.057 * g + 25.064 * b) / 256
+    u = 128 + (-37.945 * r - 74.494 * g + 112.439 * b) / 256
+    v = 128 + (112.439 * r - 94.154 * g - 18.285 * b) / 256
+    h, w = y.shape
+    u, v = (p.reshape(h // 2, 2, w // 2, 2).mean(axis=(1, 3)) for p in (u, v))
+    return yuv.pack_i420(
+        *(np.round(p).clip(0, 255).astype(np.uint8) for p in (y, u, v))
+    )
+
+
+def test_i420_to_rgb():
+    # Constant 2x2 blocks survive chroma subsampling
+    blocks = np.random.randint(0, 256, (18, 22, 3), dtype=np.uint8)
+    rgb = blocks.repeat(2, axis=0).repeat(2, axis=1)
+    frame = rgb_to_i420(rgb)
+    assert frame.shape == (54, 44) and yuv.frame_size(frame) == (36, 44)
+    assert np.abs(yuv.i420_to_rgb(frame).astype(int) - rgb).max() <= 2
+    assert luma(frame).shape == (36, 44)
+
+
+def test_compose_i420():
+    left = yuv.black_i420(16, 20)
+    right = rgb_to_i420(np.full((16, 20, 3), 255, dtype=np.uint8))
+    font_config = compose.FontConfig((40, 16), "0")
+    for compose_type, shape in (("split", (16, 20, 3)), ("sbs", (16, 40, 3))):
+        composer = compose.Composer(compose_type, font_config)
+        frame, _ = composer.compose((left, 40.0), (right, 40.0))
+        assert frame.shape == shape
+        assert frame[:, 0].max() == 0 and frame[:, -1].min() == 255
+    frame, _ = composer.compose(None, (right, 40.0))
+    assert frame[:, 0].max() == 0
+
+
+def test_compose_i420_odd_layout():
+    # Chess cell of int(398 * 0.25) = 99 rows and split at column 199
+    red = rgb_to_i420(np.full((398, 398, 3), (255, 0, 0), dtype=np.uint8))
+    blue = rgb_to_i420(np.full((398, 398, 3), (0, 0, 255), dtype=np.uint8))
+    font_config = compose.FontConfig((398, 398), "0")
+    for compose_type in ("chess", "split"):
+        composer = compose.Composer(compose_type, font_config)
+        frame, _ = composer.compose((red, 40.0), (blue, 40.0))
+        is_red = np.abs(frame.astype(int) - (255, 0, 0)).max(axis=2) <= 3
+        is_blue = np.abs(frame.astype(int) - (0, 0, 255)).max(axis=2) <= 3
+        assert (is_red | is_blue).all()  # no colour bleed at boundaries